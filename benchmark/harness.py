@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""离线基准：用本地替身服务器驱动各监控脚本的获取和解析流程。
+
+    python3 harness.py                                   # 所有脚本，10 / 100 / 1000 个商品
+    python3 harness.py --monitors root --items 100 1000 --cycles 5 --error-rate 0.02 --flap-period 20
+
+每个（脚本，商品数）组合在独立的子进程中运行，分别统计单个商品检查耗时的分位数、
+每轮检查耗时、CPU 时间和峰值 RSS；通知和状态保存不在测量范围内。
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import server as stand_in
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 名称 -> 脚本路径（相对仓库根目录）
+MONITORS = {
+    'root': 'monitor.py',  # cfscrape + 条件请求
+    'playwright': os.path.join('monitor', 'monitor.py'),  # 常驻浏览器池
+    'playwright-fast': os.path.join('monitor', 'monitor.py'),  # 常驻浏览器池，快速渲染
+    'bwh': os.path.join('bwh', 'monitor.py'),  # Playwright，每次检查新建 context
+    'engine-http': os.path.join('monitor', 'engine.py'),  # 统一引擎，cfscrape 后端
+    'engine-browser': os.path.join('monitor', 'engine.py'),  # 统一引擎，Playwright 后端（不模拟人类操作）
+    'engine-auto': os.path.join('monitor', 'engine.py'),  # 统一引擎，分层抓取（普通 HTTP → cfscrape → Playwright）
+    'engine-groups': os.path.join('monitor', 'engine.py'),  # 统一引擎，cfscrape 后端，购物车商品从 WHMCS 分组页读取
+}
+
+OUT_OF_STOCK_TEXT = 'Out of Stock'
+
+
+def build_items(count, base_urls):
+    """生成 count 个商品，轮流分配到各主机：70% WHMCS 购物车、20% ClawCloud 促销页、10% Cloudflare 验证页。"""
+    items = []
+    for index in range(count):
+        base_url = base_urls[index % len(base_urls)]
+        kind = index % 10
+        if kind == 9:
+            check_url, expected_title = f"{base_url}/challenge/{index}", 'Shopping Cart'
+        elif kind >= 7:
+            check_url, expected_title = f"{base_url}/store/promotion/plan-{index}-flash", 'CLAWCLOUD'
+        else:
+            check_url, expected_title = f"{base_url}/cart.php?a=add&pid={index}", 'Shopping Cart'
+        items.append({'title': f"item-{index}", 'check_url': check_url, 'expected_title': expected_title})
+    return items
+
+
+def load_monitor(name):
+    """以独立模块名加载监控脚本；脚本所在目录加入 sys.path 以便导入同目录模块。"""
+    path = os.path.join(REPO_DIR, MONITORS[name])
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(f"{name}_monitor", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values, fraction):
+    """最近秩法分位数。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def classify(result):
+    if result is None:
+        return 'skipped'
+    return 'in_stock' if result else 'out_of_stock'
+
+
+class Recorder:
+    """记录每个商品检查的耗时、结果，以及每轮的墙钟和 CPU 时间。"""
+
+    def __init__(self):
+        self.latencies = []
+        self.outcomes = {'in_stock': 0, 'out_of_stock': 0, 'skipped': 0}
+        self.cycles = []
+
+    async def timed(self, coro):
+        start = time.perf_counter()
+        result = None
+        try:
+            result = await coro
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+            self.outcomes[classify(result)] += 1
+
+    async def cycle(self, coros):
+        wall, cpu = time.perf_counter(), time.process_time()
+        await asyncio.gather(*(self.timed(coro) for coro in coros))
+        self.cycles.append({'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu})
+
+
+async def run_root(module, items, cycles, recorder):
+    engine = module.FetchEngine()
+    single_flight = module.SingleFlight()
+    parse_cache = module.ParseCache()
+    try:
+        for _ in range(cycles):
+            await recorder.cycle(
+                module.check_stock(engine, single_flight, parse_cache, item, OUT_OF_STOCK_TEXT, item['expected_title'])
+                for item in items
+            )
+    finally:
+        engine.close()
+
+
+async def run_playwright(module, items, cycles, recorder, fast=False):
+    browser_pool = module.BrowserPool(user_agent_factory=module.get_random_user_agent)
+    renderer = module.FastRenderer(browser_pool) if fast else None
+    single_flight = module.SingleFlight()
+
+    def fetch(url):
+        if renderer is not None:
+            return renderer.fetch(url, out_of_stock_text=OUT_OF_STOCK_TEXT)
+        return module.fetch_page_content(browser_pool, url)
+
+    async def check(item):
+        url = item['check_url']
+        parsed_page = await single_flight.do((url, False), lambda: fetch(url))
+        if parsed_page is None or not module.title_matches(parsed_page, item['expected_title'], url):
+            return None
+        return module.parse_stock(parsed_page, OUT_OF_STOCK_TEXT, url, False)
+
+    try:
+        for _ in range(cycles):
+            await recorder.cycle(check(item) for item in items)
+    finally:
+        await browser_pool.close()
+
+
+async def run_bwh(module, items, cycles, recorder):
+    async with module.async_playwright() as playwright:
+        browser = await module.launch_browser(playwright)
+        semaphore = asyncio.Semaphore(4)
+        try:
+            for _ in range(cycles):
+                await recorder.cycle(module.check_stock(browser, semaphore, item, OUT_OF_STOCK_TEXT) for item in items)
+        finally:
+            await browser.close()
+
+
+async def run_engine(module, items, cycles, recorder, backend, groups=False):
+    """把商品写成一个租户的配置文件，用引擎的获取和库存判断流程检查（不发送通知）。
+
+    groups 为 True 时购物车商品设置 whmcs_gid（pid // 10，与替身服务器的分组一致）。
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_file = os.path.join(temp_dir, 'config.json')
+        stock_urls = [dict(item, id=item['title'], buy_url=item['check_url'], price='', hardware_info='') for item in items]
+        for stock in stock_urls:
+            pid = parse_qs(urlsplit(stock['check_url']).query).get('pid')
+            if groups and pid:
+                stock['whmcs_gid'] = int(pid[0]) // stand_in.GROUP_SIZE
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump({'telegram_token': '0:bench', 'telegram_chat_id': 'bench', 'merchants': [
+                {'name': 'bench', 'tag': 'bench', 'out_of_stock_text': OUT_OF_STOCK_TEXT, 'stock_urls': stock_urls}]}, f)
+        engine = module.Engine({
+            'telegram_token': '0:bench',
+            'notify_queue': os.path.join(temp_dir, 'queue.json'),
+            'clearance': {'file': os.path.join(temp_dir, 'clearance.json')},
+            'whmcs_groups': {'enabled': groups},
+            'tenants': [{'name': 'bench', 'config': config_file, 'state_db': os.path.join(temp_dir, 'state.db'),
+                         'backend': backend, 'stock_rule': 'count', 'emulate_human': False}],
+        })
+        tenant = engine.tenants['bench']
+        tenant.reload()
+
+        async def check(item):
+            parsed_page = await engine.fetch(tenant, item)
+            if parsed_page is None or not module.title_matches(parsed_page, item.expected_title, item.check_url,
+                                                                ignore_case=True):
+                return None
+            return tenant.detect_stock(parsed_page, item)
+
+        try:
+            for _ in range(cycles):
+                await recorder.cycle(check(item) for item in tenant.config.items.values())
+        finally:
+            await engine.close()
+
+
+RUNNERS = {
+    'root': run_root,
+    'playwright': run_playwright,
+    'playwright-fast': lambda *args: run_playwright(*args, fast=True),
+    'bwh': run_bwh,
+    'engine-http': lambda *args: run_engine(*args, backend='cfscrape'),
+    'engine-browser': lambda *args: run_engine(*args, backend='playwright'),
+    'engine-auto': lambda *args: run_engine(*args, backend='auto'),
+    'engine-groups': lambda *args: run_engine(*args, backend='cfscrape', groups=True),
+}
+
+
+def worker(args):
+    """子进程：运行一个（脚本，商品数）组合，把结果以 JSON 输出到 stdout。"""
+    # 先配置根日志，脚本中的 logging.basicConfig 因此不会再创建日志文件
+    logging.basicConfig(level=getattr(logging, args.log_level), stream=sys.stderr,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    module = load_monitor(args.worker)
+    items = build_items(args.count, args.base_url)
+    recorder = Recorder()
+    asyncio.run(RUNNERS[args.worker](module, items, args.cycles, recorder))
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)  # 浏览器等已退出的子进程
+    result = {
+        'monitor': args.worker,
+        'items': args.count,
+        'cycles': recorder.cycles,
+        'latency': {name: percentile(recorder.latencies, fraction)
+                    for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))},
+        'outcomes': recorder.outcomes,
+        'cpu_self': self_usage.ru_utime + self_usage.ru_stime,
+        'cpu_children': children_usage.ru_utime + children_usage.ru_stime,
+        'peak_rss_kib': self_usage.ru_maxrss,
+        'children_peak_rss_kib': children_usage.ru_maxrss,
+    }
+    print(json.dumps(result))
+
+
+def run_case(monitor, count, args, base_urls):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', monitor, '--count', str(count),
+               '--cycles', str(args.cycles), '--log-level', args.log_level]
+    for base_url in base_urls:
+        command += ['--base-url', base_url]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, cwd=REPO_DIR, timeout=args.timeout)
+    if completed.returncode != 0:
+        print(f"{monitor} / {count} 个商品运行失败，退出码 {completed.returncode}", file=sys.stderr)
+        return None
+    return json.loads(completed.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def format_row(result, requests):
+    cycles = result['cycles']
+    warm = cycles[1:] or cycles
+    latency = result['latency']
+    return (f"{result['monitor']:<12}{result['items']:>7}"
+            f"{cycles[0]['wall']:>10.2f}{sum(c['wall'] for c in warm) / len(warm):>10.2f}"
+            f"{latency['p50'] * 1000:>10.0f}{latency['p90'] * 1000:>10.0f}{latency['p99'] * 1000:>10.0f}"
+            f"{result['cpu_self']:>9.2f}{result['cpu_children']:>9.2f}"
+            f"{result['peak_rss_kib'] / 1024:>9.1f}{result['children_peak_rss_kib'] / 1024:>9.1f}"
+            f"{requests:>9}"
+            f"  {result['outcomes']['in_stock']}/{result['outcomes']['out_of_stock']}/{result['outcomes']['skipped']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对监控脚本的获取和解析流程做离线基准测试')
+    parser.add_argument('--monitors', nargs='+', choices=sorted(MONITORS), default=list(MONITORS), help='要测试的脚本')
+    parser.add_argument('--items', nargs='+', type=int, default=[10, 100, 1000], help='商品数量')
+    parser.add_argument('--cycles', type=int, default=3, help='每个组合的检查轮数（第一轮为冷启动）')
+    parser.add_argument('--timeout', type=float, default=None, help='单个组合的最长运行时间（秒）')
+    parser.add_argument('--output', help='把完整结果写入 JSON 文件')
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    stand_in.add_options_arguments(parser)
+    # 子进程参数
+    parser.add_argument('--worker', choices=sorted(MONITORS), help=argparse.SUPPRESS)
+    parser.add_argument('--count', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', action='append', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    servers = stand_in.start_servers(args.hosts, 0, stand_in.options_from_args(args))
+    base_urls = [server.base_url for server in servers]
+    results = []
+    print(f"{'monitor':<12}{'items':>7}{'cold(s)':>10}{'warm(s)':>10}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}"
+          f"{'cpu(s)':>9}{'child':>9}{'rss(MB)':>9}{'child':>9}{'requests':>9}  in/out/skip")
+    try:
+        for monitor in args.monitors:
+            for count in args.items:
+                before = sum(server.counts['requests'] for server in servers)
+                try:
+                    result = run_case(monitor, count, args, base_urls)
+                except subprocess.TimeoutExpired:
+                    print(f"{monitor} / {count} 个商品超过 {args.timeout} 秒，已跳过", file=sys.stderr)
+                    continue
+                if result is None:
+                    continue
+                result['requests'] = sum(server.counts['requests'] for server in servers) - before
+                results.append(result)
+                print(format_row(result, result['requests']), flush=True)
+    finally:
+        stand_in.stop_servers(servers)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""本地商家替身服务器。
+
+用 corpus/ 中的样本页面模拟 WHMCS 购物车、Cloudflare 验证页和 ClawCloud 促销页，
+可配置延迟、错误率和库存翻转周期，供基准测试离线使用：
+
+    python3 server.py --hosts 4 --port 8080 --latency 0.05 --error-rate 0.02 --flap-period 30
+
+路由：
+    /cart.php?a=add&pid=N        WHMCS 购物车，pid 决定初始库存状态和库存数
+    /cart.php?gid=G              WHMCS 产品分组页，列出 pid 为 G*10 ~ G*10+9 的产品及其库存数
+    /store/promotion/<slug>      ClawCloud 促销页
+    /challenge/<N>               Cloudflare 验证页（403）
+"""
+import argparse
+import hashlib
+import logging
+import os
+import random
+import secrets
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+# 样本页面中每次请求都会替换的固定值
+SAMPLE_TOKEN = '5f4dcc3b5aa765d61d8327deb882cf99a1b2c3d4'
+SAMPLE_RAY_ID = '8a1f2c3d4e5f6a7b'
+SAMPLE_STOCK = '12 in stock'
+SAMPLE_STOCK_JSON = '"stock":12,'
+SAMPLE_PID = '87'
+SAMPLE_AVAILABLE = '12 Available'
+GROUP_SIZE = 10
+
+
+class StandInOptions:
+    """替身服务器的行为参数。"""
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, flap_period=0, etag=False):
+        self.latency = latency  # 平均响应延迟（秒）
+        self.jitter = jitter  # 延迟在 ±jitter 内均匀抖动
+        self.error_rate = error_rate  # 返回 502/503 的概率
+        self.flap_period = flap_period  # 大于 0 时库存状态每 flap_period 秒翻转一次
+        self.etag = etag  # 按页面状态发送 ETag 并支持 If-None-Match
+
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    """读取 corpus 目录中的所有样本页面，返回 {文件名（不含扩展名）: 内容}。"""
+    corpus = {}
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith('.html'):
+            with open(os.path.join(corpus_dir, name), 'r', encoding='utf-8') as f:
+                corpus[name[:-5]] = f.read()
+    return corpus
+
+
+class StandInServer(ThreadingHTTPServer):
+    """一个监听地址上的替身服务器，记录请求统计。"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, corpus, options):
+        super().__init__(address, StandInHandler)
+        self.corpus = corpus
+        self.options = options
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.counts = {'requests': 0, 'errors': 0, 'not_modified': 0}
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def in_stock(self, seed):
+        """商品当前是否有库存：seed % 4 == 0 的商品初始有货，启用翻转时按各自相位交替。"""
+        state = seed % 4 == 0
+        period = self.options.flap_period
+        if period > 0:
+            offset = (seed * 0.618) % 1 * period  # 错开各商品的翻转时刻
+            state ^= int((time.time() - self.started + offset) / period) % 2 == 1
+        return state
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server_version = 'nginx'
+    sys_version = ''
+    protocol_version = 'HTTP/1.1'  # 支持长连接，与真实商家一致
+
+    def do_GET(self):
+        server = self.server
+        options = server.options
+        server.count('requests')
+        time.sleep(max(0.0, random.uniform(options.latency - options.jitter, options.latency + options.jitter)))
+        if options.error_rate and random.random() < options.error_rate:
+            server.count('errors')
+            self._send(random.choice((502, 503)), b'<html><body><h1>Bad Gateway</h1></body></html>')
+            return
+
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        status = 200
+        if parts.path == '/cart.php' and query.get('gid', [''])[0].isdigit():
+            self._send_group(int(query['gid'][0]))
+            return
+        if parts.path == '/cart.php' and query.get('pid', [''])[0].isdigit():
+            seed = int(query['pid'][0])
+            name = 'whmcs_in_stock' if server.in_stock(seed) else 'whmcs_out_of_stock'
+        elif parts.path.startswith('/store/promotion/'):
+            seed = zlib.crc32(parts.path.encode('utf-8'))
+            name = 'clawcloud_promo_in_stock' if server.in_stock(seed) else 'clawcloud_promo_out_of_stock'
+        elif parts.path.startswith('/challenge/'):
+            seed = 0
+            name = 'cloudflare_challenge'
+            status = 403
+        elif parts.path == '/health':
+            self._send(200, b'ok', content_type='text/plain')
+            return
+        else:
+            self._send(404, b'<html><body><h1>Not Found</h1></body></html>')
+            return
+
+        stock_count = 1 + seed % 20
+        headers = {}
+        if options.etag and status == 200:
+            etag = '"%s"' % hashlib.md5(f"{name}:{stock_count}".encode('utf-8')).hexdigest()
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                server.count('not_modified')
+                self._send(304, b'', headers=headers)
+                return
+        body = (server.corpus[name]
+                .replace(SAMPLE_TOKEN, secrets.token_hex(20))  # 每次请求不同的 CSRF token
+                .replace(SAMPLE_RAY_ID, secrets.token_hex(8))
+                .replace(SAMPLE_STOCK, f"{stock_count} in stock")
+                .replace(SAMPLE_STOCK_JSON, f'"stock":{stock_count},'))
+        self._send(status, body.encode('utf-8'), headers=headers)
+
+    def _send_group(self, gid):
+        """分组页：每个产品按自己的 pid 决定库存状态，无库存时显示 0 Available。"""
+        server = self.server
+        blocks, states = [], []
+        for pid in range(gid * GROUP_SIZE, (gid + 1) * GROUP_SIZE):
+            available = 1 + pid % 20 if server.in_stock(pid) else 0
+            states.append(f"{pid}:{available}")
+            blocks.append(server.corpus['whmcs_group_product']
+                          .replace(f"product{SAMPLE_PID}", f"product{pid}")
+                          .replace(f"pid={SAMPLE_PID}", f"pid={pid}")
+                          .replace(SAMPLE_AVAILABLE, f"{available} Available"))
+        headers = {}
+        if server.options.etag:
+            etag = '"%s"' % hashlib.md5(','.join(states).encode('utf-8')).hexdigest()
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                server.count('not_modified')
+                self._send(304, b'', headers=headers)
+                return
+        body = (server.corpus['whmcs_group']
+                .replace(SAMPLE_TOKEN, secrets.token_hex(20))
+                .replace('<!-- products -->\n', ''.join(blocks)))
+        self._send(200, body.encode('utf-8'), headers=headers)
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+        self.send_response(status)
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def start_servers(hosts=1, port=0, options=None, corpus=None):
+    """在 127.0.0.1 ~ 127.0.0.<hosts> 上各启动一个替身服务器（后台线程），返回服务器列表。
+
+    多个回环地址模拟多个商家主机，便于观察单主机并发限制的影响。port 为 0 时自动分配端口。
+    """
+    options = options or StandInOptions()
+    corpus = corpus or load_corpus()
+    servers = []
+    for index in range(hosts):
+        server = StandInServer((f"127.0.0.{index + 1}", port), corpus, options)
+        threading.Thread(target=server.serve_forever, name=f"stand-in-{index + 1}", daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def stop_servers(servers):
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def add_options_arguments(parser):
+    """添加替身服务器行为参数（server.py 和 harness.py 共用）。"""
+    parser.add_argument('--hosts', type=int, default=4, help='模拟的商家主机数（127.0.0.1 起的回环地址）')
+    parser.add_argument('--latency', type=float, default=0.05, help='平均响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.02, help='延迟抖动范围（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 502/503 的概率')
+    parser.add_argument('--flap-period', type=float, default=0, help='库存状态翻转周期（秒），0 表示不翻转')
+    parser.add_argument('--etag', action='store_true', help='发送 ETag 并对 If-None-Match 返回 304')
+
+
+def options_from_args(args):
+    return StandInOptions(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          flap_period=args.flap_period, etag=args.etag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用样本页面模拟商家网站的本地服务器')
+    add_options_arguments(parser)
+    parser.add_argument('--port', type=int, default=8080, help='监听端口')
+    parser.add_argument('--verbose', action='store_true', help='打印每个请求')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(asctime)s - %(message)s')
+
+    servers = start_servers(args.hosts, args.port, options_from_args(args))
+    for server in servers:
+        logger.info(f"替身服务器已启动: {server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_servers(servers)
+        for server in servers:
+            logger.info(f"{server.base_url} 请求统计: {server.counts}")
+
+
+if __name__ == '__main__':
+    main()
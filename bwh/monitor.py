@@ -1,16 +1,26 @@
-from playwright.sync_api import sync_playwright
+from bs4 import BeautifulSoup
+from playwright.async_api import async_playwright
 import asyncio
 import json
 import os
+import re
 import fcntl
 import sys
 import logging
-from telegram import Bot
-from telegram.constants import ParseMode
-from telegram.error import BadRequest
 import time
 import html  # 用于转义 HTML 字符
 
+# 通知分发使用 monitor/ 目录中的共用模块：在仓库中是上一级目录下的 monitor/，
+# 部署后（本脚本位于 /root/monitor/bwh/）是上一级目录 /root/monitor/
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+for shared_dir in (os.path.join(os.path.dirname(SCRIPT_DIR), 'monitor'), os.path.dirname(SCRIPT_DIR)):
+    if os.path.exists(os.path.join(shared_dir, 'notifier.py')):
+        sys.path.insert(0, shared_dir)
+        break
+
+from notifier import Notifier
+from state_store import StateStore
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,  # 设置日志级别为INFO
@@ -42,15 +52,27 @@ def escape_markdown(text):
     """不进行任何转义操作，直接返回文本。"""
     return text
 
-def fetch_html_with_playwright(url):
-    """使用 Playwright 获取 HTML 页面内容"""
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)  # 启动无头浏览器
-        page = browser.new_page()
-        page.goto(url)  # 加载页面
-        html_content = page.content()  # 获取网页内容
-        browser.close()
-        return html_content
+async def launch_browser(playwright):
+    """启动常驻的无头浏览器，所有检查共用"""
+    browser = await playwright.chromium.launch(headless=True)  # 启动无头浏览器
+    logger.info("Browser launched.")
+    return browser
+
+async def fetch_html_with_playwright(browser, url, semaphore, timeout=60000):
+    """使用 Playwright 异步获取 HTML 页面内容，同时打开的页面数由 semaphore 限制"""
+    async with semaphore:
+        context = None
+        try:
+            context = await browser.new_context()  # 每次检查使用独立的 context
+            page = await context.new_page()
+            await page.goto(url, timeout=timeout)  # 加载页面
+            return await page.content()  # 获取网页内容
+        except Exception as e:
+            logger.error(f"Error fetching {url}: {e}")
+            return None
+        finally:
+            if context is not None:
+                await context.close()
 
 def parse_stock(html, out_of_stock_text):
     """解析库存信息"""
@@ -70,10 +92,10 @@ def parse_stock(html, out_of_stock_text):
         logger.error(f"Error parsing HTML: {e}")
         return None  # 返回 None 表示解析失败
 
-async def check_stock(stock, out_of_stock_text):
+async def check_stock(browser, semaphore, stock, out_of_stock_text):
     """检查商品库存"""
     url = stock['check_url']
-    html = fetch_html_with_playwright(url)
+    html = await fetch_html_with_playwright(browser, url, semaphore)
     if html is None:
         logger.warning(f"Skipping URL {url} due to repeated errors.")
         return None  # 如果获取失败，返回 None
@@ -88,9 +110,12 @@ async def load_config(filename='/root/monitor/bwh/config.json'):
         logger.info(f"Loaded config from {filename}")
         return json.load(f)
 
-async def send_notification(config, merchant, stock, stock_quantity, message_id=None):
-    """发送 Telegram 通知，使用 HTML 格式并禁用链接预览"""
-    bot = Bot(token=config['telegram_token'])
+def send_notification(notifier, config, merchant, stock, stock_quantity, detected_at=None):
+    """把 Telegram 通知交给后台分发器排队发送，使用 HTML 格式并禁用链接预览
+
+    有库存时发送新消息，已售罄时编辑之前发出的消息。限流、超时和网络错误由 Notifier 重试，
+    不会中断本轮检查。detected_at 为页面加载和解析完成的 Unix 时间戳，用于记录检测到发送的延迟。
+    """
     title = f"{merchant['name']}-{stock['title']}"
     tag = html.escape(merchant['tag'])  # 转义 HTML 特殊字符
     price = html.escape(stock['price'])  # 转义 HTML 特殊字符
@@ -117,98 +142,89 @@ async def send_notification(config, merchant, stock, stock_quantity, message_id=
         f"{buy_link}"
     )
 
-    try:
-        # 如果库存大于 0，发送新消息
-        if stock_quantity > 0:
-            sent_message = await bot.send_message(
-                chat_id=config['telegram_chat_id'],
-                text=message,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True  # 禁用链接预览
-            )
-            return sent_message.message_id
-        elif message_id:  # 如果库存为 0 且已有消息，更新已发送消息
-            await bot.edit_message_text(
-                chat_id=config['telegram_chat_id'],
-                message_id=message_id,
-                text=message,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True  # 禁用链接预览
-            )
-    except BadRequest as e:
-        logger.error(f"Error updating message: {e}")
-    return None
-
-async def check_all_stocks(config, merchants):
-    """检查所有商家的库存"""
+    # 使用商品的标题作为消息的唯一标识符
+    if stock_quantity > 0:
+        notifier.send(stock['title'], config['telegram_chat_id'], message, detected_at)
+    else:
+        notifier.edit(stock['title'], config['telegram_chat_id'], message, detected_at)
+
+async def process_stock(config, merchant, stock, browser, semaphore, stock_status, notifier):
+    """检查一个商品，完成后立即比较库存状态并排队通知，不等待同一轮的其他商品"""
+    stock_quantity = await check_stock(browser, semaphore, stock, merchant['out_of_stock_text'])
+    if stock_quantity is None:
+        return None  # 处理失败的请求
+    detected_at = time.time()
+
+    # 使用商品的标题作为唯一标识符
+    unique_identifier = stock['title']
+    previous_status = stock_status.get(unique_identifier, {'in_stock': False})
+
+    if stock_quantity > 0 and not previous_status['in_stock']:
+        # 先记录状态，避免标题相同的商品重复通知；消息发出后由 Notifier 回调记录 message_id
+        stock_status.put(unique_identifier, {'in_stock': True, 'message_id': None})
+        send_notification(notifier, config, merchant, stock, stock_quantity, detected_at)
+    elif stock_quantity == 0 and previous_status['in_stock']:
+        stock_status.put(unique_identifier, {'in_stock': False, 'message_id': previous_status['message_id']})
+        # 编辑已有的消息
+        send_notification(notifier, config, merchant, stock, stock_quantity, detected_at)
+    return stock_quantity
+
+async def check_all_stocks(config, merchants, browser, stock_status, notifier):
+    """并发检查所有商家的库存，同时加载的页面数不超过 max_concurrency
+
+    每个商品的结果一出来就处理，加载慢的页面不会推迟其他商品的通知。
+    """
+    semaphore = asyncio.Semaphore(config.get('max_concurrency', 4))
     tasks = []
     for merchant in merchants:
         if merchant['enabled']:  # 只检查启用的商家
             for stock in merchant['stock_urls']:
-                tasks.append(check_stock(stock, merchant['out_of_stock_text']))
+                tasks.append(process_stock(config, merchant, stock, browser, semaphore, stock_status, notifier))
     results = await asyncio.gather(*tasks)
     return results  # 返回一个包含所有库存数量的列表
 
-async def load_stock_status(filename='/root/monitor/bwh/stock_status.json'):
-    """加载之前保存的库存状态"""
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-async def save_stock_status(stock_status, filename='/root/monitor/bwh/stock_status.json'):
-    """保存库存状态"""
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(stock_status, f, ensure_ascii=False, indent=4)
-
 async def main():
     """主函数"""
     lock_file = acquire_lock()  # 确保只运行一个实例
+    notifier = None
+    stock_status = None
 
     try:
-        # 加载之前的库存状态
-        stock_status = await load_stock_status()
-
-        while True:
-            config = await load_config()  # 加载配置
-            check_interval = config.get('check_interval', 600)  # 获取检查间隔，默认为 600 秒
-
-            # 获取当前所有商品的库存状态
-            results = await check_all_stocks(config, config['merchants'])
-
-            result_index = 0
-            for merchant in config['merchants']:
-                if not merchant['enabled']:  # 如果商家禁用，跳过
-                    continue
-                for stock in merchant['stock_urls']:
-                    stock_quantity = results[result_index]
-                    result_index += 1
-
-                    if stock_quantity is None:
-                        continue  # 处理失败的请求
-
-                    # 使用商品的标题作为唯一标识符
-                    unique_identifier = stock['title']
-
-                    previous_status = stock_status.get(unique_identifier, {'in_stock': False})
-
-                    if stock_quantity > 0 and not previous_status['in_stock']:
-                        message_id = await send_notification(config, merchant, stock, stock_quantity)
-                        stock_status[unique_identifier] = {'in_stock': True, 'message_id': message_id}
-                    elif stock_quantity == 0 and previous_status['in_stock']:
-                        # 编辑已有的消息
-                        await send_notification(config, merchant, stock, stock_quantity, previous_status['message_id'])
-                        stock_status[unique_identifier] = {'in_stock': False, 'message_id': previous_status['message_id']}
-
-            # 每次循环后保存库存状态
-            await save_stock_status(stock_status)
-
-            logger.info(f"Waiting for {check_interval} seconds before checking again...")
-            await asyncio.sleep(check_interval)
+        # 库存状态保存在 SQLite 中，只在状态变化时写入单个商品；首次启动时导入旧的 stock_status.json
+        stock_status = StateStore('/root/monitor/bwh/stock_status.db', legacy_json='/root/monitor/bwh/stock_status.json')
+
+        async with async_playwright() as playwright:
+            browser = None
+            while True:
+                config = await load_config()  # 加载配置
+                check_interval = config.get('check_interval', 600)  # 获取检查间隔，默认为 600 秒
+
+                if notifier is None:
+                    # 后台通知分发器常驻，消息发出后把 message_id 记入库存状态，编辑时从中读取
+                    notifier = Notifier.from_config(
+                        config, '/root/monitor/bwh/notify_queue.json',
+                        on_sent=stock_status.set_message_id,
+                        message_id_for=lambda unique_identifier: stock_status.get(unique_identifier, {}).get('message_id'),
+                    )
+                    await notifier.start()
+
+                # 浏览器常驻，未启动或已崩溃时重新启动
+                if browser is None or not browser.is_connected():
+                    browser = await launch_browser(playwright)
+
+                # 检查所有商品，每个商品完成后立即处理通知
+                await check_all_stocks(config, config['merchants'], browser, stock_status, notifier)
+
+                logger.info(f"Waiting for {check_interval} seconds before checking again...")
+                await asyncio.sleep(check_interval)
 
     except Exception as e:
         logger.error(f"An error occurred: {e}")
     finally:
+        if notifier is not None:
+            await notifier.close()
+        if stock_status is not None:
+            stock_status.close()
         lock_file.close()
 
 # 启动主函数
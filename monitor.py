@@ -1,18 +1,25 @@
-import cfscrape
-from bs4 import BeautifulSoup
 import asyncio
 import json
 import os
-import re
 import fcntl
 import sys
 import logging
-from telegram import Bot
-from telegram.constants import ParseMode
-from telegram.error import BadRequest
 import time
 import html  # 用于转义 HTML 字符
 
+# 抓取引擎和页面解析使用 monitor/ 目录中的共用模块：在仓库中是同级的 monitor/ 目录，
+# 部署后（本脚本位于 /root/monitor/stock/）是上一级目录 /root/monitor/
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+for shared_dir in (os.path.join(SCRIPT_DIR, 'monitor'), os.path.dirname(SCRIPT_DIR)):
+    if os.path.exists(os.path.join(shared_dir, 'fetch_engine.py')):
+        sys.path.insert(0, shared_dir)
+        break
+
+from fetch_engine import FetchEngine, fetch_html
+from notifier import Notifier
+from state_store import StateStore
+from singleflight import SingleFlight
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,  # 设置日志级别为INFO
@@ -44,40 +51,30 @@ def escape_markdown(text):
     """不进行任何转义操作，直接返回文本。"""
     return text
 
-async def fetch_html(url, expected_title=None, retries=3):
-    scraper = cfscrape.create_scraper()
-    for attempt in range(retries):
-        try:
-            response = scraper.get(url)
-            if response.status_code != 200:
-                logger.warning(f"URL {url} 返回了非200状态码 {response.status_code}，跳过该页面。")
-                return None  # 如果状态码不是 200，跳过该页面
-            if not response.text.strip():  # 检查页面是否为空
-                logger.warning(f"URL {url} 返回了空页面，跳过。")
-                return None
-            if expected_title:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                title = soup.title.string if soup.title else None
-                if title and expected_title.lower() not in title.lower():
-                    logger.warning(f"URL {url} 标题不匹配。期望包含：{expected_title}，实际：{title}，跳过该页面。")
-                    return None  # 如果标题不包含期望的部分文本，跳过该页面
-            logger.info(f"成功获取 URL: {url}")
-            return response.text
-        except Exception as e:
-            logger.error(f"获取 {url} 时出错: {e} (尝试 {attempt + 1} 次，共 {retries} 次)")
-            await asyncio.sleep(2)  # 等待重试
-    logger.error(f"获取 URL {url} 失败，已尝试 {retries} 次。")
-    return None
-
-def parse_stock(html, out_of_stock_text):
-    """解析库存信息"""
+class ParseCache:
+    """记录每个商品上次解析时的页面摘要，页面未变化时跳过解析和状态处理；parser_backend 为页面解析后端"""
+
+    def __init__(self, parser_backend='auto'):
+        self.parser_backend = parser_backend
+        self.digests = {}
+        self.skipped = 0  # 累计跳过的解析次数
+
+    def is_unchanged(self, key, digest):
+        if self.digests.get(key) == digest:
+            self.skipped += 1
+            return True
+        return False
+
+    def remember(self, key, digest):
+        self.digests[key] = digest
+
+def parse_stock(parsed_page, out_of_stock_text):
+    """根据解析后的页面信息判断库存"""
     try:
-        soup = BeautifulSoup(html, 'html.parser')
-        stock_match = re.search(r'(\d+)\s+in stock', soup.get_text(), re.IGNORECASE)
-        if stock_match:
-            logger.info(f"Stock found: {stock_match.group(1)} in stock")
-            return int(stock_match.group(1))
-        elif out_of_stock_text in soup.get_text():
+        if parsed_page.stock_count is not None:
+            logger.info(f"Stock found: {parsed_page.stock_count} in stock")
+            return parsed_page.stock_count
+        elif out_of_stock_text in parsed_page.text:
             logger.info("Out of stock.")
             return 0
         else:
@@ -87,14 +84,35 @@ def parse_stock(html, out_of_stock_text):
         logger.error(f"Error parsing HTML: {e}")
         return None  # 返回 None 表示解析失败
 
-async def check_stock(stock, out_of_stock_text, expected_title=None):
-    """检查商品库存"""
+async def check_stock(engine, single_flight, parse_cache, stock, out_of_stock_text, expected_title=None):
+    """检查商品库存，页面与上次解析时相同则返回 None（跳过解析和状态处理）
+
+    check_url 相同的商品共用一次页面获取和解析。
+    """
     url = stock['check_url']
-    html = await fetch_html(url, expected_title=expected_title)
-    if html is None:
-        logger.warning(f"跳过 URL {url}，因获取失败或标题不匹配。")
-        return None  # 如果获取失败或标题不匹配，跳过该页面
-    return parse_stock(html, out_of_stock_text)
+    page = await single_flight.do(url, lambda: fetch_html(engine, url))
+    if page is None:
+        logger.warning(f"跳过 URL {url}，因获取失败。")
+        return None  # 如果获取失败，跳过该页面
+    # 先比较摘要，页面与上次成功解析时相同就不再解析（标题检查的结果也不会变化）
+    cache_key = (stock['title'], url, out_of_stock_text)
+    if parse_cache.is_unchanged(cache_key, page.digest):
+        logger.info(f"URL {url} 内容未变化，跳过解析。")
+        return None
+    try:
+        parsed_page = page.parse(parse_cache.parser_backend)
+    except Exception as e:
+        logger.error(f"Error parsing HTML: {e}")
+        return None  # 返回 None 表示解析失败
+    if expected_title:
+        title = parsed_page.title
+        if title and expected_title.lower() not in title.lower():
+            logger.warning(f"URL {url} 标题不匹配。期望包含：{expected_title}，实际：{title}，跳过该页面。")
+            return None  # 如果标题不包含期望的部分文本，跳过该页面
+    stock_quantity = parse_stock(parsed_page, out_of_stock_text)
+    if stock_quantity is not None:
+        parse_cache.remember(cache_key, page.digest)
+    return stock_quantity
 
 async def load_config(filename='/root/monitor/stock/config.json'):
     """加载配置文件"""
@@ -105,9 +123,12 @@ async def load_config(filename='/root/monitor/stock/config.json'):
         logger.info(f"Loaded config from {filename}")
         return json.load(f)
 
-async def send_notification(config, merchant, stock, stock_quantity, message_id=None):
-    """发送 Telegram 通知，使用 HTML 格式并禁用链接预览"""
-    bot = Bot(token=config['telegram_token'])
+def send_notification(notifier, config, merchant, stock, stock_quantity, detected_at=None):
+    """把 Telegram 通知交给后台分发器排队发送，使用 HTML 格式并禁用链接预览
+
+    有库存时发送新消息，已售罄时编辑之前发出的消息。限流、超时和网络错误由 Notifier 重试，
+    不会中断本轮检查。detected_at 为页面获取和解析完成的 Unix 时间戳，用于记录检测到发送的延迟。
+    """
     title = f"{merchant['name']}-{stock['title']}"
     tag = html.escape(merchant['tag'])  # 转义 HTML 特殊字符
     price = html.escape(stock['price'])  # 转义 HTML 特殊字符
@@ -134,91 +155,77 @@ async def send_notification(config, merchant, stock, stock_quantity, message_id=
         f"{buy_link}"
     )
 
-    try:
-        # 如果库存大于 0，发送新消息
-        if stock_quantity > 0:
-            sent_message = await bot.send_message(
-                chat_id=config['telegram_chat_id'],
-                text=message,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True  # 禁用链接预览
-            )
-            return sent_message.message_id
-        elif message_id:  # 如果库存为 0 且已有消息，更新已发送消息
-            await bot.edit_message_text(
-                chat_id=config['telegram_chat_id'],
-                message_id=message_id,
-                text=message,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True  # 禁用链接预览
-            )
-    except BadRequest as e:
-        logger.error(f"Error updating message: {e}")
-    return None
-
-async def check_all_stocks(config, merchants):
-    """检查所有商家的库存"""
+    # 使用商品的标题作为消息的唯一标识符
+    if stock_quantity > 0:
+        notifier.send(stock['title'], config['telegram_chat_id'], message, detected_at)
+    else:
+        notifier.edit(stock['title'], config['telegram_chat_id'], message, detected_at)
+
+async def process_stock(config, merchant, stock, engine, single_flight, parse_cache, stock_status, notifier):
+    """检查一个商品，完成后立即比较库存状态并排队通知，不等待同一轮的其他商品"""
+    stock_quantity = await check_stock(engine, single_flight, parse_cache, stock, merchant['out_of_stock_text'],
+                                       stock.get('expected_title'))
+    if stock_quantity is None:
+        return None  # 处理失败的请求
+    detected_at = time.time()
+
+    # 使用商品的标题作为唯一标识符
+    unique_identifier = stock['title']
+    previous_status = stock_status.get(unique_identifier, {'in_stock': False})
+
+    if stock_quantity > 0 and not previous_status['in_stock']:
+        # 先记录状态，避免标题相同的商品重复通知；消息发出后由 Notifier 回调记录 message_id
+        stock_status.put(unique_identifier, {'in_stock': True, 'message_id': None})
+        send_notification(notifier, config, merchant, stock, stock_quantity, detected_at)
+    elif stock_quantity == 0 and previous_status['in_stock']:
+        stock_status.put(unique_identifier, {'in_stock': False, 'message_id': previous_status['message_id']})
+        # 编辑已有的消息
+        send_notification(notifier, config, merchant, stock, stock_quantity, detected_at)
+    return stock_quantity
+
+async def check_all_stocks(config, merchants, engine, single_flight, parse_cache, stock_status, notifier):
+    """并发检查所有商家的库存，每个商品的结果一出来就处理，页面慢的商品不会推迟其他商品的通知"""
     tasks = []
     for merchant in merchants:
         if merchant['enabled']:  # 只检查启用的商家
             for stock in merchant['stock_urls']:
-                tasks.append(check_stock(stock, merchant['out_of_stock_text'], stock.get('expected_title')))
+                tasks.append(process_stock(config, merchant, stock, engine, single_flight, parse_cache, stock_status, notifier))
     results = await asyncio.gather(*tasks)
     return results  # 返回一个包含所有库存数量的列表
 
-async def load_stock_status(filename='/root/monitor/stock/stock_status.json'):
-    """加载之前保存的库存状态"""
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-async def save_stock_status(stock_status, filename='/root/monitor/stock/stock_status.json'):
-    """保存库存状态"""
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(stock_status, f, ensure_ascii=False, indent=4)
-
 async def main():
     """主函数"""
     lock_file = acquire_lock()  # 确保只运行一个实例
+    engine = None
+    notifier = None
+    stock_status = None
+    single_flight = SingleFlight()  # 只合并同一轮中对同一 URL 的并发请求
+    parse_cache = None
 
     try:
-        # 加载之前的库存状态
-        stock_status = await load_stock_status()
+        # 库存状态保存在 SQLite 中，只在状态变化时写入单个商品；首次启动时导入旧的 stock_status.json
+        stock_status = StateStore('/root/monitor/stock/stock_status.db', legacy_json='/root/monitor/stock/stock_status.json')
 
         while True:
             config = await load_config()  # 加载配置
             check_interval = config.get('check_interval', 600)  # 获取检查间隔，默认为 600 秒
-
-            # 获取当前所有商品的库存状态
-            results = await check_all_stocks(config, config['merchants'])
-
-            result_index = 0
-            for merchant in config['merchants']:
-                if not merchant['enabled']:  # 如果商家禁用，跳过
-                    continue
-                for stock in merchant['stock_urls']:
-                    stock_quantity = results[result_index]
-                    result_index += 1
-
-                    if stock_quantity is None:
-                        continue  # 处理失败的请求
-
-                    # 使用商品的标题作为唯一标识符
-                    unique_identifier = stock['title']
-
-                    previous_status = stock_status.get(unique_identifier, {'in_stock': False})
-
-                    if stock_quantity > 0 and not previous_status['in_stock']:
-                        message_id = await send_notification(config, merchant, stock, stock_quantity)
-                        stock_status[unique_identifier] = {'in_stock': True, 'message_id': message_id}
-                    elif stock_quantity == 0 and previous_status['in_stock']:
-                        # 编辑已有的消息
-                        await send_notification(config, merchant, stock, stock_quantity, previous_status['message_id'])
-                        stock_status[unique_identifier] = {'in_stock': False, 'message_id': previous_status['message_id']}
-
-            # 每次循环后保存库存状态
-            await save_stock_status(stock_status)
+            if engine is None:
+                engine = FetchEngine.from_config(config)  # 抓取引擎常驻，连接在各轮检查之间复用
+                parse_cache = ParseCache(config.get('parser_backend', 'auto'))
+            if notifier is None:
+                # 后台通知分发器常驻，消息发出后把 message_id 记入库存状态，编辑时从中读取
+                notifier = Notifier.from_config(
+                    config, '/root/monitor/stock/notify_queue.json',
+                    on_sent=stock_status.set_message_id,
+                    message_id_for=lambda unique_identifier: stock_status.get(unique_identifier, {}).get('message_id'),
+                )
+                await notifier.start()
+
+            # 检查所有商品，每个商品完成后立即处理通知
+            skipped_before = parse_cache.skipped
+            await check_all_stocks(config, config['merchants'], engine, single_flight, parse_cache, stock_status, notifier)
+            logger.info(f"本轮页面未变化、跳过解析 {parse_cache.skipped - skipped_before} 次（累计 {parse_cache.skipped} 次），"
+                        f"累计合并重复请求 {single_flight.shared} 次。")
 
             logger.info(f"Waiting for {check_interval} seconds before checking again...")
             await asyncio.sleep(check_interval)
@@ -226,6 +233,12 @@ async def main():
     except Exception as e:
         logger.error(f"Error in main function: {e}")
     finally:
+        if notifier is not None:
+            await notifier.close()
+        if stock_status is not None:
+            stock_status.close()
+        if engine is not None:
+            engine.close()
         if lock_file:
             lock_file.close()
 
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""解析后端微基准。
+
+用法：
+    python3 bench_parser.py --capture config.json pages/   # 抓取配置中所有 check_url 保存为样本
+    python3 bench_parser.py pages/                          # 对样本页面比较各解析后端
+    python3 bench_parser.py                                 # 使用仓库中 benchmark/corpus 的样本页面
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import urllib.request
+
+from bs4 import BeautifulSoup
+
+from page_parser import available_backends, parse_page
+
+DEFAULT_PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmark', 'corpus')
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+def legacy_parse(html, out_of_stock_text='Out of Stock'):
+    """原有流程：标题检查和库存解析各建一次 BeautifulSoup 树，get_text() 调用两次。"""
+    soup = BeautifulSoup(html, 'html.parser')
+    title = soup.title.string if soup.title else None
+    soup = BeautifulSoup(html, 'html.parser')
+    re.search(r'(\d+)\s+in stock', soup.get_text(), re.IGNORECASE)
+    out_of_stock = out_of_stock_text in soup.get_text()
+    soup.find(string=lambda text: text and out_of_stock_text in text)
+    return title, out_of_stock
+
+
+def capture(config_path, out_dir):
+    """下载配置文件中所有 check_url 的页面，保存为基准样本。"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    os.makedirs(out_dir, exist_ok=True)
+    for merchant in config['merchants']:
+        for stock in merchant['stock_urls']:
+            url = stock['check_url']
+            name = re.sub(r'[^A-Za-z0-9]+', '_', url).strip('_')[:120] + '.html'
+            try:
+                request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    body = response.read()
+            except Exception as e:
+                print(f"抓取失败 {url}: {e}", file=sys.stderr)
+                continue
+            with open(os.path.join(out_dir, name), 'wb') as f:
+                f.write(body)
+            print(f"已保存 {url} -> {name} ({len(body)} 字节)")
+
+
+def load_pages(pages_dir):
+    pages = []
+    for name in sorted(os.listdir(pages_dir)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(pages_dir, name), 'r', encoding='utf-8', errors='replace') as f:
+                pages.append((name, f.read()))
+    return pages
+
+
+def bench(func, html, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(html)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较页面解析后端的耗时')
+    parser.add_argument('pages_dir', nargs='?', default=DEFAULT_PAGES_DIR,
+                        help='保存样本页面的目录，默认使用 benchmark/corpus')
+    parser.add_argument('--capture', metavar='CONFIG', help='先抓取配置文件中的 check_url 保存到 pages_dir')
+    parser.add_argument('--repeat', type=int, default=50, help='每个页面每个后端的重复次数')
+    args = parser.parse_args()
+
+    if args.capture:
+        capture(args.capture, args.pages_dir)
+
+    pages = load_pages(args.pages_dir)
+    if not pages:
+        print(f"{args.pages_dir} 中没有 .html 样本页面。", file=sys.stderr)
+        sys.exit(1)
+
+    columns = ['legacy'] + available_backends()
+    runners = {'legacy': legacy_parse}
+    for backend in available_backends():
+        runners[backend] = lambda html, backend=backend: parse_page(html, backend)
+
+    print(f"{'page':<60}{'KiB':>8}" + ''.join(f"{name:>12}" for name in columns))
+    totals = dict.fromkeys(columns, 0.0)
+    for name, html in pages:
+        row = f"{name[:58]:<60}{len(html.encode('utf-8')) / 1024:>8.1f}"
+        for column in columns:
+            elapsed = bench(runners[column], html, args.repeat)
+            totals[column] += elapsed
+            row += f"{elapsed:>10.2f}ms"
+        print(row)
+    print(f"{'total':<68}" + ''.join(f"{totals[column]:>10.2f}ms" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from playwright.async_api import async_playwright
+
+from metrics import BROWSER_LAUNCH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+async def _close_quietly(target):
+    """关闭 page / context / browser，忽略已断开等错误。"""
+    try:
+        await target.close()
+    except Exception as e:
+        logger.debug("关闭 %s 时出错（已忽略）: %s", target, e)
+
+
+class _ContextEntry:
+    """池中的一个浏览器 context 及其已使用次数。"""
+
+    __slots__ = ('context', 'uses')
+
+    def __init__(self, context):
+        self.context = context
+        self.uses = 0
+
+
+class _BrowserSlot:
+    """一个常驻浏览器进程及其空闲 context。"""
+
+    def __init__(self, index):
+        self.index = index
+        self.browser = None
+        self.lock = asyncio.Lock()
+        self.active = 0  # 当前借出的 page 数
+        self.contexts_created = 0  # 本次启动以来创建的 context 数
+        self.idle = {}  # (是否启用 JavaScript, 指定的 User-Agent) -> 空闲 context 列表
+
+    def is_alive(self):
+        return self.browser is not None and self.browser.is_connected()
+
+    def take_idle(self):
+        """取出所有空闲 context 并清空空闲列表。"""
+        entries = [entry for entries in self.idle.values() for entry in entries]
+        self.idle = {}
+        return entries
+
+
+class BrowserPool:
+    """常驻 Chromium 浏览器池。
+
+    启动 browsers 个浏览器进程并长期复用。每次检查从池中借出一个隔离的
+    context 上的新 page，同时借出的 page 数不超过 max_pages；context 使用
+    max_context_uses 次后回收，浏览器创建 browser_max_contexts 个 context
+    后在空闲时重启，断开或崩溃时在下次借用时自动重新启动。
+    """
+
+    def __init__(self, browsers=1, max_pages=4, max_context_uses=20, browser_max_contexts=200,
+                 user_agent_factory=None, launch_options=None):
+        self.max_context_uses = max(1, max_context_uses)
+        self.browser_max_contexts = max(1, browser_max_contexts)
+        self.user_agent_factory = user_agent_factory
+        self.launch_options = launch_options or {'headless': True}
+        self._slots = [_BrowserSlot(i) for i in range(max(1, browsers))]
+        self._semaphore = asyncio.Semaphore(max(1, max_pages))
+        self._playwright = None
+        self._playwright_lock = asyncio.Lock()
+        self._closed = False
+
+    @classmethod
+    def from_config(cls, config, user_agent_factory=None):
+        """根据配置文件中的 browser_pool 段创建浏览器池。"""
+        options = config.get('browser_pool', {})
+        return cls(
+            browsers=options.get('browsers', 1),
+            max_pages=options.get('max_pages', 4),
+            max_context_uses=options.get('max_context_uses', 20),
+            browser_max_contexts=options.get('browser_max_contexts', 200),
+            user_agent_factory=user_agent_factory,
+        )
+
+    async def _ensure_playwright(self):
+        async with self._playwright_lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            return self._playwright
+
+    async def _ensure_browser(self, slot):
+        """确保槽位中的浏览器在运行，未启动或已崩溃时重新启动。"""
+        if slot.is_alive():
+            return slot.browser
+        async with slot.lock:
+            if slot.is_alive():
+                return slot.browser
+            if slot.browser is not None:
+                logger.warning(f"浏览器 #{slot.index} 已断开，正在重新启动...")
+                slot.take_idle()  # 旧进程中的 context 已失效，直接丢弃
+                slot.browser = None
+            playwright = await self._ensure_playwright()
+            with BROWSER_LAUNCH_SECONDS.time():
+                slot.browser = await playwright.chromium.launch(**self.launch_options)
+            slot.contexts_created = 0
+            logger.info(f"浏览器 #{slot.index} 已启动。")
+            return slot.browser
+
+    async def _acquire_context(self, slot, browser, enable_javascript, user_agent):
+        idle = slot.idle.get((enable_javascript, user_agent))
+        if idle:
+            return idle.pop()
+        options = {'java_script_enabled': enable_javascript}
+        if user_agent:
+            options['user_agent'] = user_agent
+        elif self.user_agent_factory:
+            options['user_agent'] = self.user_agent_factory()
+        context = await browser.new_context(**options)
+        slot.contexts_created += 1
+        return _ContextEntry(context)
+
+    async def _release(self, slot, entry, key, failed):
+        """归还 context，按使用次数、错误和浏览器状态决定复用还是回收。"""
+        retiring = slot.contexts_created >= self.browser_max_contexts
+        if entry is not None:
+            entry.uses += 1
+            if failed or retiring or self._closed or not slot.is_alive() \
+                    or entry.uses >= self.max_context_uses:
+                await _close_quietly(entry.context)
+            else:
+                slot.idle.setdefault(key, []).append(entry)
+        if retiring and slot.active == 0 and slot.browser is not None:
+            async with slot.lock:
+                if slot.active == 0 and slot.browser is not None:
+                    logger.info(f"浏览器 #{slot.index} 已创建 {slot.contexts_created} 个 context，正在回收重启。")
+                    # 先从槽位上摘下浏览器再关闭，关闭期间借用的调用者等待锁并启动新浏览器，
+                    # 不会拿到正在关闭的浏览器
+                    browser, slot.browser = slot.browser, None
+                    for idle_entry in slot.take_idle():
+                        await _close_quietly(idle_entry.context)
+                    await _close_quietly(browser)
+
+    @asynccontextmanager
+    async def page(self, enable_javascript=False, user_agent=None):
+        """借出一个新 page，退出时关闭 page 并归还所属 context。
+
+        指定 user_agent 时使用该 User-Agent 的 context（如与缓存的验证 Cookie 配套），
+        否则由 user_agent_factory 决定。
+        """
+        if self._closed:
+            raise RuntimeError("浏览器池已关闭。")
+        async with self._semaphore:
+            slot = min(self._slots, key=lambda s: s.active)
+            slot.active += 1
+            entry = None
+            failed = False
+            try:
+                browser = await self._ensure_browser(slot)
+                entry = await self._acquire_context(slot, browser, enable_javascript, user_agent)
+                page = await entry.context.new_page()
+                try:
+                    yield page
+                finally:
+                    await _close_quietly(page)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                slot.active -= 1
+                await self._release(slot, entry, (enable_javascript, user_agent), failed)
+
+    async def close(self):
+        """关闭所有 context、浏览器和 Playwright 驱动。"""
+        self._closed = True
+        for slot in self._slots:
+            for entry in slot.take_idle():
+                await _close_quietly(entry.context)
+            if slot.browser is not None:
+                await _close_quietly(slot.browser)
+                slot.browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        logger.info("浏览器池已关闭。")
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""按 cron 表达式定义的集中检查时段：在已知的补货时间前预热，时段内以很短的间隔检查。"""
+from datetime import datetime, timedelta
+
+# 分、时、日、月、星期的取值范围
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# 向后查找下一次开始时间的上限
+SEARCH_LIMIT = timedelta(days=366 * 4)
+
+
+def _parse_field(text, low, high):
+    """解析 cron 的一个字段（支持 *、a-b、a,b 和 /n），返回取值集合。"""
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            if not step_text.isdigit() or int(step_text) < 1:
+                raise ValueError(f"步长无效: {step_text}")
+            step = int(step_text)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            if not start_text.isdigit() or not end_text.isdigit():
+                raise ValueError(f"范围无效: {part}")
+            start, end = int(start_text), int(end_text)
+        elif part.isdigit():
+            start = int(part)
+            end = high if step > 1 else start
+        else:
+            raise ValueError(f"取值无效: {part}")
+        if not low <= start <= end <= high:
+            raise ValueError(f"{part} 超出范围 {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """五个字段（分 时 日 月 星期）的 cron 表达式，星期中 0 和 7 都表示星期日。
+
+    日和星期都不是 * 时，满足其中之一即可（与 cron 相同）。
+    """
+
+    __slots__ = ('expression', 'minutes', 'hours', 'days', 'months', 'weekdays', '_any_day', '_any_weekday')
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 表达式需要 5 个字段: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(text, low, high) for text, (low, high) in zip(fields, CRON_FIELDS))
+        self.weekdays = {day % 7 for day in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment):
+        """返回严格晚于 moment 的第一个匹配时间（精确到分钟），找不到时返回 None。"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + SEARCH_LIMIT
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        return None
+
+
+class BurstWindow:
+    """商家或商品的 burst_windows 中的一项。
+
+    cron 为时段开始时间，duration 为时段长度（秒），interval 为时段内的检查间隔（秒），
+    warmup 为开始前多少秒做一次预热检查，timezone 为 cron 使用的时区（默认为本机时区）。
+    """
+
+    __slots__ = ('cron', 'duration', 'interval', 'warmup', 'timezone', '_tz', '_cache')
+
+    def __init__(self, cron, duration, interval=2, warmup=60, timezone=None):
+        if duration <= 0 or interval <= 0 or warmup < 0:
+            raise ValueError("duration 和 interval 必须大于 0，warmup 不能小于 0")
+        self.cron = CronExpression(cron)
+        self.duration = duration
+        self.interval = interval
+        self.warmup = warmup
+        self.timezone = timezone
+        self._tz = None
+        if timezone:
+            from zoneinfo import ZoneInfo  # Python 3.9+
+
+            try:
+                self._tz = ZoneInfo(timezone)
+            except (KeyError, ValueError) as e:
+                raise ValueError(f"未知的时区 {timezone}: {e}")
+        self._cache = {}  # 查询的分钟 -> 下一次开始时间
+
+    @classmethod
+    def from_config(cls, options):
+        """根据 burst_windows 中的一项创建时段，不合法时抛出 ValueError。"""
+        if not isinstance(options, dict) or 'cron' not in options or 'duration' not in options:
+            raise ValueError("burst_windows 的每一项需要 cron 和 duration 字段")
+        return cls(options['cron'], options['duration'], interval=options.get('interval', 2),
+                   warmup=options.get('warmup', 60), timezone=options.get('timezone'))
+
+    def next_start(self, now):
+        """严格晚于 now（Unix 时间戳）的下一次开始时间戳，找不到时返回 None。"""
+        minute = int(now // 60)
+        if minute in self._cache:
+            return self._cache[minute]
+        local = datetime.fromtimestamp(minute * 60, self._tz).replace(tzinfo=None)
+        start = self.cron.next_after(local)
+        # 夏令时结束时本地时间有一小时重复，处在第二遍时匹配到的本地时间（取第一遍）可能已经过去
+        while start is not None and start.replace(tzinfo=self._tz).timestamp() <= minute * 60:
+            start = self.cron.next_after(start)
+        result = start.replace(tzinfo=self._tz).timestamp() if start is not None else None
+        if len(self._cache) >= 8:
+            self._cache.clear()
+        self._cache[minute] = result
+        return result
+
+    def active_until(self, now):
+        """now 在时段内时返回时段结束的时间戳，否则返回 None。"""
+        start = self.next_start(now - self.duration)
+        if start is not None and start <= now < start + self.duration:
+            return start + self.duration
+        return None
+
+    def key(self):
+        return (self.cron.expression, self.duration, self.interval, self.warmup, self.timezone)
+
+    def __eq__(self, other):
+        return isinstance(other, BurstWindow) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+def active_window(windows, now):
+    """返回 now 所在的时段（多个时段重叠时取间隔最短的），不在任何时段内时返回 None。"""
+    active = [window for window in windows if window.active_until(now) is not None]
+    return min(active, key=lambda window: window.interval) if active else None
+
+
+def next_wakeup(windows, now):
+    """不在时段内时，下一次需要检查的时间戳：预热时间，已过预热时间则为时段开始时间。"""
+    wakeups = []
+    for window in windows:
+        start = window.next_start(now)
+        if start is None:
+            continue
+        warmup = start - window.warmup
+        wakeups.append(warmup if warmup > now else start)
+    return min(wakeups) if wakeups else None
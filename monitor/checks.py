@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""商品检查的公共步骤：获取页面、检查标题、判断库存和生成通知消息。
+
+monitor.py、monitor2.py 和 engine.py 共用。
+"""
+import asyncio
+import html
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+
+from clearance import detect_challenge
+from host_health import backoff_delay
+from log_pipeline import SAMPLED
+from metrics import FETCH_RETRIES, FETCH_SECONDS, HTTP_ERRORS, TITLE_MISMATCHES, TRANSITION_CONFIRMATIONS
+from page_parser import parse_page
+from response_rule import InterceptedPage
+
+logger = logging.getLogger(__name__)
+
+
+def get_random_user_agent():
+    """返回一个随机的 User-Agent。"""
+    user_agents = [
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15",
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0",
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1",
+    ]
+    return random.choice(user_agents)
+
+
+async def fetch_page_content(browser_pool, url, enable_javascript=False, retries=3, parser_backend='auto',
+                             emulate_human=True, clearance=None):
+    """提取并解析整个页面内容，支持动态启用/禁用 JavaScript。浏览器由常驻浏览器池提供。
+
+    页面只解析一次，返回 ParsedPage 供标题检查和库存判断共用。emulate_human 为 False 时
+    跳过随机等待和鼠标移动，页面加载完成后立即读取内容。提供 clearance（ClearanceCache）时
+    带上主机缓存的验证 Cookie 和 User-Agent，成功后保存新的验证 Cookie，遇到验证页时删除缓存。
+    """
+    host = urlsplit(url).netloc
+    for attempt in range(retries):
+        try:
+            entry = clearance.get(host) if clearance is not None else None
+            # 每次尝试的耗时，包括等待浏览器池空闲和模拟人类操作的延迟
+            with FETCH_SECONDS.time(backend='playwright', javascript=str(enable_javascript).lower()):
+                async with browser_pool.page(enable_javascript, entry.user_agent if entry is not None else None) as page:
+                    if entry is not None:
+                        await page.context.add_cookies(entry.browser_cookies())
+                    # 模拟人类行为：随机延迟
+                    response = await page.goto(url, wait_until='networkidle', timeout=120000)
+                    if response.status != 200:
+                        HTTP_ERRORS.inc(backend='playwright', status=response.status)
+                        logger.warning(f"HTTP 请求失败，状态码: {response.status}。URL: {url}")
+                        if clearance is not None:
+                            reason = detect_challenge(response.status, response.headers, await page.content())
+                            if reason is not None:
+                                clearance.invalidate(host, reason)
+                        return None
+
+                    if emulate_human:
+                        await page.wait_for_timeout(random.randint(3000, 7000))  # 随机延迟 3-7 秒
+
+                        # 模拟鼠标移动
+                        await page.mouse.move(random.randint(100, 500), random.randint(100, 500))
+                        await page.wait_for_timeout(random.randint(1000, 3000))  # 随机延迟 1-3 秒
+
+                    # 如果启用 JavaScript，模拟点击 "Order" 按钮
+                    if enable_javascript:
+                        await page.click('button:has-text("Order")')  # 假设按钮文本为 "Order"
+                        await page.wait_for_timeout(5000)  # 等待页面加载
+
+                    # 提取整个页面内容
+                    page_content = await page.content()
+                    if clearance is not None:
+                        request_headers = await response.request.all_headers()
+                        clearance.update(host, request_headers.get('user-agent'), await page.context.cookies(url))
+
+            parsed_page = parse_page(page_content, parser_backend)
+            logger.info("成功提取页面内容。URL: %s, JavaScript: %s", url, '启用' if enable_javascript else '禁用', extra=SAMPLED)
+            return parsed_page
+        except Exception as e:
+            logger.warning(f"第 {attempt + 1} 次尝试失败，URL: {url}，错误: {e}")
+            if attempt == retries - 1:
+                logger.error(f"经过 {retries} 次尝试后仍无法获取 URL: {url} 的内容")
+                return None
+            FETCH_RETRIES.inc(backend='playwright')
+            await asyncio.sleep(backoff_delay(attempt, base=5))  # 指数退避后重试
+
+
+def title_matches(parsed_page, expected_title, url, ignore_case=False):
+    """检查 <title> 标签内容是否包含 expected_title。"""
+    if not expected_title:
+        return True
+    title = parsed_page.title
+    if title is not None and ignore_case:
+        title, expected_title = title.lower(), expected_title.lower()
+    if title is None or expected_title not in title:
+        TITLE_MISMATCHES.inc()
+        logger.warning(f"页面标题不符合预期。URL: {url}")
+        return False
+    return True
+
+
+def response_in_stock(page, out_of_stock_text, url):
+    """按商品的无库存文本判断接口响应（InterceptedPage）中的库存状态。"""
+    in_stock = page.in_stock(out_of_stock_text)
+    logger.info("%s库存（根据 %s）。URL: %s", '有' if in_stock else '无', page.url, url, extra=SAMPLED)
+    return in_stock
+
+
+def parse_stock(parsed_page, out_of_stock_text, url, enable_javascript):
+    """根据解析后的页面信息判断库存。"""
+    try:
+        if parsed_page is None:
+            logger.warning(f"页面内容为空。URL: {url}")
+            return False
+
+        if isinstance(parsed_page, InterceptedPage):
+            return response_in_stock(parsed_page, out_of_stock_text, url)
+
+        # 优先检查页面内容
+        if out_of_stock_text in parsed_page.text:
+            logger.info("无库存（根据页面内容）。URL: %s", url, extra=SAMPLED)
+            return False
+
+        # 如果启用 JavaScript，继续检查 errors 数组
+        if enable_javascript:
+            errors_list = parsed_page.errors
+            if errors_list is None:
+                logger.warning(f"未找到 errors 数组或无法解析。URL: {url}")
+                return True  # 假设有库存
+
+            logger.debug("errors 数组内容: %s", errors_list)
+
+            # 如果 errors 数组包含 out_of_stock_text，则无库存
+            if errors_list and any(out_of_stock_text in error for error in errors_list):
+                logger.info("无库存（根据 errors 数组）。URL: %s", url, extra=SAMPLED)
+                return False
+            else:
+                logger.info("有库存（根据 errors 数组）。URL: %s", url, extra=SAMPLED)
+                return True
+        else:
+            logger.info("有库存（根据页面内容）。URL: %s", url, extra=SAMPLED)
+            return True
+    except Exception as e:
+        logger.error(f"解析页面内容时出错。URL: {url}, 错误: {e}")
+        return True  # 假设解析错误意味着有库存
+
+
+def parse_stock_count(parsed_page, out_of_stock_text, url):
+    """按 "N in stock" 优先的规则判断库存（与根目录和 bwh 的脚本一致）。
+
+    返回库存数量：找到 "N in stock" 时为 N，包含无库存文本时为 0，都没有时视为有库存（inf）。
+    接口响应的字段为数字时即为库存数量。
+    """
+    if isinstance(parsed_page, InterceptedPage):
+        if parsed_page.stock_count is not None:
+            logger.info("Stock found: %s in stock (response %s). URL: %s", parsed_page.stock_count, parsed_page.url, url,
+                        extra=SAMPLED)
+            return parsed_page.stock_count
+        return float('inf') if response_in_stock(parsed_page, out_of_stock_text, url) else 0
+    if parsed_page.stock_count is not None:
+        logger.info("Stock found: %s in stock. URL: %s", parsed_page.stock_count, url, extra=SAMPLED)
+        return parsed_page.stock_count
+    if out_of_stock_text in parsed_page.text:
+        logger.info("Out of stock. URL: %s", url, extra=SAMPLED)
+        return 0
+    logger.info("Stock information not found, assuming in stock. URL: %s", url, extra=SAMPLED)
+    return float('inf')
+
+
+async def confirm_transition(fetch, detect, in_stock, deadline, url):
+    """库存状态将要变化时立即复查一次，复查结果相同才确认，返回是否确认。
+
+    fetch() 获取并解析页面（不使用合并或缓存的结果），限时 deadline 秒；detect(parsed_page)
+    返回复查得到的库存状态，页面不可用（如标题不符）时返回 None。复查失败、超时或结果
+    不同时不确认，状态保持不变，等下次检查。
+    """
+    started = time.monotonic()
+    try:
+        parsed_page = await asyncio.wait_for(fetch(), deadline)
+    except asyncio.TimeoutError:
+        logger.warning(f"复查超过 {deadline} 秒，暂不发送通知。URL: {url}")
+        parsed_page = None
+    except Exception as e:
+        logger.warning(f"复查时出错，暂不发送通知。URL: {url}，错误: {e}")
+        parsed_page = None
+    confirmed = detect(parsed_page) if parsed_page is not None else None
+    if confirmed is None:
+        TRANSITION_CONFIRMATIONS.inc(result='failed')
+        return False
+    if confirmed != in_stock:
+        TRANSITION_CONFIRMATIONS.inc(result='rejected')
+        logger.info(f"复查结果为{'有' if confirmed else '无'}库存，与检查结果不同，不发送通知。URL: {url}")
+        return False
+    TRANSITION_CONFIRMATIONS.inc(result='confirmed')
+    logger.info(f"复查确认{'有' if in_stock else '无'}库存，耗时 {time.monotonic() - started:.2f} 秒。URL: {url}")
+    return True
+
+
+def format_message(item, in_stock):
+    """生成商品的 Telegram 通知消息（HTML 格式）。"""
+    merchant = item.merchant
+    title = f"{merchant.name}-{item.title}"
+    tag = html.escape(merchant.tag)
+    price = html.escape(item.price)
+    hardware_info = f"<a href=\"{item.buy_url}\">{html.escape(item.hardware_info)}</a>"
+    stock_info = f'🛒 <a href="{item.buy_url}">库   存：{"有 - 抢购吧！" if in_stock else "无 - 已售罄！"}</a>'
+    buy_link = f"🔗 <s>{item.buy_url}</s>" if not in_stock else f"🔗 {item.buy_url}"
+    annual_coupon = f"🎁 优惠码：<code>{merchant.coupon_annual}</code>" if merchant.coupon_annual else ""
+    coupon_section = f"\n\n{annual_coupon}\n\n" if annual_coupon else "\n\n"
+
+    return (
+        f"<b>{title}</b>\n\n"
+        f"💰 价  格: <b>{price}</b>\n\n"
+        f"📜 配  置：{hardware_info}\n\n"
+        f"ℹ️ {tag}"
+        f"{coupon_section}"
+        f"{stock_info}\n\n"
+        f"{buy_link}"
+    )
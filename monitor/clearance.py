@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""按主机缓存 Cloudflare 等验证通过后的 Cookie 和 User-Agent，HTTP 和浏览器后端共用。"""
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Cloudflare 等 JS 验证页的特征文本
+CHALLENGE_MARKERS = (
+    '_cf_chl_opt',
+    'cf-browser-verification',
+    '/cdn-cgi/challenge-platform/',
+    '<title>Just a moment...</title>',
+    'Checking your browser before accessing',
+    'Enable JavaScript and cookies to continue',
+    'DDoS-Guard',
+)
+# 验证页的状态码；正常页面中也可能嵌入 challenge-platform 脚本，因此只在这些状态码下检查特征文本
+CHALLENGE_STATUSES = (403, 429, 503)
+# 验证通过后下发的 Cookie（名称前缀）
+CLEARANCE_COOKIE_PREFIXES = ('cf_clearance', '__ddg')
+COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'expires', 'secure')
+
+
+def detect_challenge(status_code, headers, text):
+    """判断响应是否为 Cloudflare 等 JS 验证页，是则返回原因，否则返回 None。"""
+    if headers.get('cf-mitigated') == 'challenge':
+        return f"Cloudflare 验证（{status_code}，cf-mitigated）"
+    if status_code not in CHALLENGE_STATUSES:
+        return None
+    for marker in CHALLENGE_MARKERS:
+        if marker in text:
+            return f"验证页（{status_code}，{marker}）"
+    return None
+
+
+def cookies_from_jar(jar):
+    """把 requests 的 CookieJar 转换为缓存使用的 Cookie 列表。"""
+    return [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path,
+             'expires': cookie.expires if cookie.expires is not None else -1, 'secure': cookie.secure}
+            for cookie in jar]
+
+
+def _is_clearance_cookie(cookie):
+    return cookie['name'].startswith(CLEARANCE_COOKIE_PREFIXES)
+
+
+class Clearance:
+    """一个主机的验证结果：User-Agent、Cookie 列表和过期时间（Unix 时间戳）。"""
+
+    __slots__ = ('user_agent', 'cookies', 'expires')
+
+    def __init__(self, user_agent, cookies, expires):
+        self.user_agent = user_agent
+        self.cookies = cookies
+        self.expires = expires
+
+    def tokens(self):
+        """用于判断验证结果是否变化的 (名称, 值) 集合。"""
+        return {(cookie['name'], cookie['value']) for cookie in self.cookies if _is_clearance_cookie(cookie)}
+
+    def apply_to_session(self, session):
+        """把 Cookie 和 User-Agent 写入 requests 会话（cf_clearance 与 User-Agent 绑定，必须一起使用）。"""
+        for cookie in self.cookies:
+            session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'],
+                                secure=cookie['secure'], expires=int(cookie['expires']) if cookie['expires'] > 0 else None)
+        if self.user_agent:
+            session.headers['User-Agent'] = self.user_agent
+
+    def browser_cookies(self):
+        """Playwright add_cookies() 使用的 Cookie 列表。"""
+        return [{'name': cookie['name'], 'value': cookie['value'], 'domain': cookie['domain'],
+                 'path': cookie['path'] or '/', 'expires': cookie['expires'], 'secure': cookie['secure']}
+                for cookie in self.cookies]
+
+
+class ClearanceCache:
+    """按主机保存验证通过后的 Cookie 和 User-Agent，持久化到 filename，重启后继续使用。
+
+    只有包含 cf_clearance 等验证 Cookie 时才缓存；条目在 ttl 秒或验证 Cookie 过期后失效，
+    再次遇到验证页时立即删除。
+    """
+
+    def __init__(self, filename, ttl=1800):
+        self.filename = filename
+        self.ttl = ttl
+        self._entries = self._load()
+
+    @classmethod
+    def from_config(cls, config, filename, local_path=None):
+        """根据配置文件中的 clearance 段创建缓存，未启用时返回 None。
+
+        提供 local_path 时，用它把配置的文件路径转换为本进程使用的路径（如集群模式下每个进程一个文件）。
+        """
+        options = config.get('clearance', {})
+        if not options.get('enabled', True):
+            return None
+        filename = options.get('file', filename)
+        return cls(local_path(filename) if local_path is not None else filename, ttl=options.get('ttl', 1800))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, host):
+        """返回主机未过期的验证结果，没有则返回 None。"""
+        entry = self._entries.get(host)
+        if entry is not None and entry.expires <= time.time():
+            del self._entries[host]
+            return None
+        return entry
+
+    def update(self, host, user_agent, cookies):
+        """成功获取页面后调用；验证 Cookie 有变化时更新缓存并保存，返回是否更新。"""
+        cookies = [{field: cookie.get(field) for field in COOKIE_FIELDS} for cookie in cookies]
+        for cookie in cookies:
+            if cookie['expires'] is None or cookie['expires'] <= 0:
+                cookie['expires'] = -1  # 会话 Cookie
+        clearance_cookies = [cookie for cookie in cookies if _is_clearance_cookie(cookie)]
+        if not clearance_cookies:
+            return False
+        expires = time.time() + self.ttl
+        for cookie in clearance_cookies:
+            if cookie['expires'] > 0:
+                expires = min(expires, cookie['expires'])
+        entry = Clearance(user_agent, cookies, expires)
+        previous = self.get(host)
+        if previous is not None and previous.user_agent == user_agent and previous.tokens() == entry.tokens():
+            return False
+        self._entries[host] = entry
+        logger.info(f"已缓存主机 {host} 的验证 Cookie，{int(expires - time.time())} 秒后过期。")
+        self._save()
+        return True
+
+    def invalidate(self, host, reason=''):
+        """再次遇到验证页时删除主机的缓存。"""
+        if self._entries.pop(host, None) is not None:
+            logger.info(f"主机 {host} 的验证 Cookie 已失效{'：' + reason if reason else ''}。")
+            self._save()
+
+    def _load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return {}
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"读取验证 Cookie 缓存文件出错: {e}")
+            return {}
+        now = time.time()
+        return {host: Clearance(entry['user_agent'], entry['cookies'], entry['expires'])
+                for host, entry in data.items() if entry['expires'] > now}
+
+    def _save(self):
+        """原子地写入所有未过期的条目。"""
+        if not self.filename:
+            return
+        now = time.time()
+        data = {host: {'user_agent': entry.user_agent, 'cookies': entry.cookies, 'expires': entry.expires}
+                for host, entry in self._entries.items() if entry.expires > now}
+        temp_file = f"{self.filename}.tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_file, self.filename)
+        except OSError as e:
+            logger.error(f"保存验证 Cookie 缓存文件出错: {e}")
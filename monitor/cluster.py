@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""多进程协同检查：一致性哈希分配商品，SQLite 中的可续约租约保证每个商品同时只有一个进程负责。"""
+import bisect
+import hashlib
+import logging
+import os
+import re
+import socket
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    item_key TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_worker ON leases (worker_id);
+'''
+
+
+def worker_path(path, worker_id):
+    """在文件名的扩展名前加上进程 ID，使同一台机器上的多个进程各用一个文件。"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.{re.sub(r'[^A-Za-z0-9_.-]', '_', worker_id)}{extension}"
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """一致性哈希环：每个进程占 replicas 个虚拟节点，增减进程时只有少量商品换主。"""
+
+    def __init__(self, workers, replicas=64):
+        self.workers = frozenset(workers)
+        self._ring = sorted((_hash(f"{worker}#{index}"), worker) for worker in self.workers for index in range(replicas))
+        self._points = [point for point, _ in self._ring]
+
+    def owner(self, key):
+        """返回负责该键的进程，环为空时返回 None。"""
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class LeaseStore:
+    """保存存活进程和商品租约的 SQLite 数据库（WAL 模式），同一台机器上的进程可直接共用。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None, timeout=10)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def heartbeat(self, worker_id, expires):
+        self._conn.execute('INSERT INTO workers (worker_id, expires) VALUES (?, ?) '
+                           'ON CONFLICT(worker_id) DO UPDATE SET expires = excluded.expires', (worker_id, expires))
+
+    def purge(self, now):
+        """删除已过期的进程记录和租约（进程异常退出后留下的）。"""
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute('DELETE FROM workers WHERE expires <= ?', (now,))
+            self._conn.execute('DELETE FROM leases WHERE expires <= ?', (now,))
+
+    def live_workers(self, now):
+        return {row[0] for row in self._conn.execute('SELECT worker_id FROM workers WHERE expires > ?', (now,))}
+
+    def acquire(self, worker_id, keys, now, expires):
+        """获取或续约 keys 的租约（已被其他进程持有且未过期的除外），返回本进程当前持有的全部键。"""
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany(
+                'INSERT INTO leases (item_key, worker_id, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT(item_key) DO UPDATE SET worker_id = excluded.worker_id, expires = excluded.expires '
+                'WHERE leases.worker_id = excluded.worker_id OR leases.expires <= ?',
+                [(key, worker_id, expires, now) for key in keys],
+            )
+            return {row[0] for row in self._conn.execute(
+                'SELECT item_key FROM leases WHERE worker_id = ? AND expires > ?', (worker_id, now))}
+
+    def release(self, worker_id, keys):
+        self._conn.executemany('DELETE FROM leases WHERE item_key = ? AND worker_id = ?',
+                               [(key, worker_id) for key in keys])
+
+    def holder(self, key, now):
+        """返回当前持有该键租约的进程，没有有效租约时返回 None。"""
+        row = self._conn.execute('SELECT worker_id FROM leases WHERE item_key = ? AND expires > ?', (key, now)).fetchone()
+        return row[0] if row else None
+
+    def leave(self, worker_id):
+        """释放进程的所有租约并注销，其他进程在下次续约时立即接手。"""
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute('DELETE FROM leases WHERE worker_id = ?', (worker_id,))
+            self._conn.execute('DELETE FROM workers WHERE worker_id = ?', (worker_id,))
+
+    def close(self):
+        self._conn.close()
+
+
+class Coordinator:
+    """一个检查进程在集群中的协调器。
+
+    每次 tick() 发送心跳、按存活进程重建哈希环，获取环上分配给本进程的商品的租约并
+    续约，释放不再分配给本进程的租约。进程退出或停止心跳 lease_ttl 秒后，它的商品由
+    其他进程接手。发送通知前用 confirm() 在数据库中确认租约仍由本进程持有。
+    """
+
+    def __init__(self, store, worker_id, lease_ttl=30, replicas=64):
+        self.store = store
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.replicas = replicas
+        self.ring = HashRing((), replicas)
+        self._held = set()
+        self._held_until = 0.0
+        self._last_tick = 0.0
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置文件中的 cluster 段创建协调器，未启用时返回 None。"""
+        options = config.get('cluster', {})
+        if not options.get('enabled', False):
+            return None
+        worker_id = options.get('worker_id') or f"{socket.gethostname()}-{os.getpid()}"
+        return cls(LeaseStore(options.get('store', '/root/monitor/cluster.db')), worker_id,
+                   lease_ttl=options.get('lease_ttl', 30), replicas=options.get('replicas', 64))
+
+    def __len__(self):
+        return len(self._held)
+
+    def due(self):
+        """距上次 tick() 已超过租约有效期的三分之一。"""
+        return time.time() - self._last_tick >= self.lease_ttl / 3
+
+    def owns(self, key):
+        """本进程是否持有该键的有效租约（按上次 tick() 的结果）。"""
+        return key in self._held and time.time() < self._held_until
+
+    def confirm(self, key):
+        """在数据库中确认本进程仍持有该键的租约。"""
+        return self.owns(key) and self.store.holder(key, time.time()) == self.worker_id
+
+    def tick(self, keys):
+        """续约并重新分配，返回 (新获得的键, 失去的键)。"""
+        now = time.time()
+        self._last_tick = now
+        self.store.heartbeat(self.worker_id, now + self.lease_ttl)
+        self.store.purge(now)
+        workers = self.store.live_workers(now)
+        if workers != self.ring.workers:
+            logger.info(f"集群中有 {len(workers)} 个检查进程: {', '.join(sorted(workers))}")
+            self.ring = HashRing(workers, self.replicas)
+        wanted = {key for key in keys if self.ring.owner(key) == self.worker_id}
+        unwanted = self._held - wanted
+        if unwanted:
+            self.store.release(self.worker_id, unwanted)
+        held = self.store.acquire(self.worker_id, wanted, now, now + self.lease_ttl) if wanted else set()
+        held &= wanted
+        acquired, lost = held - self._held, self._held - held
+        self._held = held
+        self._held_until = now + self.lease_ttl
+        if acquired or lost:
+            logger.info(f"本进程（{self.worker_id}）接手 {len(acquired)} 个商品，交出 {len(lost)} 个，"
+                        f"当前负责 {len(held)} 个。")
+        return acquired, lost
+
+    def leave(self):
+        self.store.leave(self.worker_id)
+        self._held = set()
+        self.store.close()
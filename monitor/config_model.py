@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+
+from burst import BurstWindow
+from response_rule import ResponseRule
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_MERCHANT_KEYS = ('name', 'tag', 'out_of_stock_text', 'stock_urls')
+REQUIRED_STOCK_KEYS = ('title', 'check_url', 'buy_url', 'price', 'hardware_info')
+
+
+class ConfigError(ValueError):
+    """配置文件内容不合法。"""
+
+
+class Merchant:
+    """商家信息，同一商家的商品共用一个实例。"""
+
+    __slots__ = ('name', 'tag', 'coupon_annual', 'out_of_stock_text')
+
+    def __init__(self, name, tag, coupon_annual, out_of_stock_text):
+        self.name = name
+        self.tag = tag
+        self.coupon_annual = coupon_annual
+        self.out_of_stock_text = out_of_stock_text
+
+    def key(self):
+        return (self.name, self.tag, self.coupon_annual, self.out_of_stock_text)
+
+
+class StockItem:
+    """一个启用的待监控商品，检查参数已按 商品 > 商家 > 全局 的优先级合并。"""
+
+    __slots__ = ('item_id', 'merchant', 'title', 'check_url', 'buy_url', 'price', 'hardware_info',
+                 'enable_javascript', 'expected_title', 'ready_selector', 'response_rule',
+                 'whmcs_gid', 'check_interval', 'check_jitter',
+                 'check_deadline', 'min_interval', 'max_interval', 'burst_windows')
+
+    def __init__(self, item_id, merchant, stock, defaults):
+        self.item_id = item_id
+        self.merchant = merchant
+        self.title = stock['title']
+        self.check_url = stock['check_url']
+        self.buy_url = stock['buy_url']
+        self.price = stock['price']
+        self.hardware_info = stock['hardware_info']
+        self.enable_javascript = bool(stock.get('enable_javascript', False))
+        self.expected_title = stock.get('expected_title')
+        self.ready_selector = stock.get('ready_selector')
+        self.response_rule = None
+        if stock.get('response_rule') is not None:
+            try:
+                self.response_rule = ResponseRule.from_config(stock['response_rule'])
+            except ValueError as e:
+                raise ConfigError(f"商品 {item_id}: {e}")
+        self.whmcs_gid = stock.get('whmcs_gid')
+        self.check_interval = stock.get('check_interval', defaults['check_interval'])
+        self.check_jitter = stock.get('check_jitter', defaults['check_jitter'])
+        self.check_deadline = stock.get('check_deadline', defaults['check_deadline'])
+        self.min_interval = stock.get('min_interval')
+        self.max_interval = stock.get('max_interval')
+        try:
+            self.burst_windows = tuple(BurstWindow.from_config(options)
+                                       for options in stock.get('burst_windows', defaults['burst_windows']))
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f"商品 {item_id} 的 burst_windows 无效: {e}")
+
+    @property
+    def out_of_stock_text(self):
+        return self.merchant.out_of_stock_text
+
+    def key(self):
+        """用于比较两次加载之间商品是否发生变化。"""
+        return (self.merchant.key(),) + tuple(getattr(self, name) for name in self.__slots__[2:])
+
+
+class CompiledConfig:
+    """校验并编译后的配置：全局设置加上按 item_id 索引的启用商品。
+
+    未建模的配置段（browser_pool、notifier 等）通过 get() 读取原始配置。
+    """
+
+    __slots__ = ('raw', 'telegram_token', 'telegram_chat_id', 'check_interval', 'items')
+
+    def __init__(self, raw, items):
+        self.raw = raw
+        self.telegram_token = raw['telegram_token']
+        self.telegram_chat_id = raw['telegram_chat_id']
+        self.check_interval = raw.get('check_interval', 600)
+        self.items = items
+
+    def get(self, key, default=None):
+        return self.raw.get(key, default)
+
+
+class ConfigDiff:
+    """两次配置之间新增、删除和变化的商品。"""
+
+    __slots__ = ('added', 'removed', 'changed')
+
+    def __init__(self, added, removed, changed):
+        self.added = added  # [StockItem]
+        self.removed = removed  # [item_id]
+        self.changed = changed  # [StockItem]，新版本
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self):
+        return f"新增 {len(self.added)} 个，删除 {len(self.removed)} 个，变更 {len(self.changed)} 个商品"
+
+
+def _require(mapping, keys, where):
+    missing = [key for key in keys if key not in mapping]
+    if missing:
+        raise ConfigError(f"{where} 缺少字段: {', '.join(missing)}")
+
+
+def compile_config(raw):
+    """校验原始配置并编译为 CompiledConfig，不合法时抛出 ConfigError。
+
+    商品以 id 字段（没有时用 title）作为稳定标识，与库存状态文件的键一致。
+    """
+    _require(raw, ('telegram_token', 'telegram_chat_id', 'merchants'), '配置文件')
+    defaults = {
+        'check_interval': raw.get('check_interval', 600),
+        'check_jitter': raw.get('check_jitter', 0.1),
+        'check_deadline': raw.get('check_deadline', 300),
+        'burst_windows': raw.get('burst_windows', []),
+    }
+    items = {}
+    for index, merchant_raw in enumerate(raw['merchants']):
+        _require(merchant_raw, REQUIRED_MERCHANT_KEYS, f"第 {index + 1} 个商家")
+        if not merchant_raw.get('enabled', True):
+            continue
+        merchant = Merchant(merchant_raw['name'], merchant_raw['tag'], merchant_raw.get('coupon_annual'),
+                            merchant_raw['out_of_stock_text'])
+        merchant_defaults = {key: merchant_raw.get(key, value) for key, value in defaults.items()}
+        for stock in merchant_raw['stock_urls']:
+            _require(stock, REQUIRED_STOCK_KEYS, f"商家 {merchant.name} 的商品")
+            item_id = stock.get('id', stock['title'])
+            if item_id in items:
+                raise ConfigError(f"商品标识重复: {item_id}，请为其中一个商品设置不同的 id。")
+            items[item_id] = StockItem(item_id, merchant, stock, merchant_defaults)
+    return CompiledConfig(raw, items)
+
+
+def load_compiled_config(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return compile_config(json.load(f))
+
+
+def diff_configs(old, new):
+    """比较两次编译的配置，返回 ConfigDiff。old 为 None 时所有商品都视为新增。"""
+    old_items = old.items if old is not None else {}
+    added = [item for item_id, item in new.items.items() if item_id not in old_items]
+    removed = [item_id for item_id in old_items if item_id not in new.items]
+    changed = [item for item_id, item in new.items.items()
+               if item_id in old_items and old_items[item_id].key() != item.key()]
+    return ConfigDiff(added, removed, changed)
+
+
+class ConfigWatcher:
+    """按文件修改时间和大小检测配置文件变化，只在变化时重新加载。"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._signature = None
+
+    def poll(self):
+        """文件有变化且内容合法时返回新的 CompiledConfig，否则返回 None。
+
+        内容不合法时记录错误并继续使用旧配置，直到文件再次变化。
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError as e:
+            logger.error(f"无法读取配置文件 {self.filename}: {e}")
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return None
+        self._signature = signature
+        try:
+            config = load_compiled_config(self.filename)
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"配置文件 {self.filename} 无效，继续使用旧配置: {e}")
+            return None
+        logger.info(f"已加载配置文件: {self.filename}")
+        return config
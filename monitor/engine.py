@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""多租户监控引擎。
+
+一个进程加载多个配置文件（租户），每个租户有自己的 Telegram 聊天、状态库和抓取后端
+（auto 分层抓取、cfscrape 或 Playwright），所有租户共用一个调度器、一个 HTTP 连接池、一个浏览器池和
+一个通知分发器。取代分别运行的 monitor.py、monitor/monitor.py 和 bwh/monitor.py。
+
+启用 cluster 后可以同时运行多个引擎进程，商品按一致性哈希分配，每个商品由持有其租约的
+进程检查和通知，进程退出后由其他进程接手。
+
+    python3 engine.py /root/monitor/engine.json
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import signal
+import sys
+import time
+from urllib.parse import urlsplit
+
+from browser_pool import BrowserPool
+from burst import active_window
+from checks import (confirm_transition, fetch_page_content, format_message, get_random_user_agent, parse_stock,
+                    parse_stock_count, title_matches)
+from clearance import ClearanceCache
+from cluster import Coordinator, worker_path
+from config_model import ConfigDiff, ConfigError, ConfigWatcher, diff_configs
+from events import EventServer, publish_check
+from fast_render import FastRenderer
+from fetch_engine import FetchEngine, create_plain_session, fetch_html
+from host_health import HostHealthTracker
+from log_pipeline import log_check, setup_logging
+from metrics import LAST_SUCCESS_AGE, TRANSITIONS, MetricsServer
+from notifier import Notifier
+from scheduler import Scheduler, apply_config_diff
+from singleflight import SingleFlight
+from state_store import StateStore
+from tiered_fetch import TieredFetcher
+from whmcs_groups import GroupAdapter
+
+# 配置日志（读取引擎配置后按其中的 logging 段重新设置）
+LOG_FILE = '/root/monitor/engine.log'
+setup_logging(LOG_FILE)
+logger = logging.getLogger()
+
+FETCH_BACKENDS = ('auto', 'cfscrape', 'playwright')
+# errors：页面文本，启用 JavaScript 的商品再检查 errors 数组（monitor.py）
+# text：只看页面文本（monitor2.py）
+# count："N in stock" 优先（根目录和 bwh 的脚本）
+STOCK_RULES = ('errors', 'text', 'count')
+
+
+def acquire_lock(lock_file_path='/root/monitor/engine.lock', retries=3, wait_time=5):
+    """尝试获取文件锁，若失败则重试。"""
+    lock_file = open(lock_file_path, 'w')
+    attempt = 0
+    while attempt < retries:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            logger.info("成功获取文件锁。")
+            return lock_file
+        except IOError:
+            logger.warning(f"第 {attempt + 1} 次尝试获取锁失败，{wait_time} 秒后重试...")
+            attempt += 1
+            time.sleep(wait_time)
+    logger.error("多次尝试后仍无法获取文件锁。")
+    sys.exit(1)
+
+
+def handle_shutdown(signum, frame):
+    """处理关闭信号，退出时在 main() 的 finally 中释放资源。"""
+    logger.info("正在优雅关闭...")
+    sys.exit(0)
+
+
+signal.signal(signal.SIGINT, handle_shutdown)
+signal.signal(signal.SIGTERM, handle_shutdown)
+
+
+class Tenant:
+    """一个配置文件对应的租户。
+
+    backend 为 auto（普通 HTTP → cfscrape → Playwright 分层升级）、cfscrape 或 playwright
+    （商品的 enable_javascript 决定是否启用 JavaScript），
+    stock_rule 为库存判断规则，initial_in_stock 为新商品的初始状态：为 True 时首次检查
+    有库存不发通知（monitor.py 的行为），为 False 时发通知（根目录和 bwh 的脚本）。
+    """
+
+    def __init__(self, name, config_file, state_db, legacy_state=None, backend='playwright',
+                 stock_rule='errors', initial_in_stock=True, emulate_human=True):
+        if ':' in name:
+            raise ConfigError(f"租户名称不能包含冒号: {name}")
+        if backend not in FETCH_BACKENDS:
+            raise ConfigError(f"租户 {name} 的 backend 无效: {backend}，可选 {', '.join(FETCH_BACKENDS)}")
+        if stock_rule not in STOCK_RULES:
+            raise ConfigError(f"租户 {name} 的 stock_rule 无效: {stock_rule}，可选 {', '.join(STOCK_RULES)}")
+        self.name = name
+        self.backend = backend
+        self.stock_rule = stock_rule
+        self.initial_in_stock = initial_in_stock
+        self.emulate_human = emulate_human
+        self.watcher = ConfigWatcher(config_file)
+        self.config = None
+        self.state_store = StateStore(state_db, legacy_json=legacy_state)
+
+    @classmethod
+    def from_settings(cls, options):
+        """根据引擎配置中 tenants 的一项创建租户。"""
+        missing = [key for key in ('name', 'config', 'state_db') if key not in options]
+        if missing:
+            raise ConfigError(f"租户配置缺少字段: {', '.join(missing)}")
+        return cls(
+            options['name'],
+            options['config'],
+            options['state_db'],
+            legacy_state=options.get('legacy_state'),
+            backend=options.get('backend', 'playwright'),
+            stock_rule=options.get('stock_rule', 'errors'),
+            initial_in_stock=options.get('initial_in_stock', True),
+            emulate_human=options.get('emulate_human', True),
+        )
+
+    def key(self, item_id):
+        """调度器、通知分发器和指标中使用的全局唯一商品键。"""
+        return f"{self.name}:{item_id}"
+
+    def reload(self):
+        """配置文件有变化且合法时重新加载，返回 ConfigDiff；否则返回 None。"""
+        new_config = self.watcher.poll()
+        if new_config is None:
+            return None
+        diff = diff_configs(self.config, new_config)
+        self.config = new_config
+        for item_id in new_config.items:
+            if item_id not in self.state_store:
+                # 多个进程共用状态库时，不能覆盖其他进程已写入的状态
+                self.state_store.setdefault(item_id, {'in_stock': self.initial_in_stock, 'message_id': None,
+                                                      'last_check': None})
+        return diff
+
+    def detect_stock(self, parsed_page, item):
+        """按租户的规则判断商品是否有库存。"""
+        if self.stock_rule == 'count':
+            return parse_stock_count(parsed_page, item.out_of_stock_text, item.check_url) > 0
+        return parse_stock(parsed_page, item.out_of_stock_text, item.check_url,
+                           item.enable_javascript and self.stock_rule == 'errors')
+
+
+class Engine:
+    """多租户监控引擎，所有租户共用调度器、连接池、浏览器池和通知分发器。"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.tenants = {}
+        for options in settings.get('tenants', []):
+            tenant = Tenant.from_settings(options)
+            if tenant.name in self.tenants:
+                raise ConfigError(f"租户名称重复: {tenant.name}")
+            self.tenants[tenant.name] = tenant
+        if not self.tenants:
+            raise ConfigError("引擎配置中没有租户。")
+        self.parser_backend = settings.get('parser_backend', 'auto')
+        self.coordinator = Coordinator.from_config(settings)
+        # 验证 Cookie 缓存由所有后端共用：任一后端通过验证后，其他后端也能使用
+        self.clearance = ClearanceCache.from_config(settings, '/root/monitor/engine_clearance.json', self._local_path)
+        self.fetch_engine = FetchEngine.from_config(settings, clearance=self.clearance)
+        self.http_engine = FetchEngine.from_config(settings, session_factory=create_plain_session, name='http',
+                                                   clearance=self.clearance)
+        self.group_adapter = GroupAdapter.from_config(settings, self.fetch_engine)
+        self.browser_pool = BrowserPool.from_config(settings, user_agent_factory=get_random_user_agent)
+        self.renderer = FastRenderer.from_config(settings, self.browser_pool, self.parser_backend, self.clearance)
+        self.notifier = Notifier.from_config(
+            settings, settings.get('notify_queue', '/root/monitor/engine_notify_queue.json'),
+            on_sent=self._message_sent,
+            message_id_for=self._message_id_for,
+            local_path=self._local_path,
+        )
+        self.tiered_fetcher = TieredFetcher(self.http_engine, self.fetch_engine, self.browser_pool,
+                                            parser_backend=self.parser_backend,
+                                            probe_interval=settings.get('tier_probe_interval', 3600),
+                                            clearance=self.clearance, renderer=self.renderer)
+        self.single_flight = SingleFlight(share_window=settings.get('share_window', 5))
+        self.host_health = HostHealthTracker.from_config(settings)
+        self.confirm_deadline = settings.get('confirm_deadline', 15)
+        self.scheduler = Scheduler(self.check, max_concurrency=settings.get('max_concurrency', 16))
+        self.metrics_server = MetricsServer.from_config(settings)
+        self.event_server = EventServer.from_config(settings)
+
+    def _local_path(self, path):
+        """集群模式下本进程独用的文件路径：加上 worker_id，避免同一台机器上的进程互相覆盖。"""
+        return worker_path(path, self.coordinator.worker_id) if self.coordinator is not None else path
+
+    def _split_key(self, key):
+        tenant_name, _, item_id = key.partition(':')
+        return self.tenants.get(tenant_name), item_id
+
+    def _message_sent(self, key, message_id):
+        tenant, item_id = self._split_key(key)
+        if tenant is not None:
+            tenant.state_store.set_message_id(item_id, message_id)
+
+    def _message_id_for(self, key):
+        tenant, item_id = self._split_key(key)
+        if tenant is None:
+            return None
+        return tenant.state_store.get(item_id, {}).get('message_id')
+
+    def apply(self, tenant, diff):
+        """把租户的配置变化应用到共用的调度器；集群模式下只排期本进程持有租约的商品。"""
+        if self.coordinator is not None:
+            def owned(items):
+                return [item for item in items if self.coordinator.owns(tenant.key(item.item_id))]
+            diff = ConfigDiff(owned(diff.added), diff.removed, owned(diff.changed))
+        apply_config_diff(self.scheduler, diff, key=tenant.key, payload=lambda item: (tenant, item))
+        for item in diff.added:
+            LAST_SUCCESS_AGE.touch(item=tenant.key(item.item_id))
+        for item_id in diff.removed:
+            LAST_SUCCESS_AGE.remove(item=tenant.key(item_id))
+
+    def rebalance(self):
+        """续约并按集群中的存活进程重新分配商品：接手的商品从状态库重新读取状态后排期，
+        交出的商品移出调度。
+        """
+        items = {tenant.key(item_id): (tenant, item)
+                 for tenant in self.tenants.values() for item_id, item in tenant.config.items.items()}
+        acquired, lost = self.coordinator.tick(items)
+        for key in lost:
+            self.scheduler.remove(key)
+            LAST_SUCCESS_AGE.remove(item=key)
+        for key in acquired:
+            tenant, item = items[key]
+            tenant.state_store.refresh(item.item_id)
+            self.apply(tenant, ConfigDiff([item], [], []))
+
+    async def fetch(self, tenant, item):
+        """按租户的后端获取并解析页面，返回 ParsedPage 或 InterceptedPage；失败或主机熔断时返回 None。"""
+        return await self._guarded(tenant, item, lambda: self._fetch(tenant, item))
+
+    async def _guarded(self, tenant, item, fetch):
+        if self.host_health is not None:
+            return await self.host_health.call(item.check_url, fetch, self._uses_browser(tenant, item))
+        return await fetch()
+
+    def _uses_browser(self, tenant, item):
+        """商品是否用浏览器获取，决定主机健康跟踪按哪个慢阈值判断耗时。"""
+        if item.enable_javascript:
+            return True
+        if tenant.backend == 'cfscrape':
+            return False
+        if tenant.backend == 'auto':
+            return self.tiered_fetcher.host_tier(urlsplit(item.check_url).netloc) == 'playwright'
+        return True
+
+    async def _fetch(self, tenant, item):
+        """后端、URL、JavaScript 模式和接口响应规则都相同的并发请求（包括不同租户之间）只获取一次。
+        WHMCS 商品（cart.php?a=add&pid=N）优先从分组页读取，无法使用分组页时再单独获取商品页。
+        只复用不超过商品当前检查间隔（集中检查时段内为时段的间隔）的结果。
+        """
+        url = item.check_url
+        window = active_window(item.burst_windows, time.time())
+        if window is not None:
+            max_age = window.interval
+        else:
+            stats = self.scheduler.stats(tenant.key(item.item_id))
+            max_age = stats['interval'] if stats is not None else None
+        if self.group_adapter is not None and not item.enable_javascript:
+            page = await self.group_adapter.fetch(item, max_age)
+            if page is not None:
+                return page
+        if tenant.backend == 'auto':
+            return await self.single_flight.do(
+                ('auto', url, item.enable_javascript, tenant.emulate_human, item.response_rule),
+                lambda: self.tiered_fetcher.fetch(url, item.expected_title, item.enable_javascript, tenant.emulate_human,
+                                                  item.ready_selector, item.out_of_stock_text, item.response_rule),
+                max_age,
+            )
+        if tenant.backend == 'cfscrape':
+            page = await self.single_flight.do(('cfscrape', url), lambda: fetch_html(self.fetch_engine, url), max_age)
+            return page.parse(self.parser_backend) if page is not None else None
+        if self.renderer is not None:
+            return await self.single_flight.do(
+                ('playwright', url, item.enable_javascript, tenant.emulate_human, item.response_rule),
+                lambda: self.renderer.fetch(url, item.enable_javascript, item.ready_selector, item.out_of_stock_text,
+                                            tenant.emulate_human, item.response_rule),
+                max_age,
+            )
+        return await self.single_flight.do(
+            ('playwright', url, item.enable_javascript, tenant.emulate_human),
+            lambda: fetch_page_content(self.browser_pool, url, item.enable_javascript,
+                                       parser_backend=self.parser_backend, emulate_human=tenant.emulate_human,
+                                       clearance=self.clearance),
+            max_age,
+        )
+
+    async def _confirm_fetch(self, tenant, item):
+        """状态变化前的复查：用能判断该商品的最便宜的方式重新获取页面，不使用合并或缓存的结果。
+
+        不需要 JavaScript、且主机用普通 HTTP 或 cfscrape 即可获取的商品（包括从分组页读取的商品）
+        直接请求商品页，其余商品用浏览器（快速渲染）获取。
+        """
+        url = item.check_url
+        if not item.enable_javascript:
+            tier = 'cfscrape' if tenant.backend == 'cfscrape' else None
+            if tenant.backend == 'auto':
+                tier = self.tiered_fetcher.host_tier(urlsplit(url).netloc) or 'http'
+            if tier in self.tiered_fetcher.engines:
+                page = await fetch_html(self.tiered_fetcher.engines[tier], url, retries=1)
+                return page.parse(self.parser_backend) if page is not None else None
+        if self.renderer is not None:
+            return await self.renderer.fetch(url, item.enable_javascript, item.ready_selector, item.out_of_stock_text,
+                                             tenant.emulate_human, item.response_rule)
+        return await fetch_page_content(self.browser_pool, url, item.enable_javascript, retries=1,
+                                        parser_backend=self.parser_backend, emulate_human=tenant.emulate_human,
+                                        clearance=self.clearance)
+
+    def _confirm_detect(self, tenant, item, parsed_page):
+        if not title_matches(parsed_page, item.expected_title, item.check_url, ignore_case=True):
+            return None
+        return tenant.detect_stock(parsed_page, item)
+
+    def _publish(self, tenant, item, in_stock, changed, detected_at):
+        if self.event_server is not None:
+            publish_check(self.event_server.bus, tenant.key(item.item_id), item, in_stock, changed, detected_at,
+                          tenant=tenant.name)
+
+    async def check(self, payload):
+        """检查一个租户的一个商品并处理库存状态变化，返回状态是否发生变化。"""
+        tenant, item = payload
+        started = time.monotonic()
+        parsed_page = await self.fetch(tenant, item)
+        fetched = time.monotonic()
+        detected_at = time.time()  # 用于统计从获取完成到通知发出的延迟
+        if parsed_page is None or not title_matches(parsed_page, item.expected_title, item.check_url, ignore_case=True):
+            return False
+
+        in_stock = tenant.detect_stock(parsed_page, item)
+        phases = {'fetch': fetched - started, 'detect': time.monotonic() - fetched}
+        key = tenant.key(item.item_id)
+        LAST_SUCCESS_AGE.touch(item=key)
+        previous_status = tenant.state_store.get(item.item_id, {'in_stock': tenant.initial_in_stock, 'message_id': None})
+        chat_id = tenant.config.telegram_chat_id
+        if in_stock != previous_status['in_stock'] and self.confirm_deadline:
+            # 单次异常页面（渲染不完整、按默认规则视为有库存等）不发通知，复查确认后才改变状态
+            confirming = time.monotonic()
+            confirmed = await confirm_transition(
+                lambda: self._guarded(tenant, item, lambda: self._confirm_fetch(tenant, item)),
+                lambda page: self._confirm_detect(tenant, item, page),
+                in_stock, self.confirm_deadline, item.check_url,
+            )
+            phases['confirm'] = time.monotonic() - confirming
+            if not confirmed:
+                self._publish(tenant, item, previous_status['in_stock'], False, detected_at)
+                log_check(logger, key, previous_status['in_stock'], False, phases)
+                return False
+        if in_stock != previous_status['in_stock'] and self.coordinator is not None and not self.coordinator.confirm(key):
+            logger.info(f"商品 {key} 的租约已不属于本进程，不发送通知。")
+            return False
+
+        self._publish(tenant, item, in_stock, in_stock != previous_status['in_stock'], detected_at)
+        if in_stock and not previous_status['in_stock']:
+            # message_id 在消息实际发出后由分发器回填
+            tenant.state_store.put(item.item_id, {'in_stock': True, 'message_id': None, 'last_check': int(time.time())})
+            self.notifier.send(key, chat_id, format_message(item, True), detected_at)
+            TRANSITIONS.inc(state='in_stock')
+            changed = True
+        elif not in_stock and previous_status['in_stock']:
+            self.notifier.edit(key, chat_id, format_message(item, False), detected_at)
+            tenant.state_store.put(item.item_id, {'in_stock': False, 'message_id': previous_status['message_id'],
+                                                  'last_check': int(time.time())})
+            TRANSITIONS.inc(state='out_of_stock')
+            changed = True
+        else:
+            changed = False
+        log_check(logger, key, in_stock, changed, phases)
+        return changed
+
+    async def run(self):
+        """加载所有租户的配置并持续运行，配置文件变化时把差异应用到调度器。"""
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        if self.event_server is not None:
+            await self.event_server.start()
+        await self.notifier.start()
+        for tenant in self.tenants.values():
+            diff = tenant.reload()
+            if diff is None:
+                raise ConfigError(f"无法加载租户 {tenant.name} 的配置文件 {tenant.watcher.filename}。")
+            self.apply(tenant, diff)
+            logger.info(f"租户 {tenant.name}（{tenant.backend}）已加载 {len(tenant.config.items)} 个商品。")
+        if self.coordinator is not None:
+            self.rebalance()
+
+        scheduler_task = asyncio.create_task(self.scheduler.run())
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        try:
+            while True:
+                await asyncio.sleep(self.settings.get('config_poll_interval', 5))
+                if scheduler_task.done():
+                    scheduler_task.result()  # 调度器异常退出时抛出异常
+
+                any_reloaded = False
+                for tenant in self.tenants.values():
+                    diff = tenant.reload()
+                    if diff is not None:
+                        any_reloaded = True
+                        self.apply(tenant, diff)
+                        logger.info(f"租户 {tenant.name} 配置已更新：{diff}。")
+                if self.coordinator is not None and (self.coordinator.due() or any_reloaded):
+                    self.rebalance()
+
+                if loop.time() - last_report >= self.settings.get('report_interval', 600):
+                    last_report = loop.time()
+                    logger.info(f"页面获取 {self.single_flight.started} 次，合并重复请求 {self.single_flight.shared} 次，"
+                                f"待发送通知 {self.notifier.pending()} 条；分层抓取各层次数 {self.tiered_fetcher.counts}，"
+                                f"升级 {self.tiered_fetcher.escalations} 次。"
+                                + (f"异常主机 {self.host_health.unhealthy()}。" if self.host_health is not None else '')
+                                + (f"本进程负责 {len(self.coordinator)} 个商品。" if self.coordinator is not None else ''))
+        finally:
+            scheduler_task.cancel()
+            await asyncio.gather(scheduler_task, return_exceptions=True)
+
+    async def close(self):
+        if self.coordinator is not None:
+            self.coordinator.leave()
+        await self.browser_pool.close()
+        self.fetch_engine.close()
+        self.http_engine.close()
+        await self.notifier.close()
+        for tenant in self.tenants.values():
+            tenant.state_store.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        if self.event_server is not None:
+            await self.event_server.close()
+
+
+def load_settings(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+async def main(settings_file='/root/monitor/engine.json'):
+    """主函数。"""
+    try:
+        settings = load_settings(settings_file)
+    except (OSError, ValueError) as e:
+        logger.error(f"无法加载引擎配置 {settings_file}: {e}")
+        sys.exit(1)
+    setup_logging(LOG_FILE, settings.get('logging'))
+    # 集群模式下由租约协调多个进程，不再使用文件锁
+    cluster = settings.get('cluster', {}).get('enabled', False)
+    lock_file = None if cluster else acquire_lock(settings.get('lock_file', '/root/monitor/engine.lock'))
+    engine = None
+    try:
+        engine = Engine(settings)
+        await engine.run()
+    except Exception as e:
+        logger.error(f"发生错误: {e}")
+    finally:
+        if engine is not None:
+            await engine.close()
+        if lock_file is not None:
+            lock_file.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*sys.argv[1:2]))
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""进程内的库存事件总线和本地推送接口（Server-Sent Events）。
+
+每次检查结果和库存状态变化都发布到 EventBus，订阅者立即收到，不经过 Telegram。
+配置中启用 events 后，EventServer 在本地端口以 GET /events 推送事件流：
+
+    curl -N 'http://127.0.0.1:9109/events?merchant=📦 ClawCloud&type=transition'
+
+merchant 和 type 可以重复指定，用于筛选商家和事件类型（check、transition）；
+replay=N 在连接时先发送最近 N 条匹配的事件。断线重连时客户端带上 Last-Event-ID
+请求头（或 last_event_id 参数），服务器从回放缓冲区补发错过的事件；错过的事件
+已不在缓冲区中（或进程已重启）时，先发送一条 reset 事件，客户端应重新同步状态。
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+from metrics import EVENTS_DROPPED, EVENTS_PUBLISHED
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ('check', 'transition')
+DEFAULT_MAX_PENDING = 256
+
+
+class WriteTimeout(Exception):
+    """推送连接的对端长时间不读取数据。"""
+
+
+class Subscription:
+    """一个订阅者待发送的事件。
+
+    待发送事件达到 max_pending 条时先丢弃最早的 check 事件；全是 transition 事件时
+    标记为溢出，由服务器断开连接，客户端重连后从回放缓冲区补齐，慢的订阅者不会拖慢发布者。
+    """
+
+    def __init__(self, merchants=None, types=None, max_pending=DEFAULT_MAX_PENDING):
+        self.merchants = frozenset(merchants) if merchants else None
+        self.types = frozenset(types) if types else None
+        self.max_pending = max_pending
+        self.overflowed = False
+        self.closed = False
+        self._pending = deque()
+        self._ready = asyncio.Event()
+
+    def matches(self, event):
+        return ((self.merchants is None or event['merchant'] in self.merchants)
+                and (self.types is None or event['type'] in self.types))
+
+    def offer(self, event):
+        if self.overflowed:
+            return
+        if len(self._pending) >= self.max_pending:
+            for index, pending in enumerate(self._pending):
+                if pending['type'] == 'check':
+                    del self._pending[index]
+                    break
+            else:
+                if event['type'] == 'check':
+                    EVENTS_DROPPED.inc(reason='check')
+                    return
+                EVENTS_DROPPED.inc(reason='overflow')
+                self.overflowed = True
+                self._ready.set()
+                return
+            EVENTS_DROPPED.inc(reason='check')
+        self._pending.append(event)
+        self._ready.set()
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def get(self):
+        """等待并取出所有待发送的事件；溢出或关闭后返回 None。"""
+        while not self._pending and not self.overflowed and not self.closed:
+            self._ready.clear()
+            await self._ready.wait()
+        if self.overflowed or self.closed:
+            return None
+        events = list(self._pending)
+        self._pending.clear()
+        return events
+
+
+class EventBus:
+    """发布-订阅事件总线，保留最近的事件用于回放。
+
+    所有事件和 transition 事件各有一个 replay_size 条的回放缓冲区，频繁的 check 事件
+    不会把状态变化挤出缓冲区。replay_size 不小于 max_pending，因此因溢出断开的订阅者
+    重连后总能补齐错过的状态变化。事件 ID 为 "<启动时间>-<序号>"。
+    """
+
+    def __init__(self, replay_size=2 * DEFAULT_MAX_PENDING, max_pending=DEFAULT_MAX_PENDING):
+        self.max_pending = max_pending
+        replay_size = max(replay_size, max_pending)
+        self._history = deque(maxlen=replay_size)
+        self._transitions = deque(maxlen=replay_size)
+        self._subscribers = set()
+        self._epoch = str(int(time.time()))
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def publish(self, event_type, **fields):
+        """发布一条事件并立即分发给匹配的订阅者，返回事件。"""
+        event = {'id': f"{self._epoch}-{next(self._ids)}", 'type': event_type, 'time': round(time.time(), 3)}
+        event.update(fields)
+        self._history.append(event)
+        if event_type == 'transition':
+            self._transitions.append(event)
+        EVENTS_PUBLISHED.inc(type=event_type)
+        for subscription in self._subscribers:
+            if subscription.matches(event):
+                subscription.offer(event)
+        return event
+
+    def _buffered(self):
+        """两个回放缓冲区中的全部事件，按序号排列。"""
+        events = {_sequence(event): event for event in self._transitions}
+        events.update((_sequence(event), event) for event in self._history)
+        return [events[sequence] for sequence in sorted(events)]
+
+    def _missed(self, subscription, sequence):
+        """序号 sequence 之后匹配订阅的事件是否可能已被移出缓冲区。"""
+        rings = [self._history]
+        if subscription.types is not None and 'check' not in subscription.types:
+            rings = [self._transitions]
+        return any(len(ring) == ring.maxlen and _sequence(ring[0]) > sequence + 1 for ring in rings)
+
+    def subscribe(self, merchants=None, types=None, last_event_id=None, replay=0):
+        """创建订阅。给出 last_event_id 时补发之后的事件，否则补发最近 replay 条匹配的事件。
+
+        last_event_id 之后的事件已有丢失（进程重启、已移出缓冲区或 ID 无效）时，
+        先放入一条 reset 事件，再补发缓冲区中的全部匹配事件。
+        """
+        subscription = Subscription(merchants, types, self.max_pending)
+        backlog = [event for event in self._buffered() if subscription.matches(event)]
+        if last_event_id:
+            epoch, _, sequence = last_event_id.partition('-')
+            if epoch != self._epoch:
+                reason = 'restart'
+            elif not sequence.isdigit():
+                reason = 'invalid'
+            elif self._missed(subscription, int(sequence)):
+                reason = 'gap'
+            else:
+                reason = None
+            if reason is None:
+                backlog = [event for event in backlog if _sequence(event) > int(sequence)]
+            else:
+                logger.info("订阅者的 Last-Event-ID %s 之后的事件无法完整补发（%s）。", last_event_id, reason)
+                subscription._pending.append({
+                    'type': 'reset',
+                    'time': round(time.time(), 3),
+                    'reason': reason,
+                    'last_event_id': last_event_id,
+                    'oldest_event_id': backlog[0]['id'] if backlog else None,
+                })
+        else:
+            backlog = backlog[-replay:] if replay > 0 else []
+        subscription._pending.extend(backlog)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscribers.discard(subscription)
+
+
+def _sequence(event):
+    return int(event['id'].partition('-')[2])
+
+
+def publish_check(bus, key, item, in_stock, changed, detected_at, tenant=None):
+    """发布一次检查的结果，状态变化时事件类型为 transition，否则为 check。
+
+    latency_ms 为从页面获取完成到发布的毫秒数（包括状态变化前的复查）。
+    """
+    fields = {
+        'item': key,
+        'merchant': item.merchant.name,
+        'title': item.title,
+        'in_stock': in_stock,
+        'price': item.price,
+        'buy_url': item.buy_url,
+        'check_url': item.check_url,
+        'latency_ms': round((time.time() - detected_at) * 1000, 1),
+    }
+    if tenant is not None:
+        fields['tenant'] = tenant
+    return bus.publish('transition' if changed else 'check', **fields)
+
+
+def _format_event(event):
+    data = json.dumps(event, ensure_ascii=False)
+    # reset 事件没有 ID，不改变客户端记录的 Last-Event-ID
+    event_id = f"id: {event['id']}\n" if 'id' in event else ''
+    return f"{event_id}event: {event['type']}\ndata: {data}\n\n".encode('utf-8')
+
+
+class EventServer:
+    """在事件循环中运行的极简 HTTP 服务器，以 GET /events 推送 Server-Sent Events。"""
+
+    def __init__(self, bus, host='127.0.0.1', port=9109, keepalive=15, write_timeout=10):
+        self.bus = bus
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.write_timeout = write_timeout
+        self._server = None
+        self._subscriptions = set()
+        self._connections = set()
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置文件中的 events 段创建服务器和事件总线，未启用时返回 None。"""
+        options = config.get('events', {})
+        if not options.get('enabled', False):
+            return None
+        max_pending = options.get('max_pending', DEFAULT_MAX_PENDING)
+        bus = EventBus(replay_size=options.get('replay_size', 2 * max_pending), max_pending=max_pending)
+        return cls(bus, options.get('host', '127.0.0.1'), options.get('port', 9109),
+                   keepalive=options.get('keepalive', 15), write_timeout=options.get('write_timeout', 10))
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"事件推送服务已启动: http://{self.host}:{self.port}/events")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # 结束所有推送连接；写入阻塞的连接最多等待 write_timeout 秒
+            for subscription in self._subscriptions:
+                subscription.close()
+            if self._connections:
+                await asyncio.wait(self._connections, timeout=self.write_timeout + 1)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _drain(self, writer):
+        """等待发送缓冲区写出；对端停止读取超过 write_timeout 秒时抛出 WriteTimeout。"""
+        try:
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+        except asyncio.TimeoutError:
+            raise WriteTimeout()
+
+    async def _read_request(self, reader):
+        request_line = await asyncio.wait_for(reader.readline(), 10)
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 10)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return request_line.decode('latin-1').split(), headers
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        subscription = None
+        try:
+            parts, headers = await self._read_request(reader)
+            target = urlsplit(parts[1]) if len(parts) >= 2 else None
+            if target is None or parts[0] != 'GET' or target.path != '/events':
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+                             b"Content-Length: 10\r\nConnection: close\r\n\r\nnot found\n")
+                await self._drain(writer)
+                return
+            query = parse_qs(target.query)
+            replay = query.get('replay', ['0'])[0]
+            subscription = self.bus.subscribe(
+                merchants=query.get('merchant'),
+                types=[event_type for event_type in query.get('type', []) if event_type in EVENT_TYPES],
+                last_event_id=headers.get('last-event-id') or query.get('last_event_id', [None])[0],
+                replay=int(replay) if replay.isdigit() else 0,
+            )
+            self._subscriptions.add(subscription)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+                         b"Cache-Control: no-cache\r\nConnection: close\r\n\r\nretry: 1000\n\n")
+            await self._drain(writer)
+            while True:
+                try:
+                    events = await asyncio.wait_for(subscription.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")  # 注释行，用于发现已断开的连接
+                else:
+                    if events is None:
+                        if subscription.overflowed:
+                            logger.warning("事件订阅者接收过慢，断开连接等待其重连补发。")
+                        return
+                    writer.write(b''.join(_format_event(event) for event in events))
+                await self._drain(writer)
+        except WriteTimeout:
+            logger.warning("事件订阅者 %s 秒内未读取数据，断开连接。", self.write_timeout)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug("事件推送连接结束: %s", e)
+        finally:
+            if subscription is not None:
+                self.bus.unsubscribe(subscription)
+                self._subscriptions.discard(subscription)
+            self._connections.discard(task)
+            writer.close()
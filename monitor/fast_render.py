@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Playwright 快速渲染：屏蔽图片、字体、媒体和统计脚本，满足商品的就绪条件后立即读取页面。"""
+import asyncio
+import logging
+import time
+from urllib.parse import urlsplit
+
+from checks import fetch_page_content
+from clearance import detect_challenge
+from log_pipeline import SAMPLED
+from metrics import FAST_RENDER_FALLBACKS, FETCH_SECONDS, HTTP_ERRORS, RESPONSE_RULE_MISSES
+from page_parser import parse_page
+from response_rule import InterceptedPage, response_stock
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_RESOURCE_TYPES = frozenset(('image', 'font', 'media'))
+# 常见的统计、广告和在线客服脚本（包括子域名）
+TRACKER_DOMAINS = (
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'googlesyndication.com',
+    'facebook.net',
+    'hotjar.com',
+    'clarity.ms',
+    'cloudflareinsights.com',
+    'tawk.to',
+    'crisp.chat',
+    'livechatinc.com',
+)
+
+# 启用 JavaScript 的页面的就绪条件，在浏览器中每 100 毫秒检查一次：
+# ready_selector 出现、页面包含无库存文本、出现 "N in stock" 或脚本中的 errors 数组
+READY_PREDICATE = """([selector, text]) => {
+    if (selector && document.querySelector(selector)) return true;
+    const content = document.documentElement ? document.documentElement.textContent : '';
+    if (text && content.includes(text)) return true;
+    if (/\\d+\\s+in stock/i.test(content)) return true;
+    return Array.from(document.scripts).some(script => /\\berrors\\s*=\\s*\\[/.test(script.textContent));
+}"""
+
+
+class RenderNotReady(Exception):
+    """快速模式无法得到可用的页面（如遇到验证页），需要回退到完整流程。"""
+
+
+def is_tracker(hostname):
+    return any(hostname == domain or hostname.endswith('.' + domain) for domain in TRACKER_DOMAINS)
+
+
+async def block_resources(route):
+    """页面路由：中止图片、字体、媒体和统计脚本的请求，其余请求照常发出。"""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or is_tracker(urlsplit(request.url).hostname or ''):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+class FastRenderer:
+    """Playwright 快速渲染模式。
+
+    不启用 JavaScript 的商品在 DOMContentLoaded 后立即读取页面；启用 JavaScript 的商品
+    点击 "Order" 后等到就绪条件满足，不再固定等待。快速模式失败（超时、验证页等）时回退到
+    带随机等待和鼠标移动的 fetch_page_content，回退成功的主机在 probe_interval 秒内直接使用
+    完整流程，之后重新试探快速模式。human_hosts 为预先已知需要模拟人类操作的主机，总是使用完整流程。
+
+    启用 JavaScript 且配置了 response_rule 的商品先监听页面的网络响应，匹配的接口返回后
+    直接按规则读取 JSON 字段，得到 InterceptedPage，不再序列化和解析整个页面；接口未出现
+    或字段无法判断时改用上面的页面渲染流程。
+    """
+
+    def __init__(self, browser_pool, parser_backend='auto', timeout=30, human_hosts=(), clearance=None,
+                 probe_interval=3600):
+        self.browser_pool = browser_pool
+        self.parser_backend = parser_backend
+        self.timeout = timeout
+        self.human_hosts = frozenset(human_hosts)
+        self.clearance = clearance
+        self.probe_interval = probe_interval
+        self._fallback_hosts = {}  # 回退成功的主机 -> 开始使用完整流程的时间
+
+    def _needs_full(self, host):
+        """主机是否直接使用完整流程；回退超过 probe_interval 秒的主机重新试探快速模式。"""
+        if host in self.human_hosts:
+            return True
+        since = self._fallback_hosts.get(host)
+        if since is None:
+            return False
+        if time.monotonic() - since < self.probe_interval:
+            return True
+        del self._fallback_hosts[host]
+        logger.info(f"主机 {host} 已使用完整流程 {self.probe_interval} 秒，重新试探快速模式。")
+        return False
+
+    @classmethod
+    def from_config(cls, config, browser_pool, parser_backend='auto', clearance=None):
+        """根据配置文件中的 fast_render 段创建渲染器，未启用时返回 None。"""
+        options = config.get('fast_render', {})
+        if not options.get('enabled', True):
+            return None
+        return cls(browser_pool, parser_backend, timeout=options.get('timeout', 30),
+                   human_hosts=options.get('human_hosts', ()), clearance=clearance,
+                   probe_interval=options.get('probe_interval', 3600))
+
+    async def fetch(self, url, enable_javascript=False, ready_selector=None, out_of_stock_text=None,
+                    emulate_human=True, response_rule=None):
+        """获取并解析页面，返回 ParsedPage 或 InterceptedPage；失败时返回 None。"""
+        host = urlsplit(url).netloc
+        if enable_javascript and response_rule is not None:
+            try:
+                return await self._fetch_response(url, host, response_rule, out_of_stock_text)
+            except Exception as e:
+                RESPONSE_RULE_MISSES.inc()
+                logger.info(f"未能从接口响应判断库存，改用页面渲染。URL: {url}，原因: {e}")
+        if emulate_human and self._needs_full(host):
+            return await self._fetch_full(url, enable_javascript, emulate_human)
+        try:
+            return await self._fetch_fast(url, host, enable_javascript, ready_selector, out_of_stock_text)
+        except Exception as e:
+            FAST_RENDER_FALLBACKS.inc()
+            logger.info(f"快速渲染失败，改用完整流程。URL: {url}，原因: {e}")
+        parsed_page = await self._fetch_full(url, enable_javascript, emulate_human)
+        if parsed_page is not None and emulate_human:
+            logger.info(f"主机 {host} 需要模拟人类操作，{self.probe_interval} 秒内使用完整流程。")
+            self._fallback_hosts[host] = time.monotonic()
+        return parsed_page
+
+    async def _fetch_full(self, url, enable_javascript, emulate_human):
+        return await fetch_page_content(self.browser_pool, url, enable_javascript, parser_backend=self.parser_backend,
+                                        emulate_human=emulate_human, clearance=self.clearance)
+
+    async def _check_response(self, url, host, response):
+        """页面请求返回非 200 时处理：验证页抛出 RenderNotReady，其他错误返回 False。"""
+        if response.status == 200:
+            return True
+        reason = detect_challenge(response.status, response.headers, await response.text())
+        if reason is not None:
+            if self.clearance is not None:
+                self.clearance.invalidate(host, reason)
+            raise RenderNotReady(reason)
+        HTTP_ERRORS.inc(backend='playwright_fast', status=response.status)
+        logger.warning(f"HTTP 请求失败，状态码: {response.status}。URL: {url}")
+        return False
+
+    async def _fetch_response(self, url, host, rule, out_of_stock_text):
+        timeout = self.timeout * 1000
+        entry = self.clearance.get(host) if self.clearance is not None else None
+        loop = asyncio.get_running_loop()
+        matched = loop.create_future()
+
+        def on_response(response):
+            if not matched.done() and rule.matches(response.url):
+                matched.set_result(response)
+
+        with FETCH_SECONDS.time(backend='playwright_response', javascript='true'):
+            async with self.browser_pool.page(True, entry.user_agent if entry is not None else None) as page:
+                if entry is not None:
+                    await page.context.add_cookies(entry.browser_cookies())
+                await page.route('**/*', block_resources)
+                page.on('response', on_response)
+                response = await page.goto(url, wait_until='domcontentloaded', timeout=timeout)
+                if not await self._check_response(url, host, response):
+                    return None
+                if rule.click and not matched.done():
+                    await page.click(rule.click, timeout=timeout)
+                reply = await asyncio.wait_for(matched, self.timeout)
+                value = rule.extract(await reply.json())
+                if response_stock(value, out_of_stock_text) is None:
+                    raise RenderNotReady(f"接口 {reply.url} 的字段 {rule.field} 无法判断库存: {value!r}")
+                title = await page.title()
+                if self.clearance is not None:
+                    request_headers = await response.request.all_headers()
+                    self.clearance.update(host, request_headers.get('user-agent'), await page.context.cookies(url))
+
+        logger.info("已从接口响应读取库存。URL: %s，接口: %s", url, reply.url, extra=SAMPLED)
+        return InterceptedPage(title, value, reply.url)
+
+    async def _fetch_fast(self, url, host, enable_javascript, ready_selector, out_of_stock_text):
+        timeout = self.timeout * 1000
+        entry = self.clearance.get(host) if self.clearance is not None else None
+        with FETCH_SECONDS.time(backend='playwright_fast', javascript=str(enable_javascript).lower()):
+            async with self.browser_pool.page(enable_javascript, entry.user_agent if entry is not None else None) as page:
+                if entry is not None:
+                    await page.context.add_cookies(entry.browser_cookies())
+                await page.route('**/*', block_resources)
+                response = await page.goto(url, wait_until='domcontentloaded', timeout=timeout)
+                if not await self._check_response(url, host, response):
+                    return None
+
+                if enable_javascript:
+                    await page.click('button:has-text("Order")', timeout=timeout)  # 假设按钮文本为 "Order"
+                    await page.wait_for_load_state('domcontentloaded', timeout=timeout)
+                    await page.wait_for_function(READY_PREDICATE, arg=[ready_selector, out_of_stock_text],
+                                                 polling=100, timeout=timeout)
+
+                page_content = await page.content()
+                if self.clearance is not None:
+                    request_headers = await response.request.all_headers()
+                    self.clearance.update(host, request_headers.get('user-agent'), await page.context.cookies(url))
+
+        parsed_page = parse_page(page_content, self.parser_backend)
+        logger.info("快速渲染成功。URL: %s, JavaScript: %s", url, '启用' if enable_javascript else '禁用', extra=SAMPLED)
+        return parsed_page
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""HTTP 抓取引擎（cfscrape 或普通 requests 会话），engine.py 和根目录的 monitor.py 共用。"""
+import asyncio
+import hashlib
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+
+import cfscrape
+import requests
+
+from clearance import cookies_from_jar, detect_challenge
+from host_health import backoff_delay
+from log_pipeline import SAMPLED
+from metrics import FETCH_RETRIES, FETCH_SECONDS, HTTP_ERRORS
+from page_parser import parse_page
+
+logger = logging.getLogger(__name__)
+
+# 每次请求都会变化、但与库存无关的内容（WHMCS 的 CSRF token、nonce 等），计算摘要前去掉
+VOLATILE_PATTERN = re.compile(r'\b[0-9a-f]{32,}\b|nonce="[^"]*"', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+PLAIN_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+def page_digest(text):
+    """计算规范化后页面内容的快速摘要。"""
+    normalized = WHITESPACE_PATTERN.sub(' ', VOLATILE_PATTERN.sub('', text))
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ChallengeDetected(Exception):
+    """服务器返回了验证页，需要换用更强的抓取方式。"""
+
+
+def create_plain_session():
+    """不带验证处理的普通 requests 会话，使用常见浏览器的 User-Agent。"""
+    session = requests.Session()
+    session.headers['User-Agent'] = PLAIN_USER_AGENT
+    return session
+
+
+class CachedPage:
+    """URL 上次成功获取的页面及其缓存校验信息，解析结果在首次使用时生成并缓存。"""
+
+    __slots__ = ('etag', 'last_modified', 'text', 'digest', 'parsed')
+
+    def __init__(self, etag, last_modified, text, digest, parsed=None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.text = text
+        self.digest = digest
+        self.parsed = parsed
+
+    def parse(self, backend='auto'):
+        if self.parsed is None:
+            self.parsed = parse_page(self.text, backend)
+        return self.parsed
+
+
+class FetchEngine:
+    """并发抓取引擎。
+
+    每个主机使用一个常驻的会话（默认为 cfscrape）以复用 TCP/TLS 连接；请求是阻塞的，
+    因此放到有界线程池中执行，并分别限制全局并发数和单个主机的并发数。
+    每个 URL 记住上次的 ETag/Last-Modified，之后发送条件请求。name 用作指标中的后端名称。
+    提供 clearance（ClearanceCache）时，会话使用缓存中主机的验证 Cookie 和 User-Agent，
+    成功获取后保存新的验证 Cookie，遇到验证页时删除缓存。
+    """
+
+    def __init__(self, max_concurrency=8, per_host_limit=2, connect_timeout=10, read_timeout=30,
+                 session_factory=None, name='cfscrape', clearance=None):
+        self.name = name
+        self.clearance = clearance
+        self.session_factory = session_factory or cfscrape.create_scraper
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_host_limit = max(1, per_host_limit)
+        self.timeout = (connect_timeout, read_timeout)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='fetch')
+        self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._host_semaphores = {}
+        self._sessions = {}
+        self._applied = {}  # 主机 -> 已写入会话的 Clearance
+        self._pages = {}  # URL -> CachedPage
+
+    @classmethod
+    def from_config(cls, config, session_factory=None, name='cfscrape', clearance=None):
+        """根据配置文件中的 fetch 段创建抓取引擎。"""
+        options = config.get('fetch', {})
+        return cls(
+            max_concurrency=options.get('max_concurrency', 8),
+            per_host_limit=options.get('per_host_limit', 2),
+            connect_timeout=options.get('connect_timeout', 10),
+            read_timeout=options.get('read_timeout', 30),
+            session_factory=session_factory,
+            name=name,
+            clearance=clearance,
+        )
+
+    def _session(self, host):
+        """返回主机对应的会话，首次使用时创建。"""
+        session = self._sessions.get(host)
+        if session is None:
+            session = self.session_factory()
+            for adapter in session.adapters.values():
+                # 连接池大小与单主机并发上限一致，保证每个并发请求都能复用连接
+                adapter.init_poolmanager(1, self.per_host_limit)
+            self._sessions[host] = session
+        return session
+
+    def _apply_clearance(self, host, session):
+        """缓存中有其他后端（如浏览器）新得到的验证结果时写入会话。"""
+        entry = self.clearance.get(host)
+        if entry is not None and entry is not self._applied.get(host):
+            entry.apply_to_session(session)
+            self._applied[host] = entry
+
+    def _record_clearance(self, host, session, response):
+        """成功时保存会话中的验证 Cookie，遇到验证页时删除缓存和会话中过期的 Cookie。"""
+        if response.status_code in (200, 304):
+            if self.clearance.update(host, response.request.headers.get('User-Agent'), cookies_from_jar(session.cookies)):
+                self._applied[host] = self.clearance.get(host)
+            return
+        reason = detect_challenge(response.status_code, response.headers, response.text)
+        if reason is not None:
+            self.clearance.invalidate(host, reason)
+            self._applied.pop(host, None)
+            session.cookies.clear()
+
+    def cached_page(self, url):
+        """返回 URL 上次成功获取的页面，没有则返回 None。"""
+        return self._pages.get(url)
+
+    def build_page(self, url, response):
+        """根据成功响应生成 CachedPage；内容摘要与上次相同时沿用上次的解析结果。"""
+        digest = page_digest(response.text)
+        previous = self._pages.get(url)
+        parsed = previous.parsed if previous is not None and previous.digest == digest else None
+        return CachedPage(
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified'),
+            response.text,
+            digest,
+            parsed,
+        )
+
+    def remember(self, url, page):
+        """保存页面的校验信息和内容摘要，供后续条件请求使用。"""
+        self._pages[url] = page
+        return page
+
+    def forget(self, url):
+        """删除 URL 的缓存页面（商品已从配置中移除）。"""
+        self._pages.pop(url, None)
+
+    async def get(self, url):
+        """在并发限制内发起 GET 请求，返回 requests 的响应对象。
+
+        已缓存的 URL 会带上 If-None-Match / If-Modified-Since，页面未变化时服务器返回 304。
+        """
+        headers = {}
+        page = self._pages.get(url)
+        if page is not None:
+            if page.etag:
+                headers['If-None-Match'] = page.etag
+            if page.last_modified:
+                headers['If-Modified-Since'] = page.last_modified
+        host = urlsplit(url).netloc
+        host_semaphore = self._host_semaphores.get(host)
+        if host_semaphore is None:
+            host_semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        async with self._global_semaphore, host_semaphore:
+            session = self._session(host)
+            if self.clearance is not None:
+                self._apply_clearance(host, session)
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(self._executor, partial(session.get, url, headers=headers, timeout=self.timeout))
+            if self.clearance is not None:
+                self._record_clearance(host, session, response)
+            return response
+
+    def close(self):
+        """关闭所有会话和线程池。"""
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+        self._executor.shutdown(wait=False)
+
+
+async def fetch_html(engine, url, retries=3, detect_challenges=False):
+    """获取页面，返回 CachedPage；失败时返回 None。
+
+    detect_challenges 为 True 时，遇到验证页直接抛出 ChallengeDetected，不再重试。
+    """
+    for attempt in range(retries):
+        if attempt > 0:
+            FETCH_RETRIES.inc(backend=engine.name)
+        try:
+            with FETCH_SECONDS.time(backend=engine.name, javascript='false'):
+                response = await engine.get(url)
+            if detect_challenges and response.status_code != 304:
+                reason = detect_challenge(response.status_code, response.headers, response.text)
+                if reason is not None:
+                    raise ChallengeDetected(reason)
+            if response.status_code == 304 and engine.cached_page(url) is not None:
+                logger.info("URL %s 未修改 (304)，使用缓存内容。", url, extra=SAMPLED)
+                return engine.cached_page(url)
+            if response.status_code != 200:
+                HTTP_ERRORS.inc(backend=engine.name, status=response.status_code)
+                logger.warning(f"URL {url} 返回了非200状态码 {response.status_code}，跳过该页面。")
+                return None  # 如果状态码不是 200，跳过该页面
+            if not response.text.strip():  # 检查页面是否为空
+                logger.warning(f"URL {url} 返回了空页面，跳过。")
+                return None
+            logger.info("成功获取 URL: %s", url, extra=SAMPLED)
+            return engine.remember(url, engine.build_page(url, response))
+        except ChallengeDetected:
+            raise
+        except Exception as e:
+            logger.error(f"获取 {url} 时出错: {e} (尝试 {attempt + 1} 次，共 {retries} 次)")
+            if attempt < retries - 1:
+                await asyncio.sleep(backoff_delay(attempt, base=2))  # 指数退避后重试
+    logger.error(f"获取 URL {url} 失败，已尝试 {retries} 次。")
+    return None
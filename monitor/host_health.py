@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""按主机跟踪错误率和延迟，对持续失败的主机熔断并按指数退避重试。"""
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+
+from metrics import HOST_CIRCUIT_TRANSITIONS, HOST_SKIPPED_CHECKS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def backoff_delay(attempt, base=2, cap=60):
+    """第 attempt 次重试（从 0 开始）前的等待秒数：指数增长，带 ±50% 抖动，不超过 cap。"""
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+class HostHealth:
+    """一个主机的健康状态。"""
+
+    __slots__ = ('error_rate', 'latency', 'slowness', 'samples', 'failures', 'state', 'open_until', 'opens', 'in_flight')
+
+    def __init__(self):
+        self.error_rate = 0.0  # 失败率的指数移动平均
+        self.latency = 0.0  # 检查耗时（秒）的指数移动平均
+        self.slowness = 0.0  # 检查耗时与该次检查的慢阈值之比的指数移动平均
+        self.samples = 0
+        self.failures = 0  # 连续失败次数
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.opens = 0  # 连续熔断次数，决定退避时长
+        self.in_flight = 0
+
+
+class HostHealthTracker:
+    """主机健康跟踪器。
+
+    每次检查后按结果更新主机的失败率和延迟的指数移动平均（平滑系数 alpha）。
+    连续失败 failure_threshold 次后熔断：base_backoff 秒内不再检查该主机，每次再熔断时
+    退避时长翻倍，最长 max_backoff 秒。退避结束后半开，只放行一个试探检查，成功则恢复，
+    失败则再次熔断。失败率达到 degraded_error_rate 或检查偏慢的主机为降级状态，同时最多
+    degraded_concurrency 个检查，其余检查直接跳过，把并发名额留给健康的主机。
+
+    HTTP 检查超过 slow_seconds 秒算慢；浏览器检查要等待 networkidle 和模拟人类操作，
+    超过 browser_slow_seconds 秒才算慢。每次检查的耗时按各自的阈值折算后再求平均，
+    同一主机混用两种方式时也不会误判。
+    """
+
+    def __init__(self, alpha=0.3, failure_threshold=5, base_backoff=60, max_backoff=1800,
+                 degraded_error_rate=0.5, slow_seconds=30, degraded_concurrency=1, browser_slow_seconds=90):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.degraded_error_rate = degraded_error_rate
+        self.slow_seconds = slow_seconds
+        self.browser_slow_seconds = browser_slow_seconds
+        self.degraded_concurrency = degraded_concurrency
+        self._hosts = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置文件中的 host_health 段创建跟踪器，未启用时返回 None。"""
+        options = config.get('host_health', {})
+        if not options.get('enabled', True):
+            return None
+        return cls(
+            alpha=options.get('alpha', 0.3),
+            failure_threshold=options.get('failure_threshold', 5),
+            base_backoff=options.get('base_backoff', 60),
+            max_backoff=options.get('max_backoff', 1800),
+            degraded_error_rate=options.get('degraded_error_rate', 0.5),
+            slow_seconds=options.get('slow_seconds', 30),
+            degraded_concurrency=options.get('degraded_concurrency', 1),
+            browser_slow_seconds=options.get('browser_slow_seconds', 90),
+        )
+
+    def get(self, host):
+        health = self._hosts.get(host)
+        if health is None:
+            health = self._hosts[host] = HostHealth()
+        return health
+
+    def degraded(self, health):
+        return health.error_rate >= self.degraded_error_rate or health.slowness >= 1.0
+
+    def acquire(self, host):
+        """判断现在能否检查该主机；能则计入进行中的检查，之后必须调用 release()。"""
+        health = self.get(host)
+        reason = None
+        if health.state == OPEN:
+            if time.monotonic() < health.open_until:
+                reason = OPEN
+            else:
+                self._transition(host, health, HALF_OPEN)
+        if reason is None and health.state == HALF_OPEN and health.in_flight > 0:
+            reason = HALF_OPEN  # 试探检查尚未完成
+        if reason is None and self.degraded(health) and health.in_flight >= self.degraded_concurrency:
+            reason = 'degraded'
+        if reason is not None:
+            HOST_SKIPPED_CHECKS.inc(reason=reason)
+            return False
+        health.in_flight += 1
+        return True
+
+    def release(self, host, ok, latency, slow_seconds=None):
+        """记录一次检查的结果和耗时（秒）；slow_seconds 为这次检查的慢阈值，默认为 HTTP 检查的阈值。"""
+        health = self.get(host)
+        health.in_flight = max(0, health.in_flight - 1)
+        alpha = self.alpha if health.samples else 1.0
+        health.samples += 1
+        health.error_rate += alpha * ((0.0 if ok else 1.0) - health.error_rate)
+        health.latency += alpha * (latency - health.latency)
+        health.slowness += alpha * (latency / (slow_seconds or self.slow_seconds) - health.slowness)
+        if ok:
+            health.failures = 0
+            if health.state != CLOSED:
+                health.opens = 0
+                self._transition(host, health, CLOSED)
+            return
+        health.failures += 1
+        if health.state == HALF_OPEN or (health.state == CLOSED and health.failures >= self.failure_threshold):
+            self._open(host, health)
+
+    def _open(self, host, health):
+        delay = min(self.max_backoff, self.base_backoff * 2 ** health.opens) * random.uniform(0.9, 1.1)
+        health.opens += 1
+        health.open_until = time.monotonic() + delay
+        self._transition(host, health, OPEN)
+        logger.warning(f"主机 {host} 连续失败 {health.failures} 次，暂停检查 {int(delay)} 秒"
+                       f"（失败率 {health.error_rate:.0%}，平均耗时 {health.latency:.1f} 秒）。")
+
+    def _transition(self, host, health, state):
+        if health.state == state:
+            return
+        health.state = state
+        HOST_CIRCUIT_TRANSITIONS.inc(state=state)
+        if state == HALF_OPEN:
+            logger.info(f"主机 {host} 暂停结束，发起一次试探检查。")
+        elif state == CLOSED:
+            logger.info(f"主机 {host} 已恢复正常。")
+
+    def unhealthy(self):
+        """返回熔断中或降级的主机及其状态。"""
+        return {host: health.state if health.state != CLOSED else 'degraded'
+                for host, health in self._hosts.items() if health.state != CLOSED or self.degraded(health)}
+
+    async def call(self, url, fetch, browser=False):
+        """在主机的熔断和降级限制内执行 fetch()，返回其结果；跳过检查时返回 None。
+
+        fetch() 返回 None 或抛出异常（包括超过截止时间被取消）记为失败。browser 为 True
+        表示 fetch() 用浏览器获取页面，耗时按 browser_slow_seconds 判断是否偏慢。
+        """
+        host = urlsplit(url).netloc
+        if not self.acquire(host):
+            return None
+        started = time.monotonic()
+        ok = False
+        try:
+            result = await fetch()
+            ok = result is not None
+            return result
+        finally:
+            self.release(host, ok, time.monotonic() - started,
+                         self.browser_slow_seconds if browser else self.slow_seconds)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""不阻塞事件循环的日志：记录放入有界队列，由后台线程格式化并写入控制台和按大小、时间轮转的文件。"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# 需要采样的重复日志（每次检查都会输出的库存判断结果等），通过 extra=SAMPLED 标记
+SAMPLED = {'sample': True}
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# LogRecord 自带的属性，其余属性（extra 传入的字段）写入 JSON 记录
+_RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime', 'sample'}
+
+_installed = None  # (QueueListener, 安装的 QueueHandler)
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出为一行 JSON：时间、级别、来源、消息，以及 extra 中的字段（如 item、phases）。"""
+
+    def format(self, record):
+        data = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """文件超过 max_bytes 字节或距上次轮转超过 interval 秒时轮转，保留 backup_count 个旧文件。"""
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, interval=86400, backup_count=7):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record):
+        if self.interval and time.time() >= self.rollover_at:
+            return 1
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+
+class SamplingFilter(logging.Filter):
+    """标记为 SAMPLED 的记录，相同内容 interval 秒内只放行一条，下一条放行的记录带上省略的条数。
+
+    内容变化（如库存状态变化）的记录不受影响。
+    """
+
+    def __init__(self, interval=300, max_keys=10000):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self._seen = {}  # 消息 -> [上次放行的时间, 之后省略的条数]
+
+    def filter(self, record):
+        if not getattr(record, 'sample', False) or self.interval <= 0:
+            return True
+        message = record.getMessage()
+        now = record.created
+        entry = self._seen.get(message)
+        if entry is not None and now - entry[0] < self.interval:
+            entry[1] += 1
+            return False
+        if entry is not None and entry[1]:
+            record.suppressed = entry[1]
+        if entry is None and len(self._seen) >= self.max_keys:
+            self._seen.clear()
+        self._seen[message] = [now, 0]
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列已满时丢弃记录而不是阻塞事件循环，丢弃的条数附在下一条记录上。"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def enqueue(self, record):
+        with self._lock:
+            if self.dropped:
+                record.dropped = self.dropped
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                return
+            self.dropped = 0
+
+
+def setup_logging(filename, options=None):
+    """配置根日志：控制台输出文本，文件输出 JSON（可改为文本），都由后台线程写入。
+
+    options 为配置文件中的 logging 段。根日志已由调用方配置（如基准测试）时不做任何修改；
+    再次调用时替换之前安装的处理器，用于读取配置后按配置重新设置。
+    """
+    global _installed
+    root = logging.getLogger()
+    if _installed is not None:
+        listener, handler = _installed
+        root.removeHandler(handler)
+        listener.stop()
+        atexit.unregister(listener.stop)
+        _installed = None
+    elif root.handlers:
+        return None
+    options = options or {}
+    root.setLevel(getattr(logging, str(options.get('level', 'INFO')).upper(), logging.INFO))
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    filename = options.get('file', filename)
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    log_file = SizeAndTimeRotatingFileHandler(
+        filename,
+        max_bytes=options.get('max_bytes', 10 * 1024 * 1024),
+        interval=options.get('rotate_interval', 86400),
+        backup_count=options.get('backup_count', 7),
+    )
+    log_file.setFormatter(JsonFormatter() if options.get('json', True) else logging.Formatter(TEXT_FORMAT))
+
+    handler = DroppingQueueHandler(queue.Queue(options.get('queue_size', 10000)))
+    handler.addFilter(SamplingFilter(options.get('sample_interval', 300)))
+    listener = logging.handlers.QueueListener(handler.queue, console, log_file, respect_handler_level=True)
+    root.addHandler(handler)
+    listener.start()
+    atexit.register(listener.stop)
+    _installed = (listener, handler)
+    return listener
+
+
+def log_check(logger, item, in_stock, changed, phases):
+    """输出一次检查的结构化记录：商品、库存状态、是否变化和各阶段耗时（秒）。
+
+    状态未变化的记录参与采样，状态变化的记录总是输出。
+    """
+    logger.info("检查完成: %s（%s库存）", item, '有' if in_stock else '无', extra={
+        'item': item,
+        'in_stock': in_stock,
+        'changed': changed,
+        'phases': {phase: round(seconds, 3) for phase, seconds in phases.items()},
+        'sample': not changed,
+    })
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""Prometheus 文本格式的运行指标。
+
+各模块直接使用本模块中定义的指标对象记录数据，开销只是几次字典操作；
+配置中启用 metrics 后，MetricsServer 在本地端口以 /metrics 提供抓取。
+"""
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def remove(self, **labels):
+        """删除一组标签的数据（如商品已从配置中移除）。"""
+        self._values.pop(self._key(labels), None)
+
+    def collect(self):
+        """返回 (样本名后缀, 额外标签, 标签值, 数值) 列表。"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, extra, labelvalues, value in self.collect():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labelvalues, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器。"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        return [('_total', (), key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """按固定桶统计的直方图。"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # 每个桶单独计数，输出时再累加；最后一个位置是 +Inf
+            state = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+        state['counts'][bisect.bisect_left(self.buckets, value)] += 1
+        state['sum'] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """记录 with 块的耗时（包括抛出异常的情况）。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        samples = []
+        for key, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state['counts']):
+                cumulative += count
+                samples.append(('_bucket', (('le', _format_value(float(bound))),), key, cumulative))
+            samples.append(('_sum', (), key, state['sum']))
+            samples.append(('_count', (), key, cumulative))
+        return samples
+
+
+class AgeGauge(_Metric):
+    """距离上次 touch() 的秒数，在抓取时计算。"""
+
+    type_name = 'gauge'
+
+    def touch(self, **labels):
+        self._values[self._key(labels)] = time.time()
+
+    def collect(self):
+        now = time.time()
+        return [('', (), key, round(now - touched, 3)) for key, touched in sorted(self._values.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+FETCH_SECONDS = REGISTRY.register(Histogram(
+    'monitor_fetch_seconds', '单个商品页面获取耗时（秒）', ('backend', 'javascript')))
+BROWSER_LAUNCH_SECONDS = REGISTRY.register(Histogram(
+    'monitor_browser_launch_seconds', '浏览器启动耗时（秒）'))
+PARSE_SECONDS = REGISTRY.register(Histogram(
+    'monitor_parse_seconds', '页面解析耗时（秒）', ('parser',),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)))
+TELEGRAM_SECONDS = REGISTRY.register(Histogram(
+    'monitor_telegram_seconds', 'Telegram 发送或编辑消息的耗时（秒）', ('kind',)))
+DETECTION_TO_SEND_SECONDS = REGISTRY.register(Histogram(
+    'monitor_detection_to_send_seconds', '从页面获取完成到 Telegram 消息发出或编辑完成的耗时（秒）', ('kind',)))
+FETCH_RETRIES = REGISTRY.register(Counter(
+    'monitor_fetch_retries', '页面获取重试次数', ('backend',)))
+HTTP_ERRORS = REGISTRY.register(Counter(
+    'monitor_http_errors', '非 200 响应次数', ('backend', 'status')))
+TITLE_MISMATCHES = REGISTRY.register(Counter(
+    'monitor_title_mismatches', '页面标题与 expected_title 不符的次数'))
+TRANSITIONS = REGISTRY.register(Counter(
+    'monitor_state_transitions', '库存状态变化次数', ('state',)))
+FETCH_TIERS = REGISTRY.register(Counter(
+    'monitor_fetch_tier', '分层抓取在各层发起的获取次数', ('tier',)))
+FETCH_ESCALATIONS = REGISTRY.register(Counter(
+    'monitor_fetch_escalations', '分层抓取从某一层升级到下一层的次数', ('tier',)))
+FAST_RENDER_FALLBACKS = REGISTRY.register(Counter(
+    'monitor_fast_render_fallbacks', '快速渲染失败后回退到完整流程的次数'))
+RESPONSE_RULE_MISSES = REGISTRY.register(Counter(
+    'monitor_response_rule_misses', '未能从接口响应判断库存、改用页面渲染的次数'))
+WHMCS_GROUP_LOOKUPS = REGISTRY.register(Counter(
+    'monitor_whmcs_group_lookups', '从 WHMCS 分组页读取商品库存的次数（hit）及改为单独获取的次数（fallback）',
+    ('result',)))
+HOST_CIRCUIT_TRANSITIONS = REGISTRY.register(Counter(
+    'monitor_host_circuit_transitions', '主机熔断状态变化次数（open、half_open、closed）', ('state',)))
+HOST_SKIPPED_CHECKS = REGISTRY.register(Counter(
+    'monitor_host_skipped_checks', '因主机熔断、试探中或降级而跳过的检查次数', ('reason',)))
+TRANSITION_CONFIRMATIONS = REGISTRY.register(Counter(
+    'monitor_transition_confirmations', '库存状态变化前的复查次数（confirmed、rejected、failed）', ('result',)))
+EVENTS_PUBLISHED = REGISTRY.register(Counter(
+    'monitor_events_published', '发布到事件总线的事件数', ('type',)))
+EVENTS_DROPPED = REGISTRY.register(Counter(
+    'monitor_events_dropped', '订阅者过慢时丢弃的 check 事件数（check）及因此断开的连接数（overflow）', ('reason',)))
+LAST_SUCCESS_AGE = REGISTRY.register(AgeGauge(
+    'monitor_item_last_success_age_seconds', '距离商品上次成功检查的秒数', ('item',)))
+
+
+class MetricsServer:
+    """在事件循环中运行的极简 HTTP 服务器，只提供 GET /metrics。"""
+
+    def __init__(self, host='127.0.0.1', port=9108, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置文件中的 metrics 段创建服务器，未启用时返回 None。"""
+        options = config.get('metrics', {})
+        if not options.get('enabled', False):
+            return None
+        return cls(options.get('host', '127.0.0.1'), options.get('port', 9108))
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"指标服务已启动: http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b'\r\n', b'\n', b''):
+                pass  # 忽略请求头
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                status, body, content_type = '404 Not Found', b'not found\n', 'text/plain'
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug("指标请求处理失败: %s", e)
+        finally:
+            writer.close()
@@ -1,30 +1,30 @@
 # -*- coding: utf-8 -*-
-from bs4 import BeautifulSoup
-import re
-from playwright.async_api import async_playwright
 import asyncio
-import json
-import os
 import fcntl
 import sys
 import logging
-from telegram import Bot
-from telegram.constants import ParseMode
-from telegram.error import BadRequest
 import time
-import html
 import signal
-import random
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,  # 设置为 DEBUG 以查看更多调试信息
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('/root/monitor/monitor_script.log')
-    ]
-)
+from browser_pool import BrowserPool
+from burst import active_window
+from checks import confirm_transition, fetch_page_content, format_message, get_random_user_agent, response_in_stock, title_matches
+from clearance import ClearanceCache
+from events import EventServer, publish_check
+from fast_render import FastRenderer
+from host_health import HostHealthTracker
+from log_pipeline import SAMPLED, log_check, setup_logging
+from scheduler import Scheduler, apply_config_diff
+from singleflight import SingleFlight
+from notifier import Notifier
+from response_rule import InterceptedPage
+from config_model import ConfigWatcher, diff_configs
+from state_store import StateStore
+from metrics import LAST_SUCCESS_AGE, TRANSITIONS, MetricsServer
+
+# 配置日志（加载配置文件后按其中的 logging 段重新设置，level 设为 DEBUG 可查看更多调试信息）
+LOG_FILE = '/root/monitor/monitor_script.log'
+setup_logging(LOG_FILE)
 logger = logging.getLogger()
 
 def acquire_lock(lock_file_path='/root/monitor/monitor_script.lock', retries=3, wait_time=5):
@@ -53,222 +53,228 @@ def handle_shutdown(signum, frame):
 signal.signal(signal.SIGINT, handle_shutdown)
 signal.signal(signal.SIGTERM, handle_shutdown)
 
-def get_random_user_agent():
-    """返回一个随机的 User-Agent。"""
-    user_agents = [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0",
-        "Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1",
-    ]
-    return random.choice(user_agents)
-
-async def fetch_page_content(url, enable_javascript=False, retries=3, expected_title=None):
-    """提取整个页面内容，支持动态启用/禁用 JavaScript。"""
-    for attempt in range(retries):
-        try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True)
-                context = await browser.new_context(
-                    user_agent=get_random_user_agent(),  # 随机 User-Agent
-                    java_script_enabled=enable_javascript  # 动态启用/禁用 JavaScript
-                )
-                page = await context.new_page()
-
-                # 模拟人类行为：随机延迟
-                response = await page.goto(url, wait_until='networkidle', timeout=120000)
-                if response.status != 200:
-                    logger.warning(f"HTTP 请求失败，状态码: {response.status}。URL: {url}")
-                    await browser.close()
-                    return None
-
-                await page.wait_for_timeout(random.randint(3000, 7000))  # 随机延迟 3-7 秒
-
-                # 模拟鼠标移动
-                await page.mouse.move(random.randint(100, 500), random.randint(100, 500))
-                await page.wait_for_timeout(random.randint(1000, 3000))  # 随机延迟 1-3 秒
-
-                # 如果启用 JavaScript，模拟点击 "Order" 按钮
-                if enable_javascript:
-                    await page.click('button:has-text("Order")')  # 假设按钮文本为 "Order"
-                    await page.wait_for_timeout(5000)  # 等待页面加载
-
-                # 提取整个页面内容
-                page_content = await page.content()
-
-                # 检查 <title> 标签内容
-                if expected_title:
-                    soup = BeautifulSoup(page_content, 'html.parser')
-                    title_tag = soup.find('title')
-                    if not title_tag or expected_title not in title_tag.text:
-                        logger.warning(f"页面标题不符合预期。URL: {url}")
-                        await browser.close()
-                        return None
-
-                await browser.close()
-                logger.info(f"成功提取页面内容。URL: {url}, JavaScript: {'启用' if enable_javascript else '禁用'}")
-                return page_content
-        except Exception as e:
-            logger.warning(f"第 {attempt + 1} 次尝试失败，URL: {url}，错误: {e}")
-            if attempt == retries - 1:
-                logger.error(f"经过 {retries} 次尝试后仍无法获取 URL: {url} 的内容")
-                return None
-            await asyncio.sleep(5)  # 重试前等待
-
-def parse_stock(page_content, out_of_stock_text, url, enable_javascript):
-    """根据页面内容解析库存信息。"""
+def parse_stock(parsed_page, out_of_stock_text, url, enable_javascript):
+    """根据解析后的页面信息判断库存。"""
     try:
-        if page_content is None:
+        if parsed_page is None:
             logger.warning(f"页面内容为空。URL: {url}")
             return False
 
-        soup = BeautifulSoup(page_content, 'html.parser')
+        if isinstance(parsed_page, InterceptedPage):
+            return response_in_stock(parsed_page, out_of_stock_text, url)
 
         # 检查页面内容是否包含无库存文本
-        if soup.find(string=lambda text: text and out_of_stock_text in text):
-            logger.info(f"无库存（根据页面内容）。URL: {url}")
+        if out_of_stock_text in parsed_page.text:
+            logger.info("无库存（根据页面内容）。URL: %s", url, extra=SAMPLED)
             return False
 
         # 无论是否启用 JavaScript，都只根据页面内容判断库存
-        logger.info(f"有库存（根据页面内容）。URL: {url}")
+        logger.info("有库存（根据页面内容）。URL: %s", url, extra=SAMPLED)
         return True
-
     except Exception as e:
         logger.error(f"解析页面内容时出错。URL: {url}, 错误: {e}")
         return True  # 假设解析错误意味着有库存
 
-async def send_notification(config, merchant, stock, in_stock, message_id=None):
-    """发送 Telegram 通知。"""
-    bot = Bot(token=config['telegram_token'])
-    title = f"{merchant['name']}-{stock['title']}"
-    tag = html.escape(merchant['tag'])
-    price = html.escape(stock['price'])
-    hardware_info = f"<a href=\"{stock['buy_url']}\">{html.escape(stock['hardware_info'])}</a>"
-    stock_info = f'🛒 <a href="{stock["buy_url"]}">库   存：{"有 - 抢购吧！" if in_stock else "无 - 已售罄！"}</a>'
-    buy_link = f"🔗 <s>{stock['buy_url']}</s>" if not in_stock else f"🔗 {stock['buy_url']}"
-    annual_coupon = f"🎁 优惠码：<code>{merchant['coupon_annual']}</code>" if merchant.get('coupon_annual') else ""
-    coupon_section = f"\n\n{annual_coupon}\n\n" if annual_coupon else "\n\n"
-
-    message = (
-        f"<b>{title}</b>\n\n"
-        f"💰 价  格: <b>{price}</b>\n\n"
-        f"📜 配  置：{hardware_info}\n\n"
-        f"ℹ️ {tag}"
-        f"{coupon_section}"
-        f"{stock_info}\n\n"
-        f"{buy_link}"
-    )
-
-    try:
-        if in_stock:
-            sent_message = await bot.send_message(
-                chat_id=config['telegram_chat_id'],
-                text=message,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True
-            )
-            return sent_message.message_id
-        elif message_id:
-            await bot.edit_message_text(
-                chat_id=config['telegram_chat_id'],
-                message_id=message_id,
-                text=message,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True
-            )
-    except BadRequest as e:
-        logger.error(f"发送或编辑消息时出错: {e}")
-    return None
+def send_notification(notifier, config, item, in_stock, detected_at=None):
+    """把 Telegram 通知交给后台分发器：有库存时发送新消息，无库存时编辑已发送的消息。"""
+    message = format_message(item, in_stock)
+    if in_stock:
+        notifier.send(item.item_id, config.telegram_chat_id, message, detected_at)
+    else:
+        notifier.edit(item.item_id, config.telegram_chat_id, message, detected_at)
 
-async def load_config(filename='/root/monitor/config.json'):
-    """加载配置文件。"""
-    if not os.path.exists(filename):
-        logger.error(f"配置文件 {filename} 不存在。")
-        sys.exit(1)
-    with open(filename, 'r', encoding='utf-8') as f:
-        logger.info(f"已加载配置文件: {filename}")
-        return json.load(f)
+def initialize_stock_status(config, state_store):
+    """初始化库存状态，如果之前没有状态则生成默认状态。"""
+    for unique_identifier in config.items:
+        if unique_identifier not in state_store:
+            # Initialize stock entry with default values
+            state_store.put(unique_identifier, {
+                'in_stock': True,
+                'message_id': None,
+                'last_check': None  # First time check, no last_check yet
+            })
+
+def track_item_metrics(diff):
+    """新增商品从加入时开始计算距上次成功检查的时间，已删除的商品不再导出。"""
+    for item in diff.added:
+        LAST_SUCCESS_AGE.touch(item=item.item_id)
+    for item_id in diff.removed:
+        LAST_SUCCESS_AGE.remove(item=item_id)
+
+async def check_item(browser_pool, single_flight, notifier, state_store, config, item, clearance=None, renderer=None,
+                     host_health=None, events=None):
+    """检查单个商品并处理库存状态变化，返回状态是否发生变化。
+
+    check_url 和 JavaScript 模式相同的商品同时检查时共用一次页面获取。提供 host_health
+    （HostHealthTracker）时，熔断中的主机不发起获取。库存状态变化时先单独复查一次，
+    在 confirm_deadline 秒内确认后才发送通知。提供 events（EventBus）时，检查结果
+    在发送通知之前发布到事件总线。
+    """
+    url = item.check_url
+
+    def fetch():
+        if renderer is not None:
+            return renderer.fetch(url, item.enable_javascript, item.ready_selector, item.out_of_stock_text,
+                                  response_rule=item.response_rule)
+        return fetch_page_content(browser_pool, url, item.enable_javascript,
+                                  parser_backend=config.get('parser_backend', 'auto'), clearance=clearance)
+
+    def confirm_fetch():
+        # 复查只尝试一次、不模拟人类操作，尽量在 confirm_deadline 内完成
+        if renderer is not None:
+            return renderer.fetch(url, item.enable_javascript, item.ready_selector, item.out_of_stock_text,
+                                  emulate_human=False, response_rule=item.response_rule)
+        return fetch_page_content(browser_pool, url, item.enable_javascript, retries=1,
+                                  parser_backend=config.get('parser_backend', 'auto'), emulate_human=False,
+                                  clearance=clearance)
+
+    def guarded(fetch):
+        if host_health is not None:
+            return host_health.call(url, fetch, browser=True)  # 本脚本总是用浏览器获取
+        return fetch()
+
+    # 接口响应规则不同的商品各自获取；集中检查时段内只复用不超过时段检查间隔的结果
+    window = active_window(item.burst_windows, time.time())
+    started = time.monotonic()
+    parsed_page = await single_flight.do((url, item.enable_javascript, item.response_rule), lambda: guarded(fetch),
+                                         window.interval if window is not None else None)
+    fetched = time.monotonic()
+    detected_at = time.time()  # 用于统计从获取完成到通知发出的延迟
+    if parsed_page is None or not title_matches(parsed_page, item.expected_title, url):
+        return False
+
+    in_stock = parse_stock(parsed_page, item.out_of_stock_text, url, item.enable_javascript)
+    phases = {'fetch': fetched - started, 'detect': time.monotonic() - fetched}
+    LAST_SUCCESS_AGE.touch(item=item.item_id)
+    unique_identifier = item.item_id
+    previous_status = state_store.get(unique_identifier, {'in_stock': True, 'message_id': None})
+    confirm_deadline = config.get('confirm_deadline', 15)
+    if in_stock != previous_status['in_stock'] and confirm_deadline:
+        # 单次异常页面（渲染不完整等）不发通知，复查确认后才改变状态
+        confirming = time.monotonic()
+        confirmed = await confirm_transition(
+            lambda: guarded(confirm_fetch),
+            lambda page: parse_stock(page, item.out_of_stock_text, url, item.enable_javascript)
+            if title_matches(page, item.expected_title, url) else None,
+            in_stock, confirm_deadline, url,
+        )
+        phases['confirm'] = time.monotonic() - confirming
+        if not confirmed:
+            if events is not None:
+                publish_check(events, item.item_id, item, previous_status['in_stock'], False, detected_at)
+            log_check(logger, item.item_id, previous_status['in_stock'], False, phases)
+            return False
 
-async def load_stock_status(filename='/root/monitor/stock_status.json'):
-    """加载库存状态。如果文件不存在，自动初始化。"""
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
+    if events is not None:
+        publish_check(events, item.item_id, item, in_stock, in_stock != previous_status['in_stock'], detected_at)
+    if in_stock and not previous_status['in_stock']:
+        # message_id 在消息实际发出后由分发器回填
+        state_store.put(unique_identifier, {'in_stock': True, 'message_id': None, 'last_check': int(time.time())})
+        send_notification(notifier, config, item, in_stock, detected_at)
+        TRANSITIONS.inc(state='in_stock')
+        changed = True
+    elif not in_stock and previous_status['in_stock']:
+        send_notification(notifier, config, item, in_stock, detected_at)
+        state_store.put(unique_identifier, {'in_stock': False, 'message_id': previous_status['message_id'], 'last_check': int(time.time())})
+        TRANSITIONS.inc(state='out_of_stock')
+        changed = True
     else:
-        # Initialize an empty dictionary for stock status
-        return {}
+        changed = False
+    log_check(logger, item.item_id, in_stock, changed, phases)
+    return changed
 
-async def save_stock_status(stock_status, filename='/root/monitor/stock_status.json'):
-    """保存库存状态，包括最后检查时间。"""
-    for unique_identifier, status in stock_status.items():
-        # Ensure that 'last_check' is always updated to the current time (timestamp)
-        status['last_check'] = int(time.time())  # Store timestamp for the last check
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(stock_status, f, ensure_ascii=False, indent=4)
+async def main(config_file='/root/monitor/config.json'):
+    """主函数。
 
-async def initialize_stock_status(config, stock_status):
-    """初始化库存状态，如果之前没有状态则生成默认状态。"""
-    for merchant in config['merchants']:
-        for stock in merchant['stock_urls']:
-            unique_identifier = stock['title']
-            if unique_identifier not in stock_status:
-                # Initialize stock entry with default values
-                stock_status[unique_identifier] = {
-                    'in_stock': True,
-                    'message_id': None,
-                    'last_check': None  # First time check, no last_check yet
-                }
-    return stock_status
-
-async def main():
-    """主函数。"""
+    配置只在文件变化时重新加载，并把新增、删除、变更的商品应用到调度器；
+    每个商品由调度器按自己的间隔独立检查，库存状态变化时立即写入 SQLite。
+    """
     lock_file = acquire_lock()
+    watcher = ConfigWatcher(config_file)
+    config = watcher.poll()
+    if config is None:
+        logger.error(f"无法加载配置文件 {config_file}。")
+        sys.exit(1)
+    setup_logging(LOG_FILE, config.get('logging'))
+
+    browser_pool = None
+    scheduler_task = None
+    notifier = None
+    state_store = None
+    metrics_server = None
+    event_server = None
 
     try:
+        state_store = StateStore(config.get('state_db', '/root/monitor/stock_status.db'),
+                                 legacy_json='/root/monitor/stock_status.json')
+
+        metrics_server = MetricsServer.from_config(config.raw)
+        if metrics_server is not None:
+            await metrics_server.start()
+        event_server = EventServer.from_config(config.raw)
+        if event_server is not None:
+            await event_server.start()
+
+        # 浏览器池、通知分发器等在整个运行期间常驻，所有检查共用
+        browser_pool = BrowserPool.from_config(config.raw, user_agent_factory=get_random_user_agent)
+        clearance = ClearanceCache.from_config(config.raw, '/root/monitor/clearance.json')
+        renderer = FastRenderer.from_config(config.raw, browser_pool, config.get('parser_backend', 'auto'), clearance)
+        notifier = Notifier.from_config(
+            config.raw, '/root/monitor/notify_queue.json',
+            on_sent=state_store.set_message_id,
+            message_id_for=lambda unique_identifier: state_store.get(unique_identifier, {}).get('message_id'),
+        )
+        await notifier.start()
+        single_flight = SingleFlight(share_window=config.get('share_window', 5))
+        host_health = HostHealthTracker.from_config(config.raw)
+        scheduler = Scheduler(
+            # config 在重新加载后指向新配置，检查时总是使用最新的全局设置
+            lambda item: check_item(browser_pool, single_flight, notifier, state_store, config, item, clearance, renderer,
+                                    host_health, event_server.bus if event_server is not None else None),
+            max_concurrency=config.get('browser_pool', {}).get('max_pages', 4),
+        )
+        initialize_stock_status(config, state_store)
+        diff = diff_configs(None, config)
+        apply_config_diff(scheduler, diff)
+        track_item_metrics(diff)
+        scheduler_task = asyncio.create_task(scheduler.run())
+
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
         while True:
-            config = await load_config()  # 每次循环重新加载配置文件
-            stock_status = await load_stock_status()
-
-            # Initialize stock status with default values if not present
-            stock_status = await initialize_stock_status(config, stock_status)
-
-            tasks = []
-            for merchant in config['merchants']:
-                if merchant['enabled']:
-                    for stock in merchant['stock_urls']:
-                        enable_javascript = stock.get('enable_javascript', False)
-                        expected_title = stock.get('expected_title', None)
-                        tasks.append(fetch_page_content(stock['check_url'], enable_javascript, expected_title=expected_title))
-            results = await asyncio.gather(*tasks)
-            result_index = 0
-
-            for merchant in config['merchants']:
-                if not merchant['enabled']:
-                    continue
-                for stock in merchant['stock_urls']:
-                    page_content = results[result_index]
-                    result_index += 1
-
-                    if page_content is None:
-                        continue
-
-                    in_stock = parse_stock(page_content, merchant['out_of_stock_text'], stock['check_url'], stock.get('enable_javascript', False))
-                    unique_identifier = stock['title']
-                    previous_status = stock_status.get(unique_identifier, {'in_stock': True})
-
-                    if in_stock and not previous_status['in_stock']:
-                        message_id = await send_notification(config, merchant, stock, in_stock)
-                        stock_status[unique_identifier] = {'in_stock': True, 'message_id': message_id, 'last_check': int(time.time())}
-                    elif not in_stock and previous_status['in_stock']:
-                        await send_notification(config, merchant, stock, in_stock, previous_status['message_id'])
-                        stock_status[unique_identifier] = {'in_stock': False, 'message_id': previous_status['message_id'], 'last_check': int(time.time())}
-
-            await save_stock_status(stock_status)
-            await asyncio.sleep(config.get('check_interval', 600))
+            await asyncio.sleep(config.get('config_poll_interval', 5))
+            if scheduler_task.done():
+                scheduler_task.result()  # 调度器异常退出时抛出异常
+
+            new_config = watcher.poll()
+            if new_config is not None:
+                diff = diff_configs(config, new_config)
+                config = new_config
+                initialize_stock_status(config, state_store)
+                apply_config_diff(scheduler, diff)
+                track_item_metrics(diff)
+                logger.info(f"配置已更新：{diff}。")
+
+            if loop.time() - last_report >= config.check_interval:
+                last_report = loop.time()
+                logger.info(f"页面获取 {single_flight.started} 次，合并重复请求 {single_flight.shared} 次。")
 
     except Exception as e:
         logger.error(f"发生错误: {e}")
     finally:
+        if scheduler_task is not None:
+            scheduler_task.cancel()
+            await asyncio.gather(scheduler_task, return_exceptions=True)
+        if browser_pool is not None:
+            await browser_pool.close()
+        if notifier is not None:
+            await notifier.close()
+        if state_store is not None:
+            state_store.close()
+        if metrics_server is not None:
+            await metrics_server.close()
+        if event_server is not None:
+            await event_server.close()
         lock_file.close()
 
 if __name__ == '__main__':
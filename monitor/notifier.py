@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+
+from telegram import Bot
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
+
+from metrics import DETECTION_TO_SEND_SECONDS, TELEGRAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_SEND = 0  # "有库存" 新消息优先发送
+PRIORITY_EDIT = 1  # "已售罄" 编辑可以稍后
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个令牌，最多积累 capacity 个。"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """距离下一个令牌可用还需等待的秒数。"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class Notifier:
+    """后台 Telegram 通知分发器。
+
+    使用一个常驻的 Bot 和 HTTP 连接池，每个聊天一个队列，队列内按优先级（新消息
+    先于编辑）逐条发送。每次从令牌桶有令牌的聊天中取优先级最高的消息，某个聊天
+    达到限速时不影响其他聊天；只有全局令牌桶和 RetryAfter 暂停（retry_after 秒）
+    会暂停所有发送。超时和网络错误按指数退避重试。排队中的消息持久化到
+    queue_file，重启后继续发送；save_delay 秒内的多次队列变化合并为一次写入。
+
+    on_sent(key, message_id) 在新消息发送成功后调用；message_id_for(key)
+    在执行编辑时返回要编辑的消息 ID。send/edit 传入 detected_at（页面获取完成的
+    Unix 时间戳）时，消息发出后记录从检测到发送的延迟。
+    """
+
+    def __init__(self, token, queue_file, on_sent=None, message_id_for=None, global_rate=25,
+                 chat_rate=20 / 60, chat_burst=3, max_attempts=5, pool_size=8, save_delay=1.0):
+        self.bot = Bot(token=token, request=HTTPXRequest(connection_pool_size=pool_size))
+        self.queue_file = queue_file
+        self.on_sent = on_sent
+        self.message_id_for = message_id_for
+        self.max_attempts = max_attempts
+        self.save_delay = save_delay
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+        self._chat_queues = {}  # chat_id -> [(优先级, 任务 ID, 任务)] 堆
+        self._wakeup = asyncio.Event()
+        self._jobs = {}  # 未完成的任务（包括等待重试的），用于持久化
+        self._pending_sends = {}  # key -> 未完成的新消息数
+        self._ids = itertools.count()
+        self._worker = None
+        self._save_handle = None
+
+    @classmethod
+    def from_config(cls, config, queue_file, on_sent=None, message_id_for=None, local_path=None):
+        """根据配置文件中的 notifier 段创建分发器。
+
+        提供 local_path 时，用它把配置的队列文件路径转换为本进程使用的路径（如集群模式下每个进程一个文件）。
+        """
+        options = config.get('notifier', {})
+        queue_file = options.get('queue_file', queue_file)
+        return cls(
+            config['telegram_token'],
+            local_path(queue_file) if local_path is not None else queue_file,
+            on_sent=on_sent,
+            message_id_for=message_id_for,
+            global_rate=options.get('global_rate', 25),
+            chat_rate=options.get('chat_rate', 20 / 60),
+            chat_burst=options.get('chat_burst', 3),
+            max_attempts=options.get('max_attempts', 5),
+            save_delay=options.get('save_delay', 1.0),
+        )
+
+    async def start(self):
+        """初始化 Bot，恢复上次未发送的消息并启动后台分发任务。"""
+        await self.bot.initialize()
+        for job in self._load_queue():
+            self._put(job)
+        if self._jobs:
+            logger.info(f"恢复了 {len(self._jobs)} 条未发送的通知。")
+        self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止分发，保存未发送的消息并关闭 Bot。"""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        self._save_queue()
+        await self.bot.shutdown()
+
+    def send(self, key, chat_id, text, detected_at=None):
+        """排队发送一条新消息（有库存）。"""
+        self._add({'kind': 'send', 'key': key, 'chat_id': chat_id, 'text': text, 'detected_at': detected_at})
+
+    def edit(self, key, chat_id, text, detected_at=None):
+        """排队编辑 key 对应的已发送消息（已售罄）。"""
+        self._add({'kind': 'edit', 'key': key, 'chat_id': chat_id, 'text': text, 'detected_at': detected_at})
+
+    def pending(self):
+        return len(self._jobs)
+
+    def _add(self, job):
+        job['id'] = next(self._ids)
+        job['attempts'] = 0
+        self._put(job)
+        self._schedule_save()
+
+    def _put(self, job):
+        if 'id' not in job:
+            job['id'] = next(self._ids)
+        self._jobs[job['id']] = job
+        if job['kind'] == 'send':
+            self._pending_sends[job['key']] = self._pending_sends.get(job['key'], 0) + 1
+        self._enqueue(job)
+
+    def _enqueue(self, job):
+        priority = PRIORITY_SEND if job['kind'] == 'send' else PRIORITY_EDIT
+        heapq.heappush(self._chat_queues.setdefault(job['chat_id'], []), (priority, job['id'], job))
+        self._wakeup.set()
+
+    def _requeue_later(self, job, delay):
+        """delay 秒后重新排队；等待期间任务仍保留在持久化队列中。"""
+        asyncio.get_running_loop().call_later(delay, self._enqueue, job)
+
+    def _finish(self, job):
+        self._jobs.pop(job['id'], None)
+        if job['kind'] == 'send':
+            remaining = self._pending_sends.get(job['key'], 1) - 1
+            if remaining > 0:
+                self._pending_sends[job['key']] = remaining
+            else:
+                self._pending_sends.pop(job['key'], None)
+        self._schedule_save()
+
+    def _schedule_save(self):
+        """save_delay 秒后写入队列文件，期间的其他变化一起写入。"""
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(self.save_delay, self._flush_queue)
+
+    def _flush_queue(self):
+        self._save_handle = None
+        self._save_queue()
+
+    def _chat_bucket(self, chat_id):
+        chat_bucket = self._chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return chat_bucket
+
+    def _next_job(self):
+        """取出下一条可以发送的任务，没有时返回 (None, 需要等待的秒数)。
+
+        全局令牌桶为空或处于 RetryAfter 暂停期时所有聊天都等待；否则在令牌桶有令牌的
+        聊天中取优先级最高、最早排队的任务，限速中的聊天不阻塞其他聊天。
+        """
+        delay = max(self._global_bucket.delay(), self._paused_until - time.monotonic())
+        if delay > 0:
+            return None, delay
+        best = None
+        wait = None
+        for chat_id, jobs in self._chat_queues.items():
+            chat_delay = self._chat_bucket(chat_id).delay()
+            if chat_delay > 0:
+                wait = chat_delay if wait is None else min(wait, chat_delay)
+            elif best is None or jobs[0][:2] < best[1][:2]:
+                best = (chat_id, jobs[0])
+        if best is None:
+            return None, wait
+        chat_id, _ = best
+        _, _, job = heapq.heappop(self._chat_queues[chat_id])
+        if not self._chat_queues[chat_id]:
+            del self._chat_queues[chat_id]
+        return job, 0
+
+    async def _run(self):
+        while True:
+            job, delay = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job['kind'] == 'edit' and job['key'] in self._pending_sends:
+                # 对应的新消息还没发出，稍后再编辑
+                self._requeue_later(job, 1)
+                continue
+            self._global_bucket.take()
+            self._chat_bucket(job['chat_id']).take()
+            await self._dispatch(job)
+
+    async def _dispatch(self, job):
+        try:
+            if job['kind'] == 'send':
+                with TELEGRAM_SECONDS.time(kind='send'):
+                    sent_message = await self.bot.send_message(
+                        chat_id=job['chat_id'],
+                        text=job['text'],
+                        parse_mode=ParseMode.HTML,
+                        disable_web_page_preview=True  # 禁用链接预览
+                    )
+                self._observe_latency(job)
+                if self.on_sent is not None:
+                    self.on_sent(job['key'], sent_message.message_id)
+            else:
+                message_id = self.message_id_for(job['key']) if self.message_id_for else None
+                if message_id:
+                    with TELEGRAM_SECONDS.time(kind='edit'):
+                        await self.bot.edit_message_text(
+                            chat_id=job['chat_id'],
+                            message_id=message_id,
+                            text=job['text'],
+                            parse_mode=ParseMode.HTML,
+                            disable_web_page_preview=True
+                        )
+                    self._observe_latency(job)
+            self._finish(job)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            retry_after = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+            logger.warning(f"Telegram 限流，{retry_after} 秒后重试。")
+            self._paused_until = time.monotonic() + retry_after
+            self._requeue_later(job, retry_after)
+        except BadRequest as e:
+            logger.error(f"发送或编辑消息时出错: {e}")
+            self._finish(job)
+        except (TimedOut, NetworkError) as e:
+            job['attempts'] += 1
+            if job['attempts'] >= self.max_attempts:
+                logger.error(f"发送消息失败，已重试 {job['attempts']} 次，放弃: {e}")
+                self._finish(job)
+            else:
+                delay = min(60, 2 ** job['attempts'])
+                logger.warning(f"发送消息超时或网络错误，{delay} 秒后重试: {e}")
+                self._requeue_later(job, delay)
+        except Exception as e:
+            logger.error(f"发送消息时出现未知错误: {e}")
+            self._finish(job)
+
+    def _observe_latency(self, job):
+        detected_at = job.get('detected_at')
+        if detected_at is None:
+            return
+        latency = max(0.0, time.time() - detected_at)
+        DETECTION_TO_SEND_SECONDS.observe(latency, kind=job['kind'])
+        logger.info("通知 %s 从检测到%s完成耗时 %.3f 秒。", job['key'], '发送' if job['kind'] == 'send' else '编辑', latency)
+
+    def _load_queue(self):
+        if not self.queue_file or not os.path.exists(self.queue_file):
+            return []
+        try:
+            with open(self.queue_file, 'r', encoding='utf-8') as f:
+                jobs = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"读取通知队列文件出错: {e}")
+            return []
+        for job in jobs:
+            job.pop('id', None)
+        return jobs
+
+    def _save_queue(self):
+        """原子地写入未完成的任务。"""
+        if not self.queue_file:
+            return
+        jobs = sorted(self._jobs.values(), key=lambda job: job['id'])
+        temp_file = f"{self.queue_file}.tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(jobs, f, ensure_ascii=False)
+            os.replace(temp_file, self.queue_file)
+        except OSError as e:
+            logger.error(f"保存通知队列文件出错: {e}")
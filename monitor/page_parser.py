@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import re
+import time
+
+from bs4 import BeautifulSoup
+
+from metrics import PARSE_SECONDS
+
+# 可选的快速解析后端，未安装时回退到 BeautifulSoup
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+try:
+    import lxml.html as lxml_html
+except ImportError:
+    lxml_html = None
+
+logger = logging.getLogger(__name__)
+
+STOCK_PATTERN = re.compile(r'(\d+)\s+in stock', re.IGNORECASE)
+ERRORS_PATTERN = re.compile(r'(?:var|let|const)\s+errors\s*=\s*(\[.*?\]);', re.DOTALL)
+
+
+class ParsedPage:
+    """一次解析得到的页面信息。
+
+    text 为页面全部文本（与 BeautifulSoup 的 get_text() 一致，包含脚本内容），
+    stock_count 为 "N in stock" 中的 N，errors 为页面脚本中的 errors 数组，
+    未找到时均为 None。
+    """
+
+    __slots__ = ('title', 'text', 'stock_count', 'errors', 'backend')
+
+    def __init__(self, title, text, scripts, backend):
+        self.title = title
+        self.text = text
+        self.backend = backend
+        stock_match = STOCK_PATTERN.search(text)
+        self.stock_count = int(stock_match.group(1)) if stock_match else None
+        self.errors = _find_errors(scripts)
+
+
+def _find_errors(scripts):
+    """在脚本内容中查找 `var errors = [...]` 并解析为列表。"""
+    for script in scripts:
+        if not script or 'errors' not in script:
+            continue
+        match = ERRORS_PATTERN.search(script)
+        if not match:
+            continue
+        try:
+            return json.loads(match.group(1))
+        except json.JSONDecodeError as e:
+            logger.warning(f"解析 errors 数组时出错: {e}")
+            return None
+    return None
+
+
+def _parse_selectolax(html):
+    tree = HTMLParser(html)
+    title_node = tree.css_first('title')
+    title = title_node.text() if title_node else None
+    root = tree.root
+    text = root.text(deep=True, separator='') if root else ''
+    scripts = [node.text(deep=True) for node in tree.css('script')]
+    return title, text, scripts
+
+
+def _parse_lxml(html):
+    root = lxml_html.document_fromstring(html)
+    title = root.findtext('.//title')
+    text = root.text_content()
+    scripts = [node.text for node in root.iter('script')]
+    return title, text, scripts
+
+
+def _parse_bs4(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    title = soup.title.get_text() if soup.title else None
+    text = soup.get_text()
+    scripts = [tag.string for tag in soup.find_all('script')]
+    return title, text, scripts
+
+
+BACKENDS = {
+    'selectolax': _parse_selectolax if HTMLParser is not None else None,
+    'lxml': _parse_lxml if lxml_html is not None else None,
+    'bs4': _parse_bs4,
+}
+
+
+def available_backends():
+    """返回当前环境可用的解析后端，按速度从快到慢排列。"""
+    return [name for name, parser in BACKENDS.items() if parser is not None]
+
+
+def resolve_backend(backend='auto'):
+    """把配置中的 parser_backend 解析为可用的后端名，不可用时回退到最快的可用后端。"""
+    if backend != 'auto' and BACKENDS.get(backend) is not None:
+        return backend
+    if backend != 'auto':
+        logger.warning(f"解析后端 {backend} 不可用，改用自动选择。")
+    return available_backends()[0]
+
+
+def parse_page(html, backend='auto'):
+    """对页面只做一次解析，同时提取标题、文本、库存数量和 errors 数组。
+
+    快速后端解析失败时回退到 BeautifulSoup。
+    """
+    name = resolve_backend(backend)
+    start = time.perf_counter()
+    try:
+        title, text, scripts = BACKENDS[name](html)
+    except Exception as e:
+        if name == 'bs4':
+            raise
+        logger.warning(f"{name} 解析失败，回退到 BeautifulSoup: {e}")
+        name = 'bs4'
+        title, text, scripts = _parse_bs4(html)
+    parsed_page = ParsedPage(title, text or '', scripts, name)
+    PARSE_SECONDS.observe(time.perf_counter() - start, parser=name)
+    return parsed_page
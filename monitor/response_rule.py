@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""接口响应规则：从页面发出的购物车/下单接口的 JSON 响应中直接读取库存状态。"""
+import re
+
+DEFAULT_CLICK = 'button:has-text("Order")'
+
+
+class ResponseRule:
+    """商品的 response_rule 配置。
+
+    url_pattern 为匹配接口 URL 的正则表达式，field 为 JSON 字段路径（用点分隔，列表用
+    数字下标，如 data.products.0.stock），click 为页面加载后点击的元素（为空时不点击）。
+    """
+
+    __slots__ = ('url_pattern', 'field', 'click', '_pattern')
+
+    def __init__(self, url_pattern, field, click=DEFAULT_CLICK):
+        self.url_pattern = url_pattern
+        self.field = field
+        self.click = click
+        self._pattern = re.compile(url_pattern)
+
+    @classmethod
+    def from_config(cls, options):
+        """根据商品配置中的 response_rule 段创建规则，不合法时抛出 ValueError。"""
+        if not isinstance(options, dict) or 'url_pattern' not in options or 'field' not in options:
+            raise ValueError("response_rule 需要 url_pattern 和 field 字段")
+        try:
+            return cls(options['url_pattern'], options['field'], options.get('click', DEFAULT_CLICK))
+        except re.error as e:
+            raise ValueError(f"response_rule 的 url_pattern 无效: {e}")
+
+    def matches(self, url):
+        return self._pattern.search(url) is not None
+
+    def extract(self, data):
+        """按字段路径取出 JSON 中的值，路径不存在时返回 None。"""
+        value = data
+        for part in self.field.split('.'):
+            if isinstance(value, dict):
+                value = value.get(part)
+            elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+                value = value[int(part)]
+            else:
+                return None
+        return value
+
+    def key(self):
+        return (self.url_pattern, self.field, self.click)
+
+    def __eq__(self, other):
+        return isinstance(other, ResponseRule) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+def response_stock(value, out_of_stock_text):
+    """根据接口字段的值判断库存，无法判断时返回 None。
+
+    布尔值直接表示是否有库存，数字为库存数量，字符串或字符串列表（如 errors 数组）
+    包含无库存文本时为无库存。
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value > 0
+    if isinstance(value, str):
+        return out_of_stock_text not in value
+    if isinstance(value, list):
+        return not any(out_of_stock_text in str(element) for element in value)
+    return None
+
+
+class InterceptedPage:
+    """从接口响应（或 WHMCS 分组页）得到的检查结果，代替 ParsedPage 用于标题检查和库存判断。
+
+    value 为规则字段的值，库存状态在判断时按商品的无库存文本计算。
+    """
+
+    __slots__ = ('title', 'value', 'url')
+
+    def __init__(self, title, value, url):
+        self.title = title
+        self.value = value
+        self.url = url  # 匹配到的接口或分组页 URL
+
+    @property
+    def stock_count(self):
+        if isinstance(self.value, (int, float)) and not isinstance(self.value, bool):
+            return self.value
+        return None
+
+    def in_stock(self, out_of_stock_text):
+        return response_stock(self.value, out_of_stock_text)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import heapq
+import logging
+import random
+import time
+
+from burst import active_window, next_wakeup
+
+logger = logging.getLogger(__name__)
+
+
+class _ScheduleEntry:
+    """一个商品的调度状态。"""
+
+    __slots__ = ('key', 'payload', 'base_interval', 'interval', 'min_interval', 'max_interval',
+                 'jitter', 'deadline', 'windows', 'next_due', 'seq', 'running', 'checks', 'changes')
+
+    def __init__(self, key):
+        self.key = key
+        self.payload = None
+        self.base_interval = None
+        self.interval = None
+        self.min_interval = None
+        self.max_interval = None
+        self.jitter = 0.0
+        self.deadline = None
+        self.windows = ()
+        self.next_due = None
+        self.seq = 0  # 每次重新排期加一，用于识别堆中过期的记录
+        self.running = False
+        self.checks = 0
+        self.changes = 0
+
+
+class Scheduler:
+    """按商品独立调度的持续调度器。
+
+    用优先队列保存每个商品的下次检查时间，到期即单独启动检查任务，慢的商品
+    不会阻塞其他商品。每个商品有自己的间隔、抖动和截止时间；检查函数返回 True
+    （状态发生变化）时间隔减半，否则缓慢增长，间隔限制在 [min_interval, max_interval]。
+    设置了集中检查时段（windows）的商品在时段开始前预热检查一次，时段内按时段的间隔检查。
+    """
+
+    def __init__(self, check, max_concurrency=None, shrink=0.5, growth=1.05):
+        self._check = check  # async def check(payload) -> 是否发生状态变化
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.shrink = shrink
+        self.growth = growth
+        self._entries = {}
+        self._heap = []
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+
+    def keys(self):
+        return set(self._entries)
+
+    def add_or_update(self, key, payload, interval, jitter=0.1, deadline=None,
+                      min_interval=None, max_interval=None, windows=()):
+        """新增商品或更新已有商品的检查参数；新商品在一个抖动范围内尽快检查。"""
+        entry = self._entries.get(key)
+        is_new = entry is None
+        if is_new:
+            entry = self._entries[key] = _ScheduleEntry(key)
+        entry.payload = payload
+        entry.jitter = max(0.0, jitter)
+        entry.deadline = deadline
+        entry.windows = tuple(windows)
+        entry.min_interval = min_interval if min_interval is not None else interval / 4
+        entry.max_interval = max_interval if max_interval is not None else interval * 4
+        if entry.base_interval != interval:
+            entry.base_interval = entry.interval = interval
+        if is_new:
+            loop = asyncio.get_running_loop()
+            self._push(entry, loop.time() + random.uniform(0, interval * entry.jitter))
+
+    def remove(self, key):
+        """移除商品；正在运行的检查完成后不再排期。"""
+        self._entries.pop(key, None)
+
+    def stats(self, key):
+        """返回商品当前的间隔、检查次数和状态变化次数。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return {'interval': entry.interval, 'checks': entry.checks, 'changes': entry.changes}
+
+    def _push(self, entry, due):
+        entry.seq += 1
+        entry.next_due = due
+        heapq.heappush(self._heap, (due, entry.seq, entry.key))
+        self._wakeup.set()
+
+    def _reschedule(self, entry, changed):
+        entry.checks += 1
+        if changed:
+            entry.changes += 1
+            entry.interval = max(entry.min_interval, entry.interval * self.shrink)
+        else:
+            entry.interval = min(entry.max_interval, entry.interval * self.growth)
+        delay = entry.interval * (1 + random.uniform(-entry.jitter, entry.jitter))
+        if entry.windows:
+            delay = self._window_delay(entry, delay)
+        self._push(entry, asyncio.get_running_loop().time() + max(0.0, delay))
+
+    def _window_delay(self, entry, delay):
+        """时段内使用时段的间隔；时段外不晚于下一次预热或时段开始的时间。"""
+        now = time.time()
+        window = active_window(entry.windows, now)
+        if window is not None:
+            return window.interval * (1 + random.uniform(-entry.jitter, entry.jitter))
+        wakeup = next_wakeup(entry.windows, now)
+        return min(delay, wakeup - now) if wakeup is not None else delay
+
+    async def _run_entry(self, entry):
+        changed = False
+        try:
+            if self._semaphore is not None:
+                async with self._semaphore:
+                    changed = await asyncio.wait_for(self._check(entry.payload), entry.deadline)
+            else:
+                changed = await asyncio.wait_for(self._check(entry.payload), entry.deadline)
+        except asyncio.TimeoutError:
+            logger.warning(f"{entry.key} 检查超过截止时间 {entry.deadline} 秒，已取消。")
+        except Exception as e:
+            logger.error(f"{entry.key} 检查时出错: {e}")
+        finally:
+            entry.running = False
+            if self._entries.get(entry.key) is entry:
+                self._reschedule(entry, bool(changed))
+
+    async def run(self):
+        """持续运行：取出到期的商品启动检查，直到被取消。"""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                now = loop.time()
+                while self._heap and self._heap[0][0] <= now:
+                    _, seq, key = heapq.heappop(self._heap)
+                    entry = self._entries.get(key)
+                    if entry is None or entry.seq != seq or entry.running:
+                        continue  # 已移除或已重新排期的过期记录
+                    entry.running = True
+                    task = asyncio.create_task(self._run_entry(entry))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+
+
+def apply_config_diff(scheduler, diff, key=None, payload=None):
+    """把配置变化应用到调度器：新增和变更的商品按其检查参数排期，删除的商品移出调度。
+
+    key(item_id) 返回调度键，payload(item) 返回传给检查函数的参数；默认分别为
+    item_id 和商品对象本身。
+    """
+    key = key or (lambda item_id: item_id)
+    payload = payload or (lambda item: item)
+    for item in diff.added + diff.changed:
+        scheduler.add_or_update(
+            key(item.item_id),
+            payload(item),
+            interval=item.check_interval,
+            jitter=item.check_jitter,
+            deadline=item.check_deadline,
+            min_interval=item.min_interval,
+            max_interval=item.max_interval,
+            windows=item.burst_windows,
+        )
+    for item_id in diff.removed:
+        scheduler.remove(key(item_id))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """合并进程内对同一个键的并发请求。
+
+    同一键已有请求在进行时，后来的调用者直接等待这次请求的结果，不再重复发起；
+    share_window 秒内刚完成的结果也直接复用。请求以独立任务运行，某个调用者被
+    取消（如超过截止时间）不会影响其他等待者。
+    """
+
+    def __init__(self, share_window=0):
+        self.share_window = share_window
+        self._inflight = {}
+        self._recent = {}  # key -> (完成时间, 任务)
+        self.started = 0  # 实际发起的请求数
+        self.shared = 0  # 被合并、复用他人结果的调用数
+
+    async def do(self, key, factory, max_age=None):
+        """返回 factory() 的结果；同一 key 的并发调用共享同一次执行。
+
+        max_age 限制可复用的已完成结果的最长时间（秒），为 0 时只合并进行中的请求。
+        """
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        share_window = self.share_window if max_age is None else min(self.share_window, max_age)
+        if task is None and share_window > 0:
+            recent = self._recent.get(key)
+            if recent is not None and loop.time() - recent[0] <= share_window:
+                task = recent[1]
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+            self.started += 1
+        else:
+            self.shared += 1
+            logger.debug("合并重复请求: %s", key)
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            if not task.cancelled():
+                logger.debug("%s 请求出错: %s", key, task.exception())
+            return
+        if self.share_window > 0:
+            now = asyncio.get_running_loop().time()
+            self._recent[key] = (now, task)
+            # 顺便清理过期的结果，避免长期运行时无限增长
+            for stale_key in [k for k, (done_at, _) in self._recent.items() if now - done_at > self.share_window]:
+                del self._recent[stale_key]
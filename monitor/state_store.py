@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stock_status (
+    item_id TEXT PRIMARY KEY,
+    in_stock INTEGER NOT NULL,
+    message_id INTEGER,
+    last_check INTEGER,
+    updated_at INTEGER NOT NULL
+)
+'''
+
+
+class StateStore:
+    """基于 SQLite（WAL 模式）的库存状态存储。
+
+    所有状态在内存中缓存一份，put() 只在状态确实变化时对单个商品执行一次
+    原子 upsert，不再整体重写文件。首次启动且数据库为空时，自动导入旧的
+    stock_status.json 并将其重命名为 .migrated。
+    """
+
+    def __init__(self, path, legacy_json=None):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None)  # 自动提交，每条语句是一个事务
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(SCHEMA)
+        self._cache = {}
+        if legacy_json:
+            self._migrate(legacy_json)
+        for item_id, in_stock, message_id, last_check in self._conn.execute(
+                'SELECT item_id, in_stock, message_id, last_check FROM stock_status'):
+            self._cache[item_id] = {'in_stock': bool(in_stock), 'message_id': message_id, 'last_check': last_check}
+        logger.info(f"已从 {path} 加载 {len(self._cache)} 条库存状态。")
+
+    def _migrate(self, legacy_json):
+        """数据库为空时导入旧的 JSON 状态文件。"""
+        if not os.path.exists(legacy_json):
+            return
+        if self._conn.execute('SELECT 1 FROM stock_status LIMIT 1').fetchone():
+            return
+        with open(legacy_json, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+        now = int(time.time())
+        with self._conn:
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO stock_status (item_id, in_stock, message_id, last_check, updated_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(item_id, int(bool(status.get('in_stock'))), status.get('message_id'), status.get('last_check'), now)
+                 for item_id, status in legacy.items()],
+            )
+        os.replace(legacy_json, f"{legacy_json}.migrated")
+        logger.info(f"已将 {len(legacy)} 条库存状态从 {legacy_json} 迁移到 {self.path}。")
+
+    def __contains__(self, item_id):
+        return item_id in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, item_id, default=None):
+        return self._cache.get(item_id, default)
+
+    def put(self, item_id, status):
+        """保存一个商品的状态；与当前状态相同时不写入。"""
+        status = {'in_stock': bool(status['in_stock']), 'message_id': status.get('message_id'),
+                  'last_check': status.get('last_check')}
+        if self._cache.get(item_id) == status:
+            return
+        self._conn.execute(
+            'INSERT INTO stock_status (item_id, in_stock, message_id, last_check, updated_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(item_id) DO UPDATE SET in_stock = excluded.in_stock, message_id = excluded.message_id, '
+            'last_check = excluded.last_check, updated_at = excluded.updated_at',
+            (item_id, int(status['in_stock']), status['message_id'], status['last_check'], int(time.time())),
+        )
+        self._cache[item_id] = status
+
+    def setdefault(self, item_id, status):
+        """商品还没有状态时写入初始状态；已有状态（包括其他进程写入的）时保持不变。"""
+        self._conn.execute(
+            'INSERT INTO stock_status (item_id, in_stock, message_id, last_check, updated_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(item_id) DO NOTHING',
+            (item_id, int(bool(status['in_stock'])), status.get('message_id'), status.get('last_check'), int(time.time())),
+        )
+        self.refresh(item_id)
+
+    def refresh(self, item_id):
+        """从数据库重新读取一个商品的状态（多个进程共用数据库、商品换由本进程检查时）。"""
+        row = self._conn.execute('SELECT in_stock, message_id, last_check FROM stock_status WHERE item_id = ?',
+                                 (item_id,)).fetchone()
+        if row is None:
+            self._cache.pop(item_id, None)
+        else:
+            self._cache[item_id] = {'in_stock': bool(row[0]), 'message_id': row[1], 'last_check': row[2]}
+
+    def set_message_id(self, item_id, message_id):
+        """新消息发出后记录 message_id。"""
+        status = self._cache.get(item_id)
+        if status is not None:
+            self.put(item_id, dict(status, message_id=message_id))
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""按主机自动选择抓取方式：普通 HTTP → cfscrape → Playwright。"""
+import logging
+import time
+from urllib.parse import urlsplit
+
+from checks import fetch_page_content
+from fetch_engine import ChallengeDetected, fetch_html
+from metrics import FETCH_ESCALATIONS, FETCH_TIERS
+
+logger = logging.getLogger(__name__)
+
+TIERS = ('http', 'cfscrape', 'playwright')
+
+
+class TieredFetcher:
+    """分层抓取：先用普通 HTTP 请求，遇到验证页、获取失败或标题不符时依次升级到
+    cfscrape 和 Playwright。
+
+    每个主机记住上次成功的层级，之后直接从该层开始；停留在较高层级超过
+    probe_interval 秒后，重新从最低层试探一次。需要 JavaScript 的商品直接使用 Playwright。
+    clearance（ClearanceCache）应与两个 HTTP 抓取引擎使用的相同，浏览器得到的验证 Cookie
+    之后可由较低层直接使用。提供 renderer（FastRenderer）时 Playwright 层使用快速渲染。
+    """
+
+    def __init__(self, http_engine, cfscrape_engine, browser_pool, parser_backend='auto', probe_interval=3600,
+                 clearance=None, renderer=None):
+        self.engines = {'http': http_engine, 'cfscrape': cfscrape_engine}
+        self.browser_pool = browser_pool
+        self.clearance = clearance
+        self.renderer = renderer
+        self.parser_backend = parser_backend
+        self.probe_interval = probe_interval
+        self._host_tiers = {}  # 主机 -> (层级序号, 记住的时间)
+        self.counts = dict.fromkeys(TIERS, 0)  # 各层发起的获取次数
+        self.escalations = 0
+
+    def host_tier(self, host):
+        """返回主机当前记住的层级名称，没有记录时返回 None。"""
+        entry = self._host_tiers.get(host)
+        return TIERS[entry[0]] if entry is not None else None
+
+    def _start_index(self, host):
+        entry = self._host_tiers.get(host)
+        if entry is None:
+            return 0
+        index, since = entry
+        if index > 0 and time.monotonic() - since >= self.probe_interval:
+            logger.info(f"主机 {host} 已在 {TIERS[index]} 层停留 {self.probe_interval} 秒，重新从 {TIERS[0]} 层试探。")
+            self._host_tiers[host] = (index, time.monotonic())
+            return 0
+        return index
+
+    def _remember(self, host, index):
+        entry = self._host_tiers.get(host)
+        if entry is None or entry[0] != index:
+            logger.info(f"主机 {host} 改用 {TIERS[index]} 层获取。")
+            self._host_tiers[host] = (index, time.monotonic())
+
+    async def _fetch_tier(self, tier, url, enable_javascript, emulate_human, ready_selector, out_of_stock_text,
+                          response_rule):
+        """在一层获取页面，返回 (ParsedPage, 升级原因)；成功时原因为 None。"""
+        if tier == 'playwright' and self.renderer is not None:
+            parsed_page = await self.renderer.fetch(url, enable_javascript, ready_selector, out_of_stock_text,
+                                                    emulate_human, response_rule)
+            return parsed_page, None if parsed_page is not None else '获取失败'
+        if tier == 'playwright':
+            parsed_page = await fetch_page_content(self.browser_pool, url, enable_javascript,
+                                                   parser_backend=self.parser_backend, emulate_human=emulate_human,
+                                                   clearance=self.clearance)
+            return parsed_page, None if parsed_page is not None else '获取失败'
+        try:
+            page = await fetch_html(self.engines[tier], url, detect_challenges=True)
+        except ChallengeDetected as e:
+            return None, str(e)
+        if page is None:
+            return None, '获取失败'
+        return page.parse(self.parser_backend), None
+
+    async def fetch(self, url, expected_title=None, enable_javascript=False, emulate_human=True, ready_selector=None,
+                    out_of_stock_text=None, response_rule=None):
+        """获取并解析页面，返回 ParsedPage；所有层级都失败时返回 None。"""
+        host = urlsplit(url).netloc
+        start = TIERS.index('playwright') if enable_javascript else self._start_index(host)
+        for index in range(start, len(TIERS)):
+            tier = TIERS[index]
+            self.counts[tier] += 1
+            FETCH_TIERS.inc(tier=tier)
+            parsed_page, reason = await self._fetch_tier(tier, url, enable_javascript, emulate_human, ready_selector,
+                                                         out_of_stock_text, response_rule)
+            if reason is None and expected_title and index < len(TIERS) - 1 \
+                    and expected_title.lower() not in (parsed_page.title or '').lower():
+                reason = f"标题不含 {expected_title}"
+            if reason is None:
+                if not enable_javascript:
+                    self._remember(host, index)
+                return parsed_page
+            if index < len(TIERS) - 1:
+                self.escalations += 1
+                FETCH_ESCALATIONS.inc(tier=tier)
+                logger.info(f"URL {url} 在 {tier} 层{reason}，升级到 {TIERS[index + 1]} 层。")
+        return None
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""WHMCS 产品分组页适配器：同一主机、同一分组的商品共用一次分组页（cart.php?gid=N）获取。"""
+import html
+import logging
+import re
+import time
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+from fetch_engine import ChallengeDetected, fetch_html
+from log_pipeline import SAMPLED
+from metrics import WHMCS_GROUP_LOOKUPS
+from response_rule import InterceptedPage
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 分组页中每个产品的容器（standard_cart 等模板为 <div class="product clearfix" id="productN">）
+PRODUCT_START_PATTERN = re.compile(r'<div\b[^>]*\bid="product\d+"', re.IGNORECASE)
+PID_PATTERN = re.compile(r'[?&](?:amp;)?pid=(\d+)')
+AVAILABLE_PATTERN = re.compile(r'(\d+)\s+(?:Available|in stock)', re.IGNORECASE)
+TITLE_PATTERN = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+# 商品页侧栏 "Categories" 中指向分组页的链接，当前分组的链接带 active 类
+GROUP_LINK_PATTERN = re.compile(r'<a\b[^>]*\bhref="[^"]*cart\.php\?(?:[^"]*?&(?:amp;)?)?gid=(\d+)[^"]*"[^>]*>', re.IGNORECASE)
+ACTIVE_CLASS_PATTERN = re.compile(r'\bclass="[^"]*\bactive\b', re.IGNORECASE)
+
+
+def product_id(url):
+    """返回 URL 中的 pid，没有时返回 None。"""
+    pid = parse_qs(urlsplit(url).query).get('pid', [''])[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def find_group_id(page_html):
+    """从商品页中找出商品所属分组的 gid：优先取带 active 类的分组链接，
+    页面只链接了一个分组时取该分组，无法确定时返回 None。
+    """
+    gids = set()
+    for match in GROUP_LINK_PATTERN.finditer(page_html):
+        gid = int(match.group(1))
+        if ACTIVE_CLASS_PATTERN.search(match.group(0)):
+            return gid
+        gids.add(gid)
+    return gids.pop() if len(gids) == 1 else None
+
+
+def group_page_url(check_url, gid):
+    """由商品的 cart.php?a=add&pid=N 地址得到同一主机上分组 gid 的分组页地址。"""
+    parts = urlsplit(check_url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, f"gid={gid}", ''))
+
+
+class GroupProduct:
+    """分组页中的一个产品：pid、"N Available" 中的库存数（没有时为 None）和产品区块的文本。"""
+
+    __slots__ = ('pid', 'stock_count', 'text')
+
+    def __init__(self, pid, stock_count, text):
+        self.pid = pid
+        self.stock_count = stock_count
+        self.text = text
+
+
+class GroupPage:
+    """解析后的分组页。"""
+
+    __slots__ = ('url', 'title', 'products')
+
+    def __init__(self, url, title, products):
+        self.url = url
+        self.title = title
+        self.products = products  # pid -> GroupProduct
+
+
+def parse_group_page(url, page_html):
+    """按产品容器切分分组页，提取每个产品的 pid、库存数和文本。"""
+    title_match = TITLE_PATTERN.search(page_html)
+    title = html.unescape(title_match.group(1).strip()) if title_match else None
+    starts = [match.start() for match in PRODUCT_START_PATTERN.finditer(page_html)]
+    products = {}
+    for start, end in zip(starts, starts[1:] + [len(page_html)]):
+        block = page_html[start:end]
+        pid_match = PID_PATTERN.search(block)
+        if not pid_match:
+            continue
+        text = html.unescape(TAG_PATTERN.sub(' ', block))
+        count_match = AVAILABLE_PATTERN.search(text)
+        pid = int(pid_match.group(1))
+        products.setdefault(pid, GroupProduct(pid, int(count_match.group(1)) if count_match else None, text))
+    return GroupPage(url, title, products)
+
+
+class GroupAdapter:
+    """WHMCS 分组页适配器。
+
+    cart.php?a=add&pid=N 商品按（主机，分组）归组，分组页在 max_age 秒内只获取和解析一次，
+    结果按 pid 分发给各商品。商品的分组取配置的 whmcs_gid；没有配置且 discover 为 True 时，
+    首次检查时获取一次商品页，从侧栏的分组链接中找出 gid，找不到时 discover_interval 秒后
+    再试。分组页获取失败、标题不符、找不到该 pid 或无法判断库存（分组页未显示库存数，
+    也不包含无库存文本）时返回 None，由调用方改为单独获取商品页。
+    """
+
+    def __init__(self, fetch_engine, max_age=60, discover=True, discover_interval=3600):
+        self.fetch_engine = fetch_engine
+        self.max_age = max_age
+        self.discover = discover
+        self.discover_interval = discover_interval
+        self.single_flight = SingleFlight(share_window=max_age)
+        self._group_ids = {}  # (主机, pid) -> (找到的 gid 或 None, 查找时间)
+
+    @classmethod
+    def from_config(cls, config, fetch_engine):
+        """根据配置文件中的 whmcs_groups 段创建适配器，未启用时返回 None。"""
+        options = config.get('whmcs_groups', {})
+        if not options.get('enabled', True):
+            return None
+        return cls(fetch_engine, max_age=options.get('max_age', 60), discover=options.get('discover', True),
+                   discover_interval=options.get('discover_interval', 3600))
+
+    async def _load(self, group_url):
+        try:
+            page = await fetch_html(self.fetch_engine, group_url, detect_challenges=True)
+        except ChallengeDetected as e:
+            logger.warning(f"分组页 {group_url} 返回验证页（{e}），改为单独获取商品页。")
+            return None
+        if page is None:
+            return None
+        group = parse_group_page(group_url, page.text)
+        logger.info("已获取分组页 %s，包含 %d 个产品。", group_url, len(group.products), extra=SAMPLED)
+        return group
+
+    async def _discover(self, item, pid):
+        """返回商品页中找到的分组 gid；找不到时 discover_interval 秒内不再获取商品页。"""
+        key = (urlsplit(item.check_url).netloc, pid)
+        known = self._group_ids.get(key)
+        if known is not None and (known[0] is not None or time.monotonic() - known[1] < self.discover_interval):
+            return known[0]
+        try:
+            page = await self.single_flight.do(('product', item.check_url),
+                                               lambda: fetch_html(self.fetch_engine, item.check_url, retries=1,
+                                                                  detect_challenges=True), 0)
+        except ChallengeDetected:
+            page = None
+        gid = find_group_id(page.text) if page is not None else None
+        if gid is not None:
+            logger.info(f"商品 pid={pid} 属于分组 gid={gid}，改为从分组页读取库存。")
+        else:
+            logger.info(f"未能从商品页 {item.check_url} 找到分组，{self.discover_interval} 秒后再试。")
+        self._group_ids[key] = (gid, time.monotonic())
+        return gid
+
+    async def fetch(self, item, max_age=None):
+        """返回商品在分组页中的检查结果（InterceptedPage），无法使用分组页时返回 None。
+
+        max_age 不为 None 时，只复用不超过 max_age 秒的分组页（商品当前的检查间隔）。
+        """
+        parts = urlsplit(item.check_url)
+        pid = product_id(item.check_url)
+        if pid is None or not parts.path.endswith('cart.php'):
+            return None
+        gid = item.whmcs_gid
+        if gid is None:
+            if not self.discover:
+                return None
+            gid = await self._discover(item, pid)
+            if gid is None:
+                return None
+        group_url = group_page_url(item.check_url, gid)
+        group = await self.single_flight.do(group_url, lambda: self._load(group_url), max_age)
+        if item.whmcs_gid is None and group is not None and pid not in group.products:
+            # 找到的分组不对（商品已移到其他分组），稍后重新查找
+            self._group_ids[(parts.netloc, pid)] = (None, time.monotonic())
+        value = self._stock_value(group, pid, item)
+        if value is None:
+            WHMCS_GROUP_LOOKUPS.inc(result='fallback')
+            return None
+        WHMCS_GROUP_LOOKUPS.inc(result='hit')
+        return InterceptedPage(group.title, value, group.url)
+
+    def _stock_value(self, group, pid, item):
+        """分组页中 pid 的库存数，或表示有无库存的布尔值；无法判断时返回 None。"""
+        if group is None:
+            return None
+        if item.expected_title and item.expected_title.lower() not in (group.title or '').lower():
+            logger.warning(f"分组页 {group.url} 的标题不含 {item.expected_title}，改为单独获取商品页。")
+            return None
+        product = group.products.get(pid)
+        if product is None:
+            logger.warning(f"分组页 {group.url} 中没有 pid={pid}，改为单独获取商品页。")
+            return None
+        if product.stock_count is not None:
+            return product.stock_count
+        if item.out_of_stock_text in product.text:
+            return False
+        logger.debug("分组页 %s 未显示 pid=%s 的库存，改为单独获取商品页。", group.url, pid)
+        return None
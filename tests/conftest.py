@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""monitor/ 中的模块按脚本同目录的方式互相导入，测试时把该目录加入 sys.path。"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'monitor'))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timezone
+
+import pytest
+
+from burst import BurstWindow, CronExpression, active_window, next_wakeup
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('*/15 * * * *', {0, 15, 30, 45}),
+    ('10-20/5 * * * *', {10, 15, 20}),
+    ('5,7 * * * *', {5, 7}),
+    ('50/5 * * * *', {50, 55}),
+])
+def test_minute_field(text, expected):
+    assert CronExpression(text).minutes == expected
+
+
+@pytest.mark.parametrize('text', ['* * * *', '60 * * * *', '5-1 * * * *', '*/0 * * * *', 'a * * * *'])
+def test_invalid_expression(text):
+    with pytest.raises(ValueError):
+        CronExpression(text)
+
+
+def test_sunday_is_0_and_7():
+    assert CronExpression('0 0 * * 7').weekdays == {0}
+    # 2024-06-02 是星期日
+    assert CronExpression('0 0 * * 0').next_after(datetime(2024, 6, 1, 12, 0)) == datetime(2024, 6, 2, 0, 0)
+
+
+def test_day_of_month_or_day_of_week():
+    """日和星期都指定时满足其一即可。"""
+    cron = CronExpression('0 9 15 * 1')
+    # 2024-06-03 是星期一，早于 15 日
+    assert cron.next_after(datetime(2024, 6, 1)) == datetime(2024, 6, 3, 9, 0)
+    assert cron.next_after(datetime(2024, 6, 14, 10, 0)) == datetime(2024, 6, 15, 9, 0)
+
+
+def test_day_of_month_and_any_weekday():
+    """只指定日时，星期为 * 不会放宽匹配。"""
+    cron = CronExpression('0 0 31 * *')
+    assert cron.next_after(datetime(2024, 4, 1)) == datetime(2024, 5, 31, 0, 0)
+
+
+def test_next_after_is_strict_and_skips_months():
+    cron = CronExpression('0 0 29 2 *')
+    assert cron.next_after(datetime(2024, 2, 29, 0, 0)) == datetime(2028, 2, 29, 0, 0)
+    assert CronExpression('30 12 * * *').next_after(datetime(2024, 1, 1, 12, 30, 45)) == datetime(2024, 1, 2, 12, 30)
+
+
+def test_next_start_with_timezone():
+    window = BurstWindow('0 10 * * *', 600, timezone='Asia/Shanghai')
+    assert window.next_start(utc(2024, 6, 1, 0, 0)) == utc(2024, 6, 1, 2, 0)
+    assert window.next_start(utc(2024, 6, 1, 2, 0)) == utc(2024, 6, 2, 2, 0)
+
+
+def test_next_start_across_dst_gap():
+    """夏令时开始时不存在的本地时间按切换前的偏移换算（即切换后的 03:30）。"""
+    window = BurstWindow('30 2 * * *', 600, timezone='America/New_York')
+    assert window.next_start(utc(2024, 3, 10, 5, 0)) == utc(2024, 3, 10, 7, 30)
+    assert window.next_start(utc(2024, 3, 10, 7, 30)) == utc(2024, 3, 11, 6, 30)
+
+
+def test_next_start_in_repeated_dst_hour():
+    """夏令时结束时重复的一小时内只开始一次，且不会返回已经过去的时间。"""
+    window = BurstWindow('30 1 * * *', 600, timezone='America/New_York')
+    first = utc(2024, 11, 3, 5, 30)  # 01:30 EDT
+    assert window.next_start(utc(2024, 11, 3, 5, 0)) == first
+    assert window.next_start(utc(2024, 11, 3, 6, 10)) == utc(2024, 11, 4, 6, 30)  # 第二遍的 01:10 EST
+    assert window.active_until(first + 60) == first + 600
+
+
+def test_active_window_prefers_shortest_interval():
+    slow = BurstWindow('0 10 * * *', 600, interval=10, timezone='UTC')
+    fast = BurstWindow('5 10 * * *', 600, interval=2, timezone='UTC')
+    assert active_window([slow, fast], utc(2024, 6, 1, 10, 1)) is slow
+    assert active_window([slow, fast], utc(2024, 6, 1, 10, 6)) is fast
+    assert active_window([slow, fast], utc(2024, 6, 1, 10, 20)) is None
+
+
+def test_next_wakeup_warmup_then_start():
+    window = BurstWindow('0 10 * * *', 600, warmup=60, timezone='UTC')
+    assert next_wakeup([window], utc(2024, 6, 1, 9, 0)) == utc(2024, 6, 1, 9, 59)
+    assert next_wakeup([window], utc(2024, 6, 1, 9, 59, 30)) == utc(2024, 6, 1, 10, 0)
+
+
+def test_from_config_validation():
+    with pytest.raises(ValueError):
+        BurstWindow.from_config({'cron': '0 10 * * *'})
+    with pytest.raises(ValueError):
+        BurstWindow.from_config({'cron': '0 10 * * *', 'duration': 60, 'timezone': 'Nowhere/Else'})
+    assert BurstWindow.from_config({'cron': '0 10 * * *', 'duration': 60}).interval == 2
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from cluster import Coordinator, HashRing, LeaseStore, worker_path
+
+KEYS = [f"tenant/item-{index}" for index in range(200)]
+
+
+def test_hash_ring_is_stable_and_balanced():
+    ring = HashRing(['a', 'b', 'c'])
+    owners = {key: ring.owner(key) for key in KEYS}
+    assert owners == {key: HashRing(['c', 'b', 'a']).owner(key) for key in KEYS}
+    counts = {worker: list(owners.values()).count(worker) for worker in 'abc'}
+    assert min(counts.values()) > len(KEYS) / 10
+    assert HashRing([]).owner('x') is None
+
+
+def test_hash_ring_rebalance_moves_only_removed_workers_keys():
+    before = HashRing(['a', 'b', 'c'])
+    after = HashRing(['a', 'b'])
+    for key in KEYS:
+        if before.owner(key) != 'c':
+            assert after.owner(key) == before.owner(key)
+
+
+def test_worker_path():
+    assert worker_path('/root/monitor/queue.json', 'host/1 2') == '/root/monitor/queue.host_1_2.json'
+
+
+def test_lease_expiry_and_takeover(tmp_path):
+    store = LeaseStore(str(tmp_path / 'cluster.db'))
+    assert store.acquire('a', ['k'], now=100, expires=130) == {'k'}
+    assert store.acquire('b', ['k'], now=110, expires=140) == set()  # 仍由 a 持有
+    assert store.holder('k', 120) == 'a'
+    assert store.holder('k', 130) is None
+    assert store.acquire('b', ['k'], now=131, expires=161) == {'k'}
+    assert store.acquire('a', ['k'], now=132, expires=162) == set()
+    store.close()
+
+
+def test_purge_removes_dead_workers(tmp_path):
+    store = LeaseStore(str(tmp_path / 'cluster.db'))
+    store.heartbeat('dead', 100)
+    store.heartbeat('alive', 200)
+    store.acquire('dead', ['k'], now=50, expires=100)
+    store.purge(150)
+    assert store.live_workers(150) == {'alive'}
+    assert store._conn.execute('SELECT COUNT(*) FROM leases').fetchone()[0] == 0
+    store.close()
+
+
+def test_coordinators_split_and_rebalance(tmp_path):
+    path = str(tmp_path / 'cluster.db')
+    first = Coordinator(LeaseStore(path), 'a')
+    second = Coordinator(LeaseStore(path), 'b')
+    first.tick(KEYS)
+    assert len(first) == len(KEYS)
+    second.tick(KEYS)  # b 加入，但 a 的租约仍有效
+    first.tick(KEYS)  # a 按新的哈希环交出 b 的商品
+    second.tick(KEYS)
+    assert len(first) + len(second) == len(KEYS)
+    assert 0 < len(second) < len(KEYS)
+    assert all(first.confirm(key) != second.confirm(key) for key in KEYS)
+    second.leave()
+    acquired, lost = first.tick(KEYS)
+    assert len(first) == len(KEYS) and not lost and len(acquired) > 0
+    first.leave()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import copy
+
+import pytest
+
+from config_model import ConfigError, compile_config, diff_configs
+
+
+def raw_config():
+    stock = {'title': 'A', 'check_url': 'https://h/a', 'buy_url': 'https://h/buy/a', 'price': '$1',
+             'hardware_info': '1C'}
+    return {
+        'telegram_token': 't',
+        'telegram_chat_id': 'c',
+        'check_interval': 300,
+        'merchants': [{
+            'name': 'M', 'tag': 'tag', 'out_of_stock_text': 'Out of Stock',
+            'stock_urls': [stock, dict(stock, title='B', check_url='https://h/b')],
+        }],
+    }
+
+
+def test_first_load_adds_everything():
+    diff = diff_configs(None, compile_config(raw_config()))
+    assert sorted(item.item_id for item in diff.added) == ['A', 'B']
+    assert not diff.removed and not diff.changed
+
+
+def test_unchanged_config_has_empty_diff():
+    assert not diff_configs(compile_config(raw_config()), compile_config(raw_config()))
+
+
+def test_added_removed_and_changed_items():
+    old = compile_config(raw_config())
+    raw = raw_config()
+    stocks = raw['merchants'][0]['stock_urls']
+    stocks[0]['price'] = '$2'
+    stocks[1] = dict(stocks[1], title='C', check_url='https://h/c')
+    diff = diff_configs(old, compile_config(raw))
+    assert [item.item_id for item in diff.added] == ['C']
+    assert diff.removed == ['B']
+    assert [item.item_id for item in diff.changed] == ['A']
+
+
+def test_merchant_level_change_marks_items_changed():
+    old = compile_config(raw_config())
+    raw = raw_config()
+    raw['merchants'][0]['out_of_stock_text'] = 'Sold out'
+    raw['merchants'][0]['check_interval'] = 60
+    diff = diff_configs(old, compile_config(raw))
+    assert sorted(item.item_id for item in diff.changed) == ['A', 'B']
+    assert all(item.check_interval == 60 for item in diff.changed)
+
+
+def test_disabled_merchant_removes_items():
+    old = compile_config(raw_config())
+    raw = raw_config()
+    raw['merchants'][0]['enabled'] = False
+    assert sorted(diff_configs(old, compile_config(raw)).removed) == ['A', 'B']
+
+
+def test_duplicate_ids_and_missing_fields_are_rejected():
+    raw = raw_config()
+    raw['merchants'][0]['stock_urls'][1]['title'] = 'A'
+    with pytest.raises(ConfigError):
+        compile_config(raw)
+    raw = copy.deepcopy(raw_config())
+    del raw['merchants'][0]['stock_urls'][0]['price']
+    with pytest.raises(ConfigError):
+        compile_config(raw)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from events import EventBus
+
+
+def drain(subscription):
+    return asyncio.run(subscription.get())
+
+
+def publish(bus, count, event_type='check', merchant='M'):
+    return [bus.publish(event_type, merchant=merchant, item=str(index)) for index in range(count)]
+
+
+def test_replay_last_n_matching_events():
+    bus = EventBus(replay_size=10, max_pending=5)
+    publish(bus, 3, merchant='A')
+    publish(bus, 2, merchant='B')
+    events = drain(bus.subscribe(merchants=['A'], replay=2))
+    assert [event['merchant'] for event in events] == ['A', 'A']
+    assert [event['item'] for event in events] == ['1', '2']
+
+
+def test_resume_from_last_event_id():
+    bus = EventBus(replay_size=10, max_pending=5)
+    published = publish(bus, 4)
+    events = drain(bus.subscribe(last_event_id=published[1]['id']))
+    assert [event['id'] for event in events] == [published[2]['id'], published[3]['id']]
+
+
+def test_gap_sends_reset_then_buffer():
+    bus = EventBus(replay_size=5, max_pending=5)
+    published = publish(bus, 10)
+    events = drain(bus.subscribe(last_event_id=published[0]['id']))
+    assert events[0]['type'] == 'reset' and events[0]['reason'] == 'gap'
+    assert 'id' not in events[0]
+    assert events[0]['oldest_event_id'] == published[5]['id']
+    assert [event['id'] for event in events[1:]] == [event['id'] for event in published[5:]]
+
+
+def test_transitions_survive_check_floods():
+    """只订阅 transition 时，大量 check 事件不会造成缺口。"""
+    bus = EventBus(replay_size=5, max_pending=5)
+    first = bus.publish('transition', merchant='M', item='x')
+    second = bus.publish('transition', merchant='M', item='x')
+    publish(bus, 20)
+    events = drain(bus.subscribe(types=['transition'], last_event_id=first['id']))
+    assert [event['id'] for event in events] == [second['id']]
+
+
+def test_restart_and_invalid_ids_reset():
+    bus = EventBus()
+    publish(bus, 1)
+    assert drain(bus.subscribe(last_event_id='1-5'))[0]['reason'] == 'restart'
+    assert drain(bus.subscribe(last_event_id=f"{bus._epoch}-x"))[0]['reason'] == 'invalid'
+
+
+def test_slow_subscriber_drops_checks_then_overflows():
+    bus = EventBus(replay_size=10, max_pending=3)
+    subscription = bus.subscribe()
+    publish(bus, 5)
+    assert [event['item'] for event in drain(subscription)] == ['2', '3', '4']
+    for _ in range(4):
+        bus.publish('transition', merchant='M', item='t')
+    assert subscription.overflowed and drain(subscription) is None
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+import host_health
+from host_health import CLOSED, HALF_OPEN, OPEN, HostHealthTracker, backoff_delay
+
+
+@pytest.fixture
+def tracker():
+    return HostHealthTracker(failure_threshold=3, base_backoff=60, max_backoff=200, degraded_concurrency=1)
+
+
+def fail(tracker, host, times=1):
+    for _ in range(times):
+        assert tracker.acquire(host)
+        tracker.release(host, False, 1.0)
+
+
+def test_opens_after_consecutive_failures(tracker):
+    fail(tracker, 'h', 2)
+    assert tracker.get('h').state == CLOSED
+    fail(tracker, 'h')
+    assert tracker.get('h').state == OPEN
+    assert not tracker.acquire('h')
+
+
+def test_half_open_probe_recovers(tracker):
+    fail(tracker, 'h', 3)
+    tracker.get('h').open_until = 0  # 退避结束
+    assert tracker.acquire('h')
+    assert tracker.get('h').state == HALF_OPEN
+    assert not tracker.acquire('h')  # 只放行一个试探检查
+    tracker.release('h', True, 1.0)
+    assert tracker.get('h').state == CLOSED and tracker.get('h').opens == 0
+
+
+def test_failed_probe_doubles_backoff(tracker, monkeypatch):
+    monkeypatch.setattr(host_health.random, 'uniform', lambda low, high: 1.0)
+    monkeypatch.setattr(host_health.time, 'monotonic', lambda: 1000.0)
+    fail(tracker, 'h', 3)
+    assert tracker.get('h').open_until == 1060.0
+    for expected in (1120.0, 1200.0):  # 翻倍，不超过 max_backoff
+        tracker.get('h').open_until = 0
+        fail(tracker, 'h')
+        assert tracker.get('h').state == OPEN and tracker.get('h').open_until == expected
+
+
+def test_degraded_limits_concurrency(tracker):
+    for _ in range(3):
+        assert tracker.acquire('h')
+        tracker.release('h', True, 40.0)  # 超过 HTTP 检查的 slow_seconds
+    assert tracker.unhealthy() == {'h': 'degraded'}
+    assert tracker.acquire('h')
+    assert not tracker.acquire('h')
+
+
+def test_browser_checks_use_their_own_threshold(tracker):
+    for _ in range(3):
+        assert tracker.acquire('h')
+        tracker.release('h', True, 40.0, tracker.browser_slow_seconds)
+    assert tracker.unhealthy() == {}
+
+
+def test_call_records_none_and_exceptions_as_failures(tracker):
+    async def none():
+        return None
+
+    async def boom():
+        raise RuntimeError('boom')
+
+    async def main():
+        assert await tracker.call('https://h/a', none) is None
+        with pytest.raises(RuntimeError):
+            await tracker.call('https://h/a', boom)
+        await tracker.call('https://h/a', none, browser=True)
+    asyncio.run(main())
+    assert tracker.get('h').state == OPEN and tracker.get('h').in_flight == 0
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert backoff_delay(attempt, base=2, cap=60) <= 90
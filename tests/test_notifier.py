@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+pytest.importorskip('telegram')
+
+import notifier
+from notifier import Notifier, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(notifier.time, 'monotonic', fake)
+    return fake
+
+
+def test_token_bucket_refill(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now += 0.25
+    assert bucket.delay() == pytest.approx(0.25)
+    clock.now += 10
+    assert bucket.delay() == 0.0
+    assert bucket.tokens == 2  # 不超过 capacity
+
+
+def make_notifier(tmp_path, **options):
+    return Notifier('123456:TEST', str(tmp_path / 'queue.json'), **options)
+
+
+def queue(instance, kind, key, chat_id):
+    job = {'kind': kind, 'key': key, 'chat_id': chat_id, 'text': key, 'detected_at': None, 'attempts': 0}
+    instance._put(job)
+    return job
+
+
+def test_next_job_priority_within_chat(clock, tmp_path):
+    instance = make_notifier(tmp_path)
+    edit = queue(instance, 'edit', 'a', 1)
+    send = queue(instance, 'send', 'b', 1)
+    assert instance._next_job() == (send, 0)
+    assert instance._next_job() == (edit, 0)
+    assert instance._next_job() == (None, None)
+
+
+def test_next_job_skips_rate_limited_chat(clock, tmp_path):
+    """限速中的聊天不阻塞其他聊天。"""
+    instance = make_notifier(tmp_path, chat_rate=1, chat_burst=1)
+    busy = queue(instance, 'send', 'a', 1)
+    queue(instance, 'send', 'b', 1)
+    other = queue(instance, 'send', 'c', 2)
+    assert instance._next_job() == (busy, 0)
+    instance._chat_bucket(1).take()
+    assert instance._next_job() == (other, 0)
+    instance._chat_bucket(2).take()
+    job, delay = instance._next_job()
+    assert job is None and delay == pytest.approx(1.0)
+
+
+def test_next_job_waits_for_global_bucket_and_retry_after(clock, tmp_path):
+    instance = make_notifier(tmp_path, global_rate=1)
+    queue(instance, 'send', 'a', 1)
+    instance._global_bucket.take()
+    assert instance._next_job() == (None, pytest.approx(1.0))
+    clock.now += 1
+    instance._paused_until = clock.now + 5
+    assert instance._next_job() == (None, pytest.approx(5.0))
+    clock.now += 5
+    assert instance._next_job()[0]['key'] == 'a'
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from singleflight import SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def counting_factory(calls, value='page', delay=0.01):
+    async def factory():
+        calls.append(value)
+        await asyncio.sleep(delay)
+        return value
+    return factory
+
+
+def test_concurrent_calls_share_one_execution():
+    async def main():
+        calls = []
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do('k', counting_factory(calls)) for _ in range(5)))
+        return calls, results, flight
+    calls, results, flight = run(main())
+    assert calls == ['page'] and results == ['page'] * 5
+    assert flight.started == 1 and flight.shared == 4
+
+
+def test_share_window_and_max_age():
+    async def main():
+        calls = []
+        flight = SingleFlight(share_window=0.2)
+        await flight.do('k', counting_factory(calls))
+        await flight.do('k', counting_factory(calls))  # 在共享窗口内，复用
+        await flight.do('k', counting_factory(calls), max_age=0)  # max_age 为 0 时只合并进行中的请求
+        await asyncio.sleep(0.25)
+        await flight.do('k', counting_factory(calls))  # 窗口已过
+        return calls
+    assert len(run(main())) == 3
+
+
+def test_without_share_window_finished_results_are_not_reused():
+    async def main():
+        calls = []
+        flight = SingleFlight()
+        await flight.do('k', counting_factory(calls))
+        await flight.do('k', counting_factory(calls))
+        return calls
+    assert len(run(main())) == 2
+
+
+def test_failed_results_are_not_shared():
+    async def main():
+        flight = SingleFlight(share_window=10)
+        attempts = []
+
+        async def failing():
+            attempts.append(1)
+            raise RuntimeError('boom')
+
+        for _ in range(2):
+            try:
+                await flight.do('k', failing)
+            except RuntimeError:
+                pass
+        return attempts
+    assert len(run(main())) == 2
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    async def main():
+        calls = []
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.do('k', counting_factory(calls, delay=0.05)))
+        second = asyncio.ensure_future(flight.do('k', counting_factory(calls, delay=0.05)))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, calls
+    assert run(main()) == ('page', ['page'])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+from state_store import StateStore
+
+
+def updated_at(store, item_id):
+    return store._conn.execute('SELECT updated_at FROM stock_status WHERE item_id = ?', (item_id,)).fetchone()[0]
+
+
+def test_put_only_writes_changes(tmp_path):
+    store = StateStore(str(tmp_path / 'state.db'))
+    store.put('a', {'in_stock': True, 'message_id': 1})
+    store._conn.execute("UPDATE stock_status SET updated_at = 0 WHERE item_id = 'a'")
+    store.put('a', {'in_stock': 1, 'message_id': 1})  # 与当前状态相同
+    assert updated_at(store, 'a') == 0
+    store.put('a', {'in_stock': False, 'message_id': 1})
+    assert updated_at(store, 'a') > 0
+    assert store.get('a') == {'in_stock': False, 'message_id': 1, 'last_check': None}
+    store.close()
+
+
+def test_state_survives_reopen(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = StateStore(path)
+    store.put('a', {'in_stock': True, 'message_id': None})
+    store.set_message_id('a', 42)
+    store.set_message_id('missing', 7)  # 没有状态的商品不写入
+    store.close()
+    store = StateStore(path)
+    assert store.get('a') == {'in_stock': True, 'message_id': 42, 'last_check': None}
+    assert 'missing' not in store and len(store) == 1
+    store.close()
+
+
+def test_setdefault_keeps_existing_state(tmp_path):
+    store = StateStore(str(tmp_path / 'state.db'))
+    store.put('a', {'in_stock': False, 'message_id': 3})
+    store.setdefault('a', {'in_stock': True})
+    store.setdefault('b', {'in_stock': True})
+    assert store.get('a')['in_stock'] is False
+    assert store.get('b')['in_stock'] is True
+    store.close()
+
+
+def test_migrates_legacy_json(tmp_path):
+    legacy = tmp_path / 'stock_status.json'
+    legacy.write_text(json.dumps({'a': {'in_stock': True, 'message_id': 5}, 'b': {'in_stock': False}}), encoding='utf-8')
+    store = StateStore(str(tmp_path / 'state.db'), legacy_json=str(legacy))
+    assert store.get('a') == {'in_stock': True, 'message_id': 5, 'last_check': None}
+    assert store.get('b')['in_stock'] is False
+    assert not legacy.exists() and os.path.exists(f"{legacy}.migrated")
+    store.close()
+
+
+def test_no_migration_into_non_empty_database(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = StateStore(path)
+    store.put('a', {'in_stock': False})
+    store.close()
+    legacy = tmp_path / 'stock_status.json'
+    legacy.write_text(json.dumps({'a': {'in_stock': True}, 'b': {'in_stock': True}}), encoding='utf-8')
+    store = StateStore(path, legacy_json=str(legacy))
+    assert store.get('a')['in_stock'] is False and 'b' not in store
+    assert legacy.exists()
+    store.close()